@@ -1,105 +1,220 @@
-import os, psycopg2
-from psycopg2.extras import RealDictCursor
+import os
 from datetime import datetime
 from dotenv import load_dotenv
+from .db_pool import create_pool
+from .metrics import timed_query
 
 load_dotenv()
 
 
+DB_PARAMS = dict(
+    host=os.getenv("DB_HOST"),
+    dbname=os.getenv("DB_NAME"),
+    user=os.getenv("DB_USER"),
+    password=os.getenv("DB_PASSWORD"),
+    port=os.getenv("DB_PORT"),
+)
+
+pool = create_pool(DB_PARAMS, name="bonus")
+
+# Строк за один FETCH серверного курсора при выгрузке
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+
 def get_db_connection():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        database=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        port=os.getenv("DB_PORT"),
-    )
+    # Соединение возвращается в пул при выходе из async with; выход без
+    # ошибки фиксирует транзакцию, исключение - откатывает
+    return pool.connection()
 
 
-def get_privilege_with_history(username: str):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+@timed_query
+async def get_privilege_version(username: str) -> str | None:
+    """Версия строки привилегии. Каждая операция с бонусами меняет баланс,
+    поэтому версия меняется и при любом изменении истории"""
+    async with get_db_connection() as conn:
+        cur = await conn.execute(
+            "SELECT xmin::text AS version FROM privilege WHERE username = %s", (username,)
+        )
+        row = await cur.fetchone()
+    return row["version"] if row else None
 
-    cur.execute(
-        "SELECT id, balance, status FROM privilege WHERE username = %s", (username,)
-    )
-    privilege = cur.fetchone()
-
-    if not privilege:
-        cur.close()
-        conn.close()
-        return {"balance": 0, "status": "BRONZE", "history": []}
-
-    cur.execute(
-        """
-        SELECT datetime as "date", ticket_uid as "ticketUid", 
-               balance_diff as "balanceDiff", operation_type as "operationType"
-        FROM privilege_history WHERE privilege_id = %s
-    """,
-        (privilege["id"],),
-    )
-    history = cur.fetchall()
 
-    cur.close()
-    conn.close()
+@timed_query
+async def get_privilege_with_history(username: str):
+    async with get_db_connection() as conn:
+        cur = await conn.execute(
+            "SELECT id, balance, status, xmin::text AS version FROM privilege WHERE username = %s",
+            (username,),
+        )
+        privilege = await cur.fetchone()
+
+        if not privilege:
+            return {"balance": 0, "status": "BRONZE", "history": [], "version": None}
+
+        cur = await conn.execute(
+            """
+            SELECT datetime as "date", ticket_uid as "ticketUid",
+                   balance_diff as "balanceDiff", operation_type as "operationType"
+            FROM privilege_history WHERE privilege_id = %s
+        """,
+            (privilege["id"],),
+        )
+        history = await cur.fetchall()
+
     return {
         "balance": privilege["balance"],
         "status": privilege["status"],
         "history": history,
+        "version": privilege["version"],
     }
 
 
-def process_bonus_operation(
-    username: str, ticket_uid: str, price: int, paid_from_balance: bool
-):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+@timed_query
+async def get_privilege_balance(username: str):
+    """Баланс и статус без истории операций"""
+    async with get_db_connection() as conn:
+        cur = await conn.execute(
+            "SELECT balance, status FROM privilege WHERE username = %s", (username,)
+        )
+        privilege = await cur.fetchone()
+    return privilege or {"balance": 0, "status": "BRONZE"}
 
-    cur.execute(
-        "SELECT id, balance, status FROM privilege WHERE username = %s", (username,)
-    )
-    priv = cur.fetchone()
 
-    if priv is None:
-        cur.execute(
-            "INSERT INTO privilege (username, status, balance) VALUES (%s, 'BRONZE', 0) RETURNING id, balance, status",
-            (username,),
+@timed_query
+async def get_privilege_history(
+    username: str,
+    limit: int,
+    after: int | None = None,
+):
+    """Операции пользователя в порядке записи. Страница - keyset по id:
+    after - id последней операции предыдущей страницы. Операции одного
+    пользователя пишутся под блокировкой его строки privilege, поэтому их
+    id растут в порядке фиксации транзакций - строка не может появиться
+    позади курсора. По datetime такой гарантии нет: время берется до
+    блокировки. В каждой строке есть служебное поле id для построения курсора."""
+    conditions = ["p.username = %s"]
+    params = [username]
+    if after is not None:
+        conditions.append("h.id > %s")
+        params.append(after)
+    params.append(limit)
+
+    async with get_db_connection() as conn:
+        cur = await conn.execute(
+            f"""
+            SELECT h.id, h.datetime as "date", h.ticket_uid as "ticketUid",
+                   h.balance_diff as "balanceDiff", h.operation_type as "operationType"
+            FROM privilege_history h JOIN privilege p ON p.id = h.privilege_id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY h.id
+            LIMIT %s
+        """,
+            params,
         )
-        priv = cur.fetchone()
-
-    paid_by_bonuses = 0
-    balance_diff = 0
-    op_type = ""
-
-    if paid_from_balance:
-        paid_by_bonuses = min(priv["balance"], price)
-        balance_diff = -paid_by_bonuses
-        op_type = "DEBIT_THE_ACCOUNT"
-    else:
-        balance_diff = int(price * 0.1)
-        paid_by_bonuses = 0
-        op_type = "FILL_IN_BALANCE"
-
-    cur.execute(
-        "UPDATE privilege SET balance = balance + %s WHERE id = %s RETURNING balance, status",
-        (balance_diff, priv["id"]),
-    )
-    updated_priv = cur.fetchone()
+        return await cur.fetchall()
+
+
+async def stream_privilege_history(username: str, batch_size: int = EXPORT_BATCH_SIZE):
+    """Вся история пользователя пачками по batch_size строк в том же порядке,
+    что и страницы get_privilege_history. Серверный курсор держит результат
+    в Postgres: память сервиса не зависит от длины истории."""
+    async with get_db_connection() as conn:
+        async with conn.cursor(name="privilege_history_export") as cur:
+            await cur.execute(
+                """
+                SELECT h.datetime as "date", h.ticket_uid as "ticketUid",
+                       h.balance_diff as "balanceDiff", h.operation_type as "operationType"
+                FROM privilege_history h JOIN privilege p ON p.id = h.privilege_id
+                WHERE p.username = %s
+                ORDER BY h.id
+            """,
+                (username,),
+            )
+            while batch := await cur.fetchmany(batch_size):
+                yield batch
+
 
-    cur.execute(
-        """
+# Начисление или списание и запись в историю - одна инструкция. Строка
+# привилегии к этому моменту заблокирована (LOCK_PRIVILEGE), поэтому
+# подзапрос diff видит тот же баланс, который изменит UPDATE, и операцию
+# по этому билету, если ее уже выполнил предыдущий запрос
+APPLY_BONUS = """
+    WITH diff AS (
+        SELECT id,
+               CASE WHEN %(debit)s THEN -LEAST(balance, %(price)s) ELSE %(fill)s END AS balance_diff
+        FROM privilege WHERE username = %(username)s
+          AND NOT EXISTS (SELECT 1 FROM privilege_history WHERE ticket_uid = %(ticket_uid)s)
+    ), updated AS (
+        UPDATE privilege p SET balance = p.balance + diff.balance_diff
+        FROM diff WHERE p.id = diff.id
+        RETURNING p.id, p.balance, p.status, diff.balance_diff
+    ), history AS (
         INSERT INTO privilege_history (privilege_id, ticket_uid, datetime, balance_diff, operation_type)
-        VALUES (%s, %s, %s, %s, %s)
-    """,
-        (priv["id"], ticket_uid, datetime.now(), abs(balance_diff), op_type),
+        SELECT id, %(ticket_uid)s, %(now)s, abs(balance_diff), %(operation)s FROM updated
     )
+    SELECT balance, status, balance_diff FROM updated
+"""
 
-    conn.commit()
-    cur.close()
-    conn.close()
+CREATE_PRIVILEGE = """
+    INSERT INTO privilege (username, status, balance) VALUES (%s, 'BRONZE', 0)
+    ON CONFLICT (username) DO NOTHING
+"""
 
-    return {
-        "paidByBonuses": paid_by_bonuses,
+LOCK_PRIVILEGE = "SELECT id FROM privilege WHERE username = %s FOR UPDATE"
+
+# Результат уже выполненной операции по билету; rolled_back - операция
+# после этого откачена, и повторять ее результат нельзя
+STORED_OPERATION = """
+    SELECT p.balance, p.status,
+           CASE h.operation_type WHEN 'DEBIT_THE_ACCOUNT' THEN -h.balance_diff
+                                 ELSE h.balance_diff END AS balance_diff,
+           h.operation_type = 'DEBIT_THE_ACCOUNT' AS debit,
+           r.ticket_uid IS NOT NULL AS rolled_back
+    FROM privilege_history h JOIN privilege p ON p.id = h.privilege_id
+    LEFT JOIN privilege_rollback r ON r.ticket_uid = h.ticket_uid
+    WHERE h.ticket_uid = %s
+"""
+
+
+@timed_query
+async def process_bonus_operation(
+    username: str, ticket_uid: str, price: int, paid_from_balance: bool
+):
+    """(True, результат) - операция выполнена этим вызовом, (False,
+    результат) - повтор по тому же билету, результат сохраненный, (False,
+    None) - операция по билету уже откачена"""
+    async with get_db_connection() as conn:
+        # Три инструкции уходят одним пакетом, без ожидания ответа на каждую;
+        # блокировка строки держится до конца транзакции, так что параллельные
+        # покупки одного пользователя выполняются по очереди
+        async with conn.pipeline():
+            await conn.execute(CREATE_PRIVILEGE, (username,))
+            await conn.execute(LOCK_PRIVILEGE, (username,))
+            cur = await conn.execute(
+                APPLY_BONUS,
+                {
+                    "username": username,
+                    "ticket_uid": ticket_uid,
+                    "price": price,
+                    "debit": paid_from_balance,
+                    "fill": int(price * 0.1),
+                    "now": datetime.now(),
+                    "operation": "DEBIT_THE_ACCOUNT" if paid_from_balance else "FILL_IN_BALANCE",
+                },
+            )
+        updated_priv = await cur.fetchone()
+        applied = updated_priv is not None
+        if not applied:
+            # Повтор запроса: отвечаем сохраненным результатом
+            cur = await conn.execute(STORED_OPERATION, (ticket_uid,))
+            updated_priv = await cur.fetchone()
+            if updated_priv["rolled_back"]:
+                return False, None
+            paid_from_balance = updated_priv["debit"]
+
+    balance_diff = updated_priv["balance_diff"]
+    return applied, {
+        "paidByBonuses": -balance_diff if paid_from_balance else 0,
         "balanceDiff": balance_diff,
         "privilege": {
             "balance": updated_priv["balance"],
@@ -108,29 +223,48 @@ def process_bonus_operation(
     }
 
 
-def process_rollback_operation(
+@timed_query
+async def process_rollback_operation(
     username: str, ticket_uid: str, price: int
 ):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    cur.execute("SELECT operation_type FROM privilege_history WHERE ticket_uid = %s", (ticket_uid,))
-    t = cur.fetchone()
-    if not t:
-        return
-    paid_from_balance = t["operation_type"] == "DEBIT_THE_ACCOUNT"
-
-    if paid_from_balance:
-        cost = price
-    else:
-        cur.execute("SELECT balance FROM privilege WHERE username = %s", (username,))
-        balance = cur.fetchone()
-        if not balance:
+    async with get_db_connection() as conn:
+        cur = await conn.execute(
+            "SELECT operation_type, balance_diff FROM privilege_history WHERE ticket_uid = %s",
+            (ticket_uid,),
+        )
+        t = await cur.fetchone()
+        if not t:
             return
-        cost = -min(balance["balance"], price // 10)
+        paid_from_balance = t["operation_type"] == "DEBIT_THE_ACCOUNT"
 
-    cur.execute("UPDATE privilege SET balance = balance + %s WHERE username = %s", (cost, username))
+        # Блокировка строки: параллельный откат другого билета не должен
+        # посчитать списание от устаревшего баланса
+        cur = await conn.execute(
+            "SELECT id, balance FROM privilege WHERE username = %s FOR UPDATE", (username,)
+        )
+        privilege = await cur.fetchone()
+        if not privilege:
+            return
+
+        # Возвращается ровно то, что изменила операция покупки: при частичной
+        # оплате бонусами списано меньше цены билета
+        if paid_from_balance:
+            cost = t["balance_diff"]
+        else:
+            cost = -min(privilege["balance"], t["balance_diff"])
+
+        # Откат записывается в той же транзакции, что и изменение баланса;
+        # повтор (например, из очереди gateway) упирается в ticket_uid
+        cur = await conn.execute(
+            """
+            INSERT INTO privilege_rollback (ticket_uid, privilege_id, balance_diff, datetime)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (ticket_uid) DO NOTHING
+            RETURNING ticket_uid
+            """,
+            (ticket_uid, privilege["id"], cost, datetime.now()),
+        )
+        if await cur.fetchone() is None:
+            return
 
-    conn.commit()
-    cur.close()
-    conn.close()
+        await conn.execute("UPDATE privilege SET balance = balance + %s WHERE id = %s", (cost, privilege["id"]))
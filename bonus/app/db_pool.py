@@ -0,0 +1,65 @@
+import os
+
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def pool_settings_from_env():
+    return {
+        "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+        "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+        "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+        "timeout": float(os.getenv("DB_POOL_TIMEOUT", "5")),
+        "health_check": _env_bool("DB_POOL_HEALTH_CHECK", True),
+        # 0 - готовить (PREPARE) запрос при первом же выполнении на соединении
+        "prepare_threshold": int(os.getenv("DB_PREPARE_THRESHOLD", "0")),
+    }
+
+
+def create_pool(connect_params: dict, name: str) -> AsyncConnectionPool:
+    """Асинхронный пул psycopg 3; открывается и закрывается в lifespan сервиса.
+
+    Строки возвращаются как dict, повторяющиеся запросы выполняются
+    как prepared statements на стороне сервера."""
+    settings = pool_settings_from_env()
+    return AsyncConnectionPool(
+        kwargs={
+            **{k: v for k, v in connect_params.items() if v is not None},
+            "row_factory": dict_row,
+            "prepare_threshold": settings["prepare_threshold"],
+        },
+        min_size=settings["min_size"],
+        max_size=settings["max_size"],
+        max_lifetime=settings["max_lifetime"],
+        timeout=settings["timeout"],
+        check=AsyncConnectionPool.check_connection if settings["health_check"] else None,
+        name=name,
+        open=False,
+    )
+
+
+def pool_stats(pool: AsyncConnectionPool) -> dict:
+    stats = pool.get_stats()
+    checkouts = stats.get("requests_num", 0)
+    wait_total = stats.get("requests_wait_ms", 0) / 1000
+    return {
+        "checkouts": checkouts,
+        "checkout_timeouts": stats.get("requests_errors", 0),
+        "waiting": stats.get("requests_waiting", 0),
+        "wait_time_total": wait_total,
+        "wait_time_avg": wait_total / checkouts if checkouts else 0.0,
+        "connections_created": stats.get("connections_num", 0),
+        # Соединения, отбракованные проверкой при выдаче или потерянные
+        "connections_lost": stats.get("connections_lost", 0),
+        "returns_bad": stats.get("returns_bad", 0),
+        "in_use": stats.get("pool_size", 0) - stats.get("pool_available", 0),
+        "idle": stats.get("pool_available", 0),
+        "max_size": stats.get("pool_max", pool.max_size),
+    }
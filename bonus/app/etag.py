@@ -0,0 +1,23 @@
+import hashlib
+
+from fastapi import Response
+
+
+def make_etag(*parts) -> str:
+    """Сильный ETag из версий строк (xmin) и всего, от чего зависит тело ответа"""
+    digest = hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=12)
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Проверка If-None-Match: слабое сравнение, как требует RFC 9110"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in tags
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
@@ -1,29 +1,132 @@
-from fastapi import FastAPI, Header, HTTPException
-from .database import get_privilege_with_history, process_bonus_operation, process_rollback_operation
-from .schemas import PrivilegeInfoResponse, BonusOperationRequest, BonusOperationResponse, RollbackRequest
+from contextlib import asynccontextmanager
+from typing import List
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from .database import (
+    get_privilege_balance,
+    get_privilege_history,
+    get_privilege_version,
+    get_privilege_with_history,
+    process_bonus_operation,
+    process_rollback_operation,
+    pool,
+    stream_privilege_history,
+)
+from .db_pool import pool_stats
+from .etag import etag_matches, make_etag, not_modified
+from .metrics import MetricsMiddleware, metrics_response, register_pool
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+from .responses import NDJSON_MEDIA_TYPE, FastJSONResponse, ndjson_stream
+from .schemas import (
+    BalanceHistoryDTO,
+    BonusOperationRequest,
+    BonusOperationResponse,
+    PrivilegeBalanceResponse,
+    PrivilegeInfoResponse,
+    RollbackRequest,
+)
 
-app = FastAPI(title="Bonus Service")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # wait=False: сервис стартует, даже если БД еще поднимается
+    await pool.open(wait=False)
+    yield
+    await pool.close()
+
+app = FastAPI(
+    title="Bonus Service", lifespan=lifespan, default_response_class=FastJSONResponse
+)
+app.add_middleware(MetricsMiddleware)
+register_pool(pool, pool_stats)
 
 @app.get("/manage/health")
 async def manage_health():
     return {}
 
+@app.get("/manage/pool")
+async def manage_pool():
+    return pool_stats(pool)
+
+@app.get("/manage/metrics")
+async def manage_metrics():
+    return metrics_response()
+
 @app.get("/privilege", response_model=PrivilegeInfoResponse)
-async def get_privilege(username: str):
-    data = get_privilege_with_history(username)
+async def get_privilege(
+    username: str, if_none_match: str | None = Header(None)
+):
+    # Ревалидация читает только версию строки, без истории операций
+    if if_none_match:
+        etag = make_etag(username, await get_privilege_version(username))
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+    data = await get_privilege_with_history(username)
     if not data:
         raise HTTPException(status_code=404, detail="Privilege not found")
-    return data
+    # История сериализуется напрямую из строк БД, без проверки response_model
+    return FastJSONResponse(
+        {"balance": data["balance"], "status": data["status"], "history": data["history"]},
+        headers={"ETag": make_etag(username, data["version"])},
+    )
+
+@app.get("/privilege/balance", response_model=PrivilegeBalanceResponse)
+async def get_balance(username: str):
+    return FastJSONResponse(await get_privilege_balance(username))
+
+# Токен продолжения отдается в заголовке, чтобы тело осталось списком
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+@app.get("/privilege/history", response_model=List[BalanceHistoryDTO])
+async def get_history(
+    username: str,
+    limit: int = Query(100, ge=1, le=500),
+    since: str | None = Query(None, description="Значение X-Next-Cursor предыдущего ответа"),
+):
+    """Страница истории в порядке записи операций. X-Next-Cursor указывает на
+    последнюю отданную операцию: с ним же клиент приходит и за следующей
+    страницей, и позже за новыми операциями. Пустой ответ - история
+    синхронизирована, курсор не меняется."""
+    try:
+        after = decode_cursor(since) if since else None
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    history = await get_privilege_history(username, limit, after)
+
+    headers = {}
+    if history:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(history[-1]["id"])
+    elif since:
+        headers[NEXT_CURSOR_HEADER] = since
+    for operation in history:
+        operation.pop("id", None)
+    return FastJSONResponse(history, headers=headers)
+
+@app.get("/privilege/history/export")
+async def export_history(username: str):
+    """Вся история в NDJSON, по операции на строку, в порядке записи.
+    Строки читаются из серверного курсора пачками и сразу уходят клиенту"""
+    return StreamingResponse(
+        ndjson_stream(stream_privilege_history(username)),
+        media_type=NDJSON_MEDIA_TYPE,
+    )
 
-@app.post("/privilege/calculate", response_model=BonusOperationResponse)
+@app.post("/privilege/calculate", response_model=BonusOperationResponse, status_code=201)
 async def calculate_bonus(request: BonusOperationRequest):
-    return process_bonus_operation(
+    """201 - операция выполнена этим запросом, 200 - повтор по тому же
+    билету: вызывающий по коду отличает свою операцию от выполненной раньше.
+    410 - операция по билету откачена, повторить ее нельзя"""
+    applied, result = await process_bonus_operation(
         request.username, str(request.ticketUid), request.price, request.paidFromBalance
     )
+    if result is None:
+        raise HTTPException(status_code=410, detail="Operation for this ticket is rolled back")
+    return FastJSONResponse(result, status_code=201 if applied else 200)
 
 
 @app.post("/privilege/rollback/{ticketUID}")
 async def calculate_bonus(request: RollbackRequest, ticketUID: str):
-    return process_rollback_operation(
+    return await process_rollback_operation(
         request.username, ticketUID, request.price,
     )
@@ -0,0 +1,92 @@
+import functools
+from time import perf_counter
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ["method", "route", "status"],
+)
+
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "Время выполнения функции доступа к БД, включая ожидание соединения из пула",
+    ["query"],
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: латентность запросов по шаблону маршрута.
+
+    Чистый ASGI вместо BaseHTTPMiddleware - без лишней задачи и копирования
+    тела на каждый запрос. Дочерние метрики по меткам кэшируются."""
+
+    def __init__(self, app):
+        self.app = app
+        self._children = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Роутер кладет найденный маршрут в scope; шаблон пути вместо
+            # реального пути ограничивает число рядов метрики
+            route = scope.get("route")
+            key = (scope["method"], route.path if route is not None else "unmatched", status)
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = REQUEST_LATENCY.labels(key[0], key[1], str(status))
+            child.observe(perf_counter() - start)
+
+
+def timed_query(fn):
+    """Декоратор async-функции модуля database: время выполнения в DB_QUERY_LATENCY"""
+    child = DB_QUERY_LATENCY.labels(fn.__name__)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            child.observe(perf_counter() - start)
+
+    return wrapper
+
+
+class PoolCollector:
+    """Состояние пула соединений, снимается в момент scrape"""
+
+    def __init__(self, pool, stats):
+        self.pool = pool
+        self.stats = stats
+
+    def collect(self):
+        stats = self.stats(self.pool)
+        for name in ("in_use", "idle", "waiting", "max_size"):
+            yield GaugeMetricFamily(f"db_pool_{name}", f"Пул соединений: {name}", value=stats[name])
+        for name in ("checkouts", "checkout_timeouts", "connections_lost"):
+            yield CounterMetricFamily(f"db_pool_{name}", f"Пул соединений: {name}", value=stats[name])
+
+
+def register_pool(pool, stats):
+    REGISTRY.register(PoolCollector(pool, stats))
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
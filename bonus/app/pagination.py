@@ -0,0 +1,18 @@
+import base64
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(history_id: int) -> str:
+    """Непрозрачный токен продолжения: id последней операции страницы"""
+    return base64.urlsafe_b64encode(str(history_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> int:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        return int(base64.urlsafe_b64decode(padded).decode())
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursor(token) from exc
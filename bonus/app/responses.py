@@ -0,0 +1,26 @@
+from typing import Any, AsyncIterable
+
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON-ответ, который сериализует pydantic_core за один проход, без
+    json.dumps. datetime и UUID пишутся так же, как их пишет pydantic.
+
+    Если обработчик возвращает такой ответ сам, FastAPI пропускает проверку
+    response_model и jsonable_encoder. Поэтому так возвращаются только
+    данные, которые уже имеют форму ответа."""
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+async def ndjson_stream(batches: AsyncIterable[list[dict]]):
+    """Пачки строк в NDJSON: один объект на строку, один кусок ответа на
+    пачку. Клиент может разбирать выгрузку построчно, не дожидаясь конца."""
+    async for batch in batches:
+        yield b"".join(to_json(row) + b"\n" for row in batch)
@@ -9,6 +9,10 @@ class BalanceHistoryDTO(BaseModel):
     balanceDiff: int
     operationType: str
 
+class PrivilegeBalanceResponse(BaseModel):
+    balance: int
+    status: str
+
 class PrivilegeInfoResponse(BaseModel):
     balance: int
     status: str
@@ -1,4 +1,7 @@
+import base64
+import json
 import pytest
+from datetime import datetime
 from fastapi.testclient import TestClient
 from unittest.mock import patch
 from app.main import app
@@ -10,16 +13,40 @@ def test_manage_health():
     assert response.status_code == 200
     assert response.json() == {}
 
+def test_manage_pool():
+    response = client.get("/manage/pool")
+    assert response.status_code == 200
+    assert {"checkouts", "in_use", "idle", "wait_time_avg"} <= response.json().keys()
+
 @patch("app.main.get_privilege_with_history")
 def test_get_privilege_success(mock_db):
     mock_db.return_value = {
         "balance": 100,
         "status": "BRONZE",
-        "history": []
+        "history": [],
+        "version": "742",
     }
     response = client.get("/privilege?username=TestUser")
     assert response.status_code == 200
     assert response.json()["balance"] == 100
+    assert response.headers["ETag"]
+
+@patch("app.main.get_privilege_version")
+@patch("app.main.get_privilege_with_history")
+def test_get_privilege_not_modified(mock_db, mock_version):
+    mock_db.return_value = {"balance": 100, "status": "BRONZE", "history": [], "version": "742"}
+    mock_version.return_value = "742"
+    etag = client.get("/privilege?username=TestUser").headers["ETag"]
+    mock_db.reset_mock()
+
+    response = client.get("/privilege?username=TestUser", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    # История не читается, если версия строки не изменилась
+    mock_db.assert_not_called()
+
+    mock_version.return_value = "743"
+    response = client.get("/privilege?username=TestUser", headers={"If-None-Match": etag})
+    assert response.status_code == 200
 
 @patch("app.main.get_privilege_with_history")
 def test_get_privilege_404(mock_db):
@@ -27,13 +54,75 @@ def test_get_privilege_404(mock_db):
     response = client.get("/privilege?username=NonExistent")
     assert response.status_code == 404
 
+@patch("app.main.get_privilege_balance")
+def test_get_balance(mock_db):
+    mock_db.return_value = {"balance": 100, "status": "BRONZE"}
+    response = client.get("/privilege/balance?username=TestUser")
+    assert response.status_code == 200
+    assert response.json() == {"balance": 100, "status": "BRONZE"}
+
+@patch("app.main.get_privilege_history")
+def test_get_history_pages(mock_db):
+    def operation(i):
+        return {
+            "id": i,
+            "date": datetime(2026, 1, 1, 12, i),
+            "ticketUid": "550e8400-e29b-41d4-a716-44665544000" + str(i),
+            "balanceDiff": 150,
+            "operationType": "FILL_IN_BALANCE",
+        }
+
+    mock_db.return_value = [operation(1), operation(2)]
+    response = client.get("/privilege/history?username=TestUser&limit=2")
+    assert response.status_code == 200
+    assert [op["ticketUid"][-1] for op in response.json()] == ["1", "2"]
+    assert "id" not in response.json()[0]
+    cursor = response.headers["X-Next-Cursor"]
+
+    mock_db.return_value = []
+    response = client.get(f"/privilege/history?username=TestUser&limit=2&since={cursor}")
+    mock_db.assert_called_with("TestUser", 2, 2)
+    # Новых операций нет - курсор для следующей синхронизации прежний
+    assert response.json() == []
+    assert response.headers["X-Next-Cursor"] == cursor
+
+    assert client.get("/privilege/history?username=TestUser&since=%21%21").status_code == 400
+
+@patch("app.main.get_privilege_history")
+def test_get_history_rejects_malformed_cursor(mock_db):
+    malformed = base64.urlsafe_b64encode(b"2026-01-01T12:02:00|2").decode().rstrip("=")
+    response = client.get(f"/privilege/history?username=TestUser&since={malformed}")
+    assert response.status_code == 400
+    mock_db.assert_not_called()
+
+@patch("app.main.stream_privilege_history")
+def test_export_history_ndjson(mock_stream):
+    async def batches(*args):
+        for i in (1, 2):
+            yield [{
+                "date": datetime(2026, 1, 1, 12, i),
+                "ticketUid": "550e8400-e29b-41d4-a716-44665544000" + str(i),
+                "balanceDiff": 150,
+                "operationType": "FILL_IN_BALANCE",
+            }]
+
+    mock_stream.side_effect = batches
+    response = client.get("/privilege/history/export?username=TestUser")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [op["date"] for op in lines] == ["2026-01-01T12:01:00", "2026-01-01T12:02:00"]
+    mock_stream.assert_called_once_with("TestUser")
+
 @patch("app.main.process_bonus_operation")
 def test_calculate_bonus(mock_db):
-    mock_db.return_value = {
+    result = {
         "paidByBonuses": 10,
         "balanceDiff": -10,
         "privilege": {"balance": 90, "status": "BRONZE"}
     }
+    mock_db.return_value = (True, result)
     payload = {
         "ticketUid": "550e8400-e29b-41d4-a716-446655440000",
         "price": 100,
@@ -41,5 +130,26 @@ def test_calculate_bonus(mock_db):
         "username": "TestUser"
     }
     response = client.post("/privilege/calculate", json=payload)
-    assert response.status_code == 200
+    assert response.status_code == 201
     assert response.json()["paidByBonuses"] == 10
+
+    # Повтор по тому же билету отличается от новой операции только кодом
+    mock_db.return_value = (False, result)
+    response = client.post("/privilege/calculate", json=payload)
+    assert response.status_code == 200
+    assert response.json() == result
+
+    # Операция откачена компенсацией - повтор не выдает ее за выполненную
+    mock_db.return_value = (False, None)
+    assert client.post("/privilege/calculate", json=payload).status_code == 410
+
+
+def test_manage_metrics():
+    client.get("/manage/health")
+    response = client.get("/manage/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/manage/health",status="200"}' in body
+    assert 'db_query_duration_seconds_count{query="get_privilege_with_history"}' in body
+    assert "db_pool_in_use" in body
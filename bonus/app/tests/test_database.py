@@ -1,56 +1,167 @@
+import asyncio
 import pytest
-from unittest.mock import MagicMock, patch
-from datetime import datetime
-from app.database import get_privilege_with_history, process_bonus_operation, process_rollback_operation
+from unittest.mock import AsyncMock, MagicMock, patch
+from app.database import (
+    get_privilege_balance,
+    get_privilege_history,
+    get_privilege_with_history,
+    process_bonus_operation,
+    process_rollback_operation,
+    stream_privilege_history,
+)
 
-@patch("app.database.get_db_connection")
-def test_get_privilege_with_history_not_found(mock_connect):
+
+def mock_db(mock_connect):
+    """Соединение из пула: async with get_db_connection() as conn, conn.execute -> cursor"""
     mock_conn = MagicMock()
     mock_cur = MagicMock()
-    mock_connect.return_value = mock_conn
-    mock_conn.cursor.return_value = mock_cur
+    mock_connect.return_value.__aenter__.return_value = mock_conn
+    mock_conn.execute = AsyncMock(return_value=mock_cur)
+    mock_cur.fetchall = AsyncMock()
+    mock_cur.fetchone = AsyncMock()
+    return mock_conn, mock_cur
+
+
+@patch("app.database.get_db_connection")
+def test_get_privilege_with_history_not_found(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
     mock_cur.fetchone.return_value = None
-    
-    result = get_privilege_with_history("unknown")
-    
+
+    result = asyncio.run(get_privilege_with_history("unknown"))
+
     assert result["balance"] == 0
     assert result["status"] == "BRONZE"
     assert result["history"] == []
 
+@patch("app.database.get_db_connection")
+def test_get_privilege_balance_reads_only_privilege(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+    mock_cur.fetchone.return_value = None
+
+    assert asyncio.run(get_privilege_balance("unknown")) == {"balance": 0, "status": "BRONZE"}
+    assert "privilege_history" not in mock_conn.execute.call_args.args[0]
+
+@patch("app.database.get_db_connection")
+def test_get_privilege_history_continues_after_cursor(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+    mock_cur.fetchall.return_value = []
+
+    asyncio.run(get_privilege_history("user", 100, 42))
+
+    query, params = mock_conn.execute.call_args.args
+    assert "h.id > %s" in query
+    assert "ORDER BY h.id" in query
+    assert "h.datetime," not in query.split("ORDER BY")[1]
+    assert params == ["user", 42, 100]
+
+@patch("app.database.get_db_connection")
+def test_stream_privilege_history_uses_server_cursor(mock_connect):
+    mock_conn, _ = mock_db(mock_connect)
+    server_cur = MagicMock()
+    mock_conn.cursor.return_value.__aenter__.return_value = server_cur
+    server_cur.execute = AsyncMock()
+    server_cur.fetchmany = AsyncMock(side_effect=[[{"balanceDiff": 150}], []])
+
+    async def collect():
+        return [batch async for batch in stream_privilege_history("user", batch_size=500)]
+
+    assert asyncio.run(collect()) == [[{"balanceDiff": 150}]]
+    assert mock_conn.cursor.call_args.kwargs["name"]
+    server_cur.fetchmany.assert_called_with(500)
+    query, params = server_cur.execute.call_args.args
+    assert "ORDER BY h.id" in query
+    assert params == ("user",)
+
 @patch("app.database.get_db_connection")
 def test_process_bonus_operation_fill(mock_connect):
-    mock_conn = MagicMock()
-    mock_cur = MagicMock()
-    mock_connect.return_value = mock_conn
-    mock_conn.cursor.return_value = mock_cur
-    
-    mock_cur.fetchone.side_effect = [
-        {"id": 1, "balance": 100, "status": "BRONZE"},
-        {"balance": 110, "status": "BRONZE"}
-    ]
-    
-    result = process_bonus_operation("user", "uid", 100, False)
-    
+    mock_conn, mock_cur = mock_db(mock_connect)
+
+    mock_cur.fetchone.return_value = {"balance": 110, "status": "BRONZE", "balance_diff": 10}
+
+    applied, result = asyncio.run(process_bonus_operation("user", "uid", 100, False))
+
+    assert applied is True
     assert result["paidByBonuses"] == 0
     assert result["balanceDiff"] == 10
     assert result["privilege"]["balance"] == 110
-    mock_conn.commit.assert_called_once()
+    # Создание, блокировка строки и изменение баланса - одним пакетом
+    assert mock_conn.execute.await_count == 3
+    assert "FOR UPDATE" in mock_conn.execute.await_args_list[1].args[0]
+    params = mock_conn.execute.await_args_list[2].args[1]
+    assert params["fill"] == 10 and params["debit"] is False
+    # Транзакцию фиксирует выход из контекста соединения пула
+    mock_connect.return_value.__aexit__.assert_called_once()
 
 @patch("app.database.get_db_connection")
 def test_process_bonus_operation_debit(mock_connect):
-    mock_conn = MagicMock()
-    mock_cur = MagicMock()
-    mock_connect.return_value = mock_conn
-    mock_conn.cursor.return_value = mock_cur
-    
+    mock_conn, mock_cur = mock_db(mock_connect)
+
+    mock_cur.fetchone.return_value = {"balance": 300, "status": "BRONZE", "balance_diff": -200}
+
+    _, result = asyncio.run(process_bonus_operation("user", "uid", 200, True))
+
+    assert result["paidByBonuses"] == 200
+    assert result["balanceDiff"] == -200
+    assert result["privilege"]["balance"] == 300
+
+@patch("app.database.get_db_connection")
+def test_process_bonus_operation_repeat_returns_stored_result(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+
+    # Операция по билету уже есть: APPLY_BONUS ничего не изменил
     mock_cur.fetchone.side_effect = [
-        {"id": 1, "balance": 500, "status": "BRONZE"},
-        {"balance": 300, "status": "BRONZE"}
+        None,
+        {"balance": 300, "status": "BRONZE", "balance_diff": -200, "debit": True,
+         "rolled_back": False},
     ]
-    
-    result = process_bonus_operation("user", "uid", 200, True)
-    
+
+    applied, result = asyncio.run(process_bonus_operation("user", "uid", 200, True))
+
+    assert applied is False
     assert result["paidByBonuses"] == 200
     assert result["balanceDiff"] == -200
-    assert result["privilege"]["balance"] == 300
+    assert "privilege_history h" in mock_conn.execute.call_args.args[0]
+
+@patch("app.database.get_db_connection")
+def test_process_bonus_operation_repeat_after_rollback_is_rejected(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+
+    mock_cur.fetchone.side_effect = [
+        None,
+        {"balance": 1000, "status": "BRONZE", "balance_diff": -1000, "debit": True,
+         "rolled_back": True},
+    ]
+
+    assert asyncio.run(process_bonus_operation("user", "uid", 1500, True)) == (False, None)
+    assert "privilege_rollback" in mock_conn.execute.call_args.args[0]
+
+@patch("app.database.get_db_connection")
+def test_process_rollback_operation_applied_once(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+
+    mock_cur.fetchone.side_effect = [
+        {"operation_type": "FILL_IN_BALANCE", "balance_diff": 100},
+        {"id": 1, "balance": 500},
+        None,  # откат этого билета уже записан
+    ]
+
+    asyncio.run(process_rollback_operation("user", "uid", 1000))
+
+    queries = [c.args[0] for c in mock_conn.execute.call_args_list]
+    assert "privilege_rollback" in queries[-1]
+    assert not any(q.startswith("UPDATE privilege") for q in queries)
+
+@patch("app.database.get_db_connection")
+def test_process_rollback_operation_returns_spent_bonuses(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+
+    # Билет за 1000 оплачен бонусами частично, списано 300
+    mock_cur.fetchone.side_effect = [
+        {"operation_type": "DEBIT_THE_ACCOUNT", "balance_diff": 300},
+        {"id": 1, "balance": 0},
+        {"ticket_uid": "uid"},
+    ]
+
+    asyncio.run(process_rollback_operation("user", "uid", 1000))
 
+    assert mock_conn.execute.call_args.args[1] == (300, 1)
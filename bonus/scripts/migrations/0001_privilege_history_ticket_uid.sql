@@ -0,0 +1,4 @@
+-- Поиск операций по билету при возврате
+-- Остаток неудачного CONCURRENTLY-построения (INVALID индекс) удаляется заранее
+DROP INDEX CONCURRENTLY IF EXISTS idx_privilege_history_ticket_uid;
+CREATE INDEX CONCURRENTLY idx_privilege_history_ticket_uid ON privilege_history (ticket_uid);
@@ -0,0 +1,3 @@
+-- История операций программы лояльности: GET /privilege
+DROP INDEX CONCURRENTLY IF EXISTS idx_privilege_history_privilege_id;
+CREATE INDEX CONCURRENTLY idx_privilege_history_privilege_id ON privilege_history (privilege_id);
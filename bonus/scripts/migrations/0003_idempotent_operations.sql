@@ -0,0 +1,14 @@
+-- Одна операция начисления/списания на билет: повторный calculate находит
+-- ее по ticket_uid и не меняет баланс второй раз. Уникальный индекс
+-- заменяет обычный из 0001
+DROP INDEX CONCURRENTLY IF EXISTS idx_privilege_history_ticket_uid_key;
+CREATE UNIQUE INDEX CONCURRENTLY idx_privilege_history_ticket_uid_key ON privilege_history (ticket_uid);
+DROP INDEX CONCURRENTLY IF EXISTS idx_privilege_history_ticket_uid;
+
+-- Выполненные откаты: повтор из очереди gateway не вернет бонусы дважды
+CREATE TABLE IF NOT EXISTS privilege_rollback (
+    ticket_uid   uuid PRIMARY KEY,
+    privilege_id INT       NOT NULL REFERENCES privilege (id),
+    balance_diff INT       NOT NULL,
+    datetime     TIMESTAMP NOT NULL
+);
@@ -0,0 +1,7 @@
+-- Постраничная история операций: WHERE privilege_id = ? AND id > ? ORDER BY id.
+-- Операции пользователя пишутся под блокировкой его строки privilege, поэтому
+-- id растут в порядке фиксации. Индекс по (privilege_id, id) покрывает и
+-- поиск по privilege_id из 0002, старый индекс удаляется
+DROP INDEX CONCURRENTLY IF EXISTS idx_privilege_history_privilege_id_id;
+CREATE INDEX CONCURRENTLY idx_privilege_history_privilege_id_id ON privilege_history (privilege_id, id);
+DROP INDEX CONCURRENTLY IF EXISTS idx_privilege_history_privilege_id;
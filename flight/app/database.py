@@ -1,65 +1,220 @@
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import time
 from dotenv import load_dotenv
+from .db_pool import create_pool
+from .metrics import timed_query
 
 load_dotenv()
 
+DB_PARAMS = dict(
+    host=os.getenv("DB_HOST", "localhost"),
+    dbname=os.getenv("DB_NAME", "flights"),
+    user=os.getenv("DB_USER", "program"),
+    password=os.getenv("DB_PASSWORD", "test"),
+    port=os.getenv("DB_PORT", "5432"),
+)
+
+pool = create_pool(DB_PARAMS, name="flight")
+
 def get_db_connection():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST", "localhost"),
-        database=os.getenv("DB_NAME", "flights"),
-        user=os.getenv("DB_USER", "program"),
-        password=os.getenv("DB_PASSWORD", "test"),
-        port=os.getenv("DB_PORT", "5432"),
-    )
-
-def fetch_flights(page: int, size: int):
+    # Соединение возвращается в пул при выходе из async with, в том числе при ошибке
+    return pool.connection()
+
+# version - версии строк рейса и аэропортов, из них строится ETag ответа
+FLIGHT_VERSION = "concat_ws(':', f.xmin, a1.xmin, a2.xmin) as version"
+
+# Поля ответа. Дата форматируется в SQL, название аэропорта хранится
+# готовым (airport.display_name), строки из БД отдаются без изменений в Python
+FLIGHT_FIELDS = """
+    f.flight_number as "flightNumber",
+    to_char(f.datetime, 'YYYY-MM-DD HH24:MI') as "date",
+    f.price,
+    a1.display_name as "fromAirport",
+    a2.display_name as "toAirport"
+"""
+
+# id и datetime - ключ keyset-пагинации, в ответ не попадают
+FLIGHT_COLUMNS = f"""
+    f.id,
+    f.datetime,
+    {FLIGHT_VERSION},
+    {FLIGHT_FIELDS}
+"""
+
+# Сколько секунд переиспользуется посчитанное число рейсов
+COUNT_CACHE_TTL = float(os.getenv("FLIGHT_COUNT_CACHE_TTL", "60"))
+# Начиная с этого числа строк вместо COUNT(*) берется оценка планировщика
+COUNT_ESTIMATE_THRESHOLD = int(os.getenv("FLIGHT_COUNT_ESTIMATE_THRESHOLD", "100000"))
+
+_count_cache = {"value": None, "expires_at": 0.0}
+
+
+async def count_flights(conn, exact: bool = False) -> int:
+    """Общее число рейсов.
+
+    Без exact значение берется из кэша процесса, а на большой таблице -
+    из pg_class.reltuples, чтобы не сканировать ее на каждый запрос страницы."""
+    now = time.monotonic()
+    if not exact and _count_cache["value"] is not None and _count_cache["expires_at"] > now:
+        return _count_cache["value"]
+
+    total = None
+    if not exact:
+        cur = await conn.execute(
+            "SELECT reltuples::bigint AS estimate FROM pg_class WHERE oid = 'flight'::regclass"
+        )
+        estimate = (await cur.fetchone())['estimate']
+        if estimate >= COUNT_ESTIMATE_THRESHOLD:
+            total = estimate
+    if total is None:
+        cur = await conn.execute("SELECT COUNT(*) FROM flight")
+        total = (await cur.fetchone())['count']
+
+    _count_cache.update(value=total, expires_at=now + COUNT_CACHE_TTL)
+    return total
+
+
+@timed_query
+async def fetch_flights(page: int, size: int, exact_count: bool = False):
     offset = (page - 1) * size
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    # Raw SQL запрос с JOIN для получения названий аэропортов
-    query = """
-        SELECT 
-            f.flight_number as "flightNumber",
-            f.datetime as "date",
-            f.price,
-            concat(a1.city, ' ', a1.name) as "fromAirport",
-            concat(a2.city, ' ', a2.name) as "toAirport"
-        FROM flight f
-        JOIN airport a1 ON f.from_airport_id = a1.id
-        JOIN airport a2 ON f.to_airport_id = a2.id
-        LIMIT %s OFFSET %s
-    """
-    cur.execute(query, (size, offset))
-    items = cur.fetchall()
-    
-    cur.execute("SELECT COUNT(*) FROM flight")
-    total_elements = cur.fetchone()['count']
-    
-    cur.close()
-    conn.close()
-    return items, total_elements
-
-def fetch_flight_by_number(flight_number: str):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    query = """
-        SELECT 
-            f.flight_number as "flightNumber",
-            f.datetime as "date",
-            f.price,
-            concat(a1.city, ' ', a1.name) as "fromAirport",
-            concat(a2.city, ' ', a2.name) as "toAirport"
+    async with get_db_connection() as conn:
+        # Raw SQL запрос с JOIN для получения названий аэропортов
+        query = f"""
+            SELECT {FLIGHT_COLUMNS}
+            FROM flight f
+            JOIN airport a1 ON f.from_airport_id = a1.id
+            JOIN airport a2 ON f.to_airport_id = a2.id
+            ORDER BY f.datetime, f.id
+            LIMIT %s OFFSET %s
+        """
+        cur = await conn.execute(query, (size, offset))
+        items = await cur.fetchall()
+
+        total_elements = await count_flights(conn, exact_count)
+
+        return items, total_elements
+
+
+@timed_query
+async def fetch_flights_after(after: tuple | None, size: int, exact_count: bool = False):
+    """Keyset-пагинация по (datetime, id): страница после ключа after
+    (None - первая страница). Стоимость не зависит от глубины страницы."""
+    async with get_db_connection() as conn:
+        where = "WHERE (f.datetime, f.id) > (%s, %s)" if after is not None else ""
+        query = f"""
+            SELECT {FLIGHT_COLUMNS}
+            FROM flight f
+            JOIN airport a1 ON f.from_airport_id = a1.id
+            JOIN airport a2 ON f.to_airport_id = a2.id
+            {where}
+            ORDER BY f.datetime, f.id
+            LIMIT %s
+        """
+        cur = await conn.execute(query, (*(after or ()), size))
+        items = await cur.fetchall()
+
+        total_elements = await count_flights(conn, exact_count)
+
+        return items, total_elements
+
+
+@timed_query
+async def fetch_flight_by_number(flight_number: str):
+    async with get_db_connection() as conn:
+        query = f"""
+            SELECT {FLIGHT_VERSION}, {FLIGHT_FIELDS}
+            FROM flight f
+            JOIN airport a1 ON f.from_airport_id = a1.id
+            JOIN airport a2 ON f.to_airport_id = a2.id
+            WHERE f.flight_number = %s
+        """
+        cur = await conn.execute(query, (flight_number,))
+        return await cur.fetchone()
+
+@timed_query
+async def fetch_flights_by_numbers(flight_numbers: list[str]):
+    async with get_db_connection() as conn:
+        # Один запрос на весь набор номеров вместо N запросов по одному
+        query = f"""
+            SELECT {FLIGHT_VERSION}, {FLIGHT_FIELDS}
+            FROM flight f
+            JOIN airport a1 ON f.from_airport_id = a1.id
+            JOIN airport a2 ON f.to_airport_id = a2.id
+            WHERE f.flight_number = ANY(%s)
+        """
+        cur = await conn.execute(query, (list(flight_numbers),))
+        return await cur.fetchall()
+
+
+# Сортировки поиска: колонка ключа keyset-пагинации, поле с ее значением
+# в строке результата и направление
+SEARCH_SORTS = {
+    "date": ("f.datetime", "datetime", "ASC"),
+    "-date": ("f.datetime", "datetime", "DESC"),
+    "price": ("f.price", "price", "ASC"),
+    "-price": ("f.price", "price", "DESC"),
+}
+
+# Аэропорт задается названием, городом или полным именем из ответа
+AIRPORT_MATCH = """
+    SELECT id FROM airport WHERE lower(%s) IN (lower(city), lower(name), lower(display_name))
+"""
+
+
+def search_query(
+    from_airport: str | None = None,
+    to_airport: str | None = None,
+    date_from=None,
+    date_to=None,
+    min_price: int | None = None,
+    max_price: int | None = None,
+    sort: str = "date",
+    size: int = 10,
+    after: tuple | None = None,
+) -> tuple[str, list]:
+    """Запрос поиска и его параметры. Даты - полуинтервал [date_from,
+    date_to), цены - включительно. after - ключ (значение сортировки, id)
+    последнего рейса предыдущей страницы."""
+    conditions = []
+    params = []
+    if from_airport is not None:
+        conditions.append(f"f.from_airport_id IN ({AIRPORT_MATCH})")
+        params.append(from_airport)
+    if to_airport is not None:
+        conditions.append(f"f.to_airport_id IN ({AIRPORT_MATCH})")
+        params.append(to_airport)
+    for condition, value in (
+        ("f.datetime >= %s", date_from),
+        ("f.datetime < %s", date_to),
+        ("f.price >= %s", min_price),
+        ("f.price <= %s", max_price),
+    ):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+
+    column, _, direction = SEARCH_SORTS[sort]
+    if after is not None:
+        conditions.append(f"({column}, f.id) {'>' if direction == 'ASC' else '<'} (%s, %s)")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"""
+        SELECT {FLIGHT_COLUMNS}
         FROM flight f
         JOIN airport a1 ON f.from_airport_id = a1.id
         JOIN airport a2 ON f.to_airport_id = a2.id
-        WHERE f.flight_number = %s
+        {where}
+        ORDER BY {column} {direction}, f.id {direction}
+        LIMIT %s
     """
-    cur.execute(query, (flight_number,))
-    flight = cur.fetchone()
-    cur.close()
-    conn.close()
-    return flight
\ No newline at end of file
+    params.append(size)
+    return query, params
+
+
+@timed_query
+async def search_flights(**filters):
+    """Страница поиска рейсов, фильтры - как у search_query"""
+    query, params = search_query(**filters)
+    async with get_db_connection() as conn:
+        cur = await conn.execute(query, params)
+        return await cur.fetchall()
@@ -1,31 +1,177 @@
-from fastapi import FastAPI, HTTPException, Query
-from .database import fetch_flights, fetch_flight_by_number
-from .schemas import PaginationResponse, FlightResponse
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Literal
+from fastapi import FastAPI, Header, HTTPException, Query
+from .database import (
+    fetch_flights,
+    fetch_flights_after,
+    fetch_flight_by_number,
+    fetch_flights_by_numbers,
+    pool,
+    search_flights,
+    SEARCH_SORTS,
+)
+from .db_pool import pool_stats
+from .etag import etag_matches, make_etag, not_modified
+from .metrics import MetricsMiddleware, metrics_response, register_pool
+from .pagination import (
+    InvalidCursor,
+    decode_cursor,
+    decode_search_cursor,
+    encode_cursor,
+    encode_search_cursor,
+)
+from .responses import FastJSONResponse
+from .schemas import PaginationResponse, FlightResponse, SearchResponse
 
-app = FastAPI(title="Flight Service")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # wait=False: сервис стартует, даже если БД еще поднимается
+    await pool.open(wait=False)
+    yield
+    await pool.close()
+
+app = FastAPI(
+    title="Flight Service", lifespan=lifespan, default_response_class=FastJSONResponse
+)
+app.add_middleware(MetricsMiddleware)
+register_pool(pool, pool_stats)
 
 @app.get("/manage/health")
 async def manage_health():
     return {}
 
+@app.get("/manage/pool")
+async def manage_pool():
+    return pool_stats(pool)
+
+@app.get("/manage/metrics")
+async def manage_metrics():
+    return metrics_response()
+
+# Максимум номеров рейсов в одном пакетном запросе
+MAX_BATCH_NUMBERS = 100
+
+# Ответы со списками рейсов собираются из строк БД и сериализуются напрямую;
+# response_model остается описанием схемы
+FLIGHT_FIELDS = tuple(FlightResponse.model_fields)
+
+
+def public_flight(flight: dict) -> dict:
+    """Рейс без служебных полей (id, datetime, version)"""
+    return {name: flight[name] for name in FLIGHT_FIELDS}
+
+
 @app.get("/flights", response_model=PaginationResponse)
-async def get_flights(page: int = Query(1, ge=1), size: int = Query(10, ge=1, le=100)):
-    items, total = fetch_flights(page, size)
-    # Приведение даты к формату из примера
-    for item in items:
-        item['date'] = item['date'].strftime("%Y-%m-%d %H:%M")
-        
-    return {
-        "page": page,
+async def get_flights(
+    if_none_match: str | None = Header(None),
+    page: int = Query(1, ge=1),
+    size: int = Query(10, ge=1, le=100),
+    numbers: str | None = Query(None, description="Номера рейсов через запятую"),
+    cursor: str | None = Query(None, description="Токен nextCursor предыдущей страницы"),
+    exactCount: bool = Query(False, description="Посчитать totalElements точно"),
+):
+    if numbers is not None:
+        return await get_flights_batch(numbers, if_none_match)
+
+    if cursor is not None:
+        # Пустой cursor - первая страница в режиме keyset
+        try:
+            after = decode_cursor(cursor) if cursor else None
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        items, total = await fetch_flights_after(after, size, exactCount)
+        page = None
+    else:
+        items, total = await fetch_flights(page, size, exactCount)
+
+    next_cursor = encode_cursor(items[-1]) if len(items) == size else None
+    etag = make_etag(page, size, total, *(item["version"] for item in items))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    return FastJSONResponse(
+        {
+            "page": page,
+            "pageSize": size,
+            "totalElements": total,
+            "nextCursor": next_cursor,
+            "items": [public_flight(item) for item in items],
+        },
+        headers={"ETag": etag},
+    )
+
+@app.get("/flights/search", response_model=SearchResponse)
+async def search(
+    fromAirport: str | None = Query(None, description="Город, аэропорт или \"город аэропорт\" вылета"),
+    toAirport: str | None = Query(None, description="Город, аэропорт или \"город аэропорт\" прилета"),
+    dateFrom: datetime | None = Query(None, description="Вылет не раньше"),
+    dateTo: datetime | None = Query(None, description="Вылет раньше"),
+    minPrice: int | None = Query(None, ge=0),
+    maxPrice: int | None = Query(None, ge=0),
+    sort: Literal["date", "-date", "price", "-price"] = Query("date"),
+    size: int = Query(10, ge=1, le=100),
+    cursor: str | None = Query(None, description="Токен nextCursor предыдущей страницы"),
+):
+    """Поиск рейсов с фильтрами на стороне БД. Страницы - keyset по ключу
+    сортировки; cursor действителен только с той же сортировкой"""
+    try:
+        after = decode_search_cursor(cursor, sort) if cursor else None
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    items = await search_flights(
+        from_airport=fromAirport,
+        to_airport=toAirport,
+        date_from=dateFrom,
+        date_to=dateTo,
+        min_price=minPrice,
+        max_price=maxPrice,
+        sort=sort,
+        size=size,
+        after=after,
+    )
+    next_cursor = None
+    if len(items) == size:
+        _, key, _ = SEARCH_SORTS[sort]
+        next_cursor = encode_search_cursor(sort, items[-1][key], items[-1]["id"])
+    return FastJSONResponse({
         "pageSize": size,
-        "totalElements": total,
-        "items": items
-    }
+        "nextCursor": next_cursor,
+        "items": [public_flight(item) for item in items],
+    })
 
 @app.get("/flights/{flight_number}", response_model=FlightResponse)
-async def get_flight(flight_number: str):
-    flight = fetch_flight_by_number(flight_number)
+async def get_flight(
+    flight_number: str, if_none_match: str | None = Header(None)
+):
+    flight = await fetch_flight_by_number(flight_number)
     if not flight:
         raise HTTPException(status_code=404, detail="Flight not found")
-    flight['date'] = flight['date'].strftime("%Y-%m-%d %H:%M")
-    return flight
\ No newline at end of file
+    # 304 экономит сериализацию и передачу тела; сам запрос по индексу дешев
+    etag = make_etag(flight["version"])
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    return FastJSONResponse(public_flight(flight), headers={"ETag": etag})
+
+
+async def get_flights_batch(numbers: str, if_none_match: str | None):
+    flight_numbers = list(dict.fromkeys(n.strip() for n in numbers.split(",") if n.strip()))
+    if len(flight_numbers) > MAX_BATCH_NUMBERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many flight numbers, max {MAX_BATCH_NUMBERS}",
+        )
+
+    items = await fetch_flights_by_numbers(flight_numbers) if flight_numbers else []
+    etag = make_etag(*sorted(f"{item['flightNumber']}={item['version']}" for item in items))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    return FastJSONResponse(
+        {
+            "page": 1,
+            "pageSize": len(items),
+            "totalElements": len(items),
+            "items": [public_flight(item) for item in items],
+        },
+        headers={"ETag": etag},
+    )
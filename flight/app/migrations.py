@@ -0,0 +1,113 @@
+"""Версионные миграции схемы: python -m app.migrations
+
+Миграции - файлы scripts/migrations/NNNN_описание.sql, применяются по
+возрастанию номера, примененные записываются в schema_migrations. Каждая
+инструкция выполняется отдельно в autocommit, поэтому в миграциях можно
+использовать CREATE INDEX CONCURRENTLY и не блокировать запись в таблицу."""
+
+import asyncio
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import psycopg
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "scripts" / "migrations"
+
+# Ключ pg_advisory_lock: одновременно миграции применяет только одна реплика
+ADVISORY_LOCK_KEY = 7_304_512
+
+_FILE_RE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    statements: list[str]
+
+
+def split_statements(sql: str) -> list[str]:
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    return [s.strip() for s in "\n".join(lines).split(";") if s.strip()]
+
+
+def load_migrations(directory: Path = MIGRATIONS_DIR) -> list[Migration]:
+    migrations = []
+    for path in directory.glob("*.sql"):
+        match = _FILE_RE.match(path.name)
+        if match is None:
+            raise ValueError(f"Bad migration file name: {path.name}")
+        migrations.append(
+            Migration(int(match[1]), match[2], split_statements(path.read_text()))
+        )
+    migrations.sort()
+    versions = [m.version for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+async def migrate(conninfo: str = "", directory: Path = MIGRATIONS_DIR, **connect_kwargs) -> list[int]:
+    """Применяет недостающие миграции, возвращает номера примененных"""
+    migrations = load_migrations(directory)
+    applied_now = []
+    async with await psycopg.AsyncConnection.connect(
+        conninfo, autocommit=True, **connect_kwargs
+    ) as conn:
+        # DDL, ждущий блокировку за долгой транзакцией, сам блокирует все
+        # последующие запросы к таблице - лучше упасть и повторить позже
+        await conn.execute(
+            "SELECT set_config('lock_timeout', %s, false)",
+            (os.getenv("DB_MIGRATE_LOCK_TIMEOUT", "5s"),),
+        )
+        await conn.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_KEY,))
+        try:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version    INT PRIMARY KEY,
+                    name       VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+                )
+            """)
+            cur = await conn.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in await cur.fetchall()}
+
+            for migration in migrations:
+                if migration.version in applied:
+                    continue
+                for statement in migration.statements:
+                    await conn.execute(statement)
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                    (migration.version, migration.name),
+                )
+                applied_now.append(migration.version)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_KEY,))
+    return applied_now
+
+
+async def main():
+    from .database import DB_PARAMS
+
+    params = {k: v for k, v in DB_PARAMS.items() if v is not None}
+    # При старте в docker-compose база может подниматься дольше сервиса;
+    # LockNotAvailable (lock_timeout) - тоже OperationalError, его повторяем так же
+    deadline = time.monotonic() + float(os.getenv("DB_MIGRATE_WAIT", "30"))
+    while True:
+        try:
+            applied = await migrate(**params)
+            break
+        except psycopg.OperationalError as exc:
+            if time.monotonic() > deadline:
+                raise
+            print(f"Migration attempt failed, retrying: {exc}", file=sys.stderr)
+            await asyncio.sleep(1)
+    print(f"Applied migrations: {applied or 'none'}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,44 @@
+import base64
+import json
+from datetime import datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(flight: dict) -> str:
+    """Непрозрачный токен продолжения: ключ (datetime, id) последнего рейса страницы"""
+    payload = json.dumps([flight["datetime"].isoformat(), flight["id"]])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> tuple[datetime, int]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        date, flight_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(date), int(flight_id)
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursor(token) from exc
+
+
+def encode_search_cursor(sort: str, value, flight_id: int) -> str:
+    """Токен продолжения поиска: сортировка и ее ключ (значение, id) у
+    последнего рейса страницы"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([sort, value, flight_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_search_cursor(token: str, sort: str) -> tuple:
+    """Ключ из токена; токен другой сортировки недействителен"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        cursor_sort, value, flight_id = json.loads(base64.urlsafe_b64decode(padded))
+        if cursor_sort != sort:
+            raise ValueError(f"cursor for sort {cursor_sort}")
+        value = datetime.fromisoformat(value) if sort.endswith("date") else int(value)
+        return value, int(flight_id)
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursor(token) from exc
@@ -0,0 +1,16 @@
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON-ответ, который сериализует pydantic_core за один проход, без
+    json.dumps. datetime и UUID пишутся так же, как их пишет pydantic.
+
+    Если обработчик возвращает такой ответ сам, FastAPI пропускает проверку
+    response_model и jsonable_encoder. Поэтому так возвращаются только
+    данные, которые уже имеют форму ответа."""
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 class FlightResponse(BaseModel):
     flightNumber: str
@@ -10,7 +10,16 @@ class FlightResponse(BaseModel):
     price: int
 
 class PaginationResponse(BaseModel):
-    page: int
+    # В режиме cursor номер страницы не определен
+    page: Optional[int]
     pageSize: int
     totalElements: int
-    items: List[FlightResponse]
\ No newline at end of file
+    nextCursor: Optional[str] = None
+    items: List[FlightResponse]
+
+class SearchResponse(BaseModel):
+    # Общее число найденных рейсов не считается: для широкого фильтра это
+    # обход большей части таблицы
+    pageSize: int
+    nextCursor: Optional[str] = None
+    items: List[FlightResponse]
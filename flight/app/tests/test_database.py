@@ -1,33 +1,124 @@
+import asyncio
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from datetime import datetime
-from app.database import fetch_flights, fetch_flight_by_number
+from app import database
+from app.database import (
+    fetch_flights,
+    fetch_flights_after,
+    fetch_flight_by_number,
+    fetch_flights_by_numbers,
+    search_flights,
+    search_query,
+)
 
-@patch("app.database.get_db_connection")
-def test_fetch_flights_logic(mock_connect):
+
+@pytest.fixture(autouse=True)
+def reset_count_cache():
+    database._count_cache.update(value=None, expires_at=0.0)
+
+
+def mock_db(mock_connect):
+    """Соединение из пула: async with get_db_connection() as conn, conn.execute -> cursor"""
     mock_conn = MagicMock()
     mock_cur = MagicMock()
-    mock_connect.return_value = mock_conn
-    mock_conn.cursor.return_value = mock_cur
-    
+    mock_connect.return_value.__aenter__.return_value = mock_conn
+    mock_conn.execute = AsyncMock(return_value=mock_cur)
+    mock_cur.fetchall = AsyncMock()
+    mock_cur.fetchone = AsyncMock()
+    return mock_conn, mock_cur
+
+
+@patch("app.database.get_db_connection")
+def test_fetch_flights_logic(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+
     mock_cur.fetchall.return_value = [
         {"flightNumber": "A101", "date": datetime(2026, 1, 1, 12, 0), "price": 100, "fromAirport": "MSK", "toAirport": "SPB"}
     ]
-    mock_cur.fetchone.return_value = {"count": 1}
-    
-    items, total = fetch_flights(1, 10)
-    
+    mock_cur.fetchone.side_effect = [{"estimate": -1}, {"count": 1}]
+
+    items, total = asyncio.run(fetch_flights(1, 10))
+
     assert total == 1
     assert items[0]["flightNumber"] == "A101"
-    assert mock_cur.execute.called
+    assert "ORDER BY f.datetime, f.id" in mock_conn.execute.call_args_list[0].args[0]
+
+@patch("app.database.get_db_connection")
+def test_count_is_cached_and_estimated(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+    mock_cur.fetchall.return_value = []
+    mock_cur.fetchone.side_effect = [{"estimate": 2_000_000}, {"count": 1_999_999}]
+
+    _, first = asyncio.run(fetch_flights(1, 10))
+    _, cached = asyncio.run(fetch_flights(500, 10))
+    _, exact = asyncio.run(fetch_flights(500, 10, exact_count=True))
+
+    assert (first, cached, exact) == (2_000_000, 2_000_000, 1_999_999)
+    queries = [c.args[0] for c in mock_conn.execute.call_args_list]
+    assert sum("COUNT(*)" in q for q in queries) == 1
+    assert sum("reltuples" in q for q in queries) == 1
+
+@patch("app.database.get_db_connection")
+def test_fetch_flights_after_uses_keyset(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+    mock_cur.fetchall.return_value = []
+    mock_cur.fetchone.side_effect = [{"estimate": -1}, {"count": 0}]
+    after = (datetime(2026, 1, 1, 12, 0), 42)
+
+    asyncio.run(fetch_flights_after(after, 10))
+
+    query, params = mock_conn.execute.call_args_list[0].args
+    assert "(f.datetime, f.id) > (%s, %s)" in query
+    assert "OFFSET" not in query
+    assert params == (datetime(2026, 1, 1, 12, 0), 42, 10)
 
 @patch("app.database.get_db_connection")
 def test_fetch_flight_by_number_not_found(mock_connect):
-    mock_conn = MagicMock()
-    mock_cur = MagicMock()
-    mock_connect.return_value = mock_conn
-    mock_conn.cursor.return_value = mock_cur
+    mock_conn, mock_cur = mock_db(mock_connect)
     mock_cur.fetchone.return_value = None
-    
-    result = fetch_flight_by_number("NULL000")
-    assert result is None
\ No newline at end of file
+
+    result = asyncio.run(fetch_flight_by_number("NULL000"))
+    assert result is None
+
+@patch("app.database.get_db_connection")
+def test_fetch_flights_by_numbers_single_query(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+    mock_cur.fetchall.return_value = [
+        {"flightNumber": "A101", "date": datetime(2026, 1, 1, 12, 0), "price": 100, "fromAirport": "MSK", "toAirport": "SPB"}
+    ]
+
+    result = asyncio.run(fetch_flights_by_numbers(["A101", "B202"]))
+
+    assert result[0]["flightNumber"] == "A101"
+    mock_conn.execute.assert_called_once()
+    query, params = mock_conn.execute.call_args.args
+    assert "ANY(%s)" in query
+    assert params == (["A101", "B202"],)
+
+
+def test_search_query_filters_and_keyset():
+    date_from = datetime(2026, 1, 1)
+    query, params = search_query(
+        from_airport="Москва", date_from=date_from, max_price=2000,
+        sort="-price", size=20, after=(1500, 42),
+    )
+
+    assert "f.from_airport_id IN" in query and "to_airport_id IN" not in query
+    assert "f.datetime >= %s" in query and "f.price <= %s" in query
+    assert "(f.price, f.id) < (%s, %s)" in query
+    assert "ORDER BY f.price DESC, f.id DESC" in query
+    assert "a1.display_name" in query and "concat(" not in query
+    assert params == ["Москва", date_from, 2000, 1500, 42, 20]
+
+@patch("app.database.get_db_connection")
+def test_search_flights_without_filters(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+    mock_cur.fetchall.return_value = []
+
+    asyncio.run(search_flights(size=10))
+
+    query, params = mock_conn.execute.call_args.args
+    assert "WHERE" not in query
+    assert "ORDER BY f.datetime ASC, f.id ASC" in query
+    assert params == [10]
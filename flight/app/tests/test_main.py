@@ -14,13 +14,57 @@ def test_manage_health():
 @patch("app.main.fetch_flights")
 def test_get_flights_api(mock_fetch):
     mock_fetch.return_value = ([
-        {"flightNumber": "A101", "date": datetime(2026, 1, 1, 12, 0), "price": 100, "fromAirport": "MSK", "toAirport": "SPB"}
+        {"flightNumber": "A101", "date": "2026-01-01 12:00", "price": 100, "fromAirport": "MSK", "toAirport": "SPB", "version": "1:1:1"}
     ], 1)
     
     response = client.get("/flights?page=1&size=10")
     assert response.status_code == 200
     assert response.json()["totalElements"] == 1
-    assert response.json()["items"][0]["date"] == "2026-01-01 12:00"
+    assert response.json()["items"][0] == {
+        "flightNumber": "A101", "fromAirport": "MSK", "toAirport": "SPB",
+        "date": "2026-01-01 12:00", "price": 100,
+    }
+
+@patch("app.main.fetch_flights_after")
+def test_get_flights_cursor_api(mock_fetch):
+    mock_fetch.side_effect = lambda *args: ([
+        {"id": 7, "datetime": datetime(2026, 1, 1, 12, 0), "flightNumber": "A101", "date": "2026-01-01 12:00", "price": 100, "fromAirport": "MSK", "toAirport": "SPB", "version": "1:1:1"}
+    ], 5)
+
+    first = client.get("/flights?cursor=&size=1").json()
+    assert first["page"] is None
+    assert first["nextCursor"]
+    mock_fetch.assert_called_with(None, 1, False)
+
+    client.get(f"/flights?cursor={first['nextCursor']}&size=1&exactCount=true")
+    mock_fetch.assert_called_with((datetime(2026, 1, 1, 12, 0), 7), 1, True)
+
+def test_get_flights_invalid_cursor_api():
+    response = client.get("/flights?cursor=garbage")
+    assert response.status_code == 400
+
+@patch("app.main.search_flights")
+def test_search_flights_api(mock_search):
+    mock_search.return_value = [
+        {"id": 7, "datetime": datetime(2026, 1, 1, 12, 0), "flightNumber": "A101", "date": "2026-01-01 12:00", "price": 100, "fromAirport": "MSK", "toAirport": "SPB", "version": "1:1:1"}
+    ]
+
+    first = client.get("/flights/search?fromAirport=Москва&maxPrice=2000&sort=-price&size=1").json()
+    assert first["items"][0]["flightNumber"] == "A101"
+    assert "id" not in first["items"][0]
+    assert mock_search.call_args.kwargs["from_airport"] == "Москва"
+    assert mock_search.call_args.kwargs["after"] is None
+
+    client.get(f"/flights/search?sort=-price&size=1&cursor={first['nextCursor']}")
+    assert mock_search.call_args.kwargs["after"] == (100, 7)
+
+    # Курсор другой сортировки не принимается
+    response = client.get(f"/flights/search?sort=date&cursor={first['nextCursor']}")
+    assert response.status_code == 400
+
+def test_search_flights_bad_params():
+    assert client.get("/flights/search?sort=name").status_code == 422
+    assert client.get("/flights/search?dateFrom=tomorrow").status_code == 422
 
 @patch("app.main.fetch_flight_by_number")
 def test_get_flight_not_found_api(mock_fetch):
@@ -33,11 +77,73 @@ def test_get_flight_not_found_api(mock_fetch):
 def test_get_flight_success_api(mock_fetch):
     mock_fetch.return_value = {
         "flightNumber": "A101", 
-        "date": datetime(2026, 1, 1, 12, 0), 
+        "date": "2026-01-01 12:00", 
         "price": 100, 
         "fromAirport": "MSK", 
-        "toAirport": "SPB"
+        "toAirport": "SPB",
+        "version": "1:1:1",
     }
     response = client.get("/flights/A101")
     assert response.status_code == 200
-    assert response.json()["flightNumber"] == "A101"
\ No newline at end of file
+    assert response.json()["flightNumber"] == "A101"
+    assert "version" not in response.json()
+    assert response.headers["ETag"]
+
+@patch("app.main.fetch_flight_by_number")
+def test_get_flight_conditional_api(mock_fetch):
+    mock_fetch.side_effect = lambda number: {
+        "flightNumber": number, "date": "2026-01-01 12:00", "price": 100,
+        "fromAirport": "MSK", "toAirport": "SPB", "version": "5:1:1",
+    }
+    etag = client.get("/flights/A101").headers["ETag"]
+
+    response = client.get("/flights/A101", headers={"If-None-Match": f'W/"other", {etag}'})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    # Изменилась строка рейса - новая версия, полный ответ
+    mock_fetch.side_effect = lambda number: {
+        "flightNumber": number, "date": "2026-01-01 12:00", "price": 200,
+        "fromAirport": "MSK", "toAirport": "SPB", "version": "6:1:1",
+    }
+    response = client.get("/flights/A101", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+@patch("app.main.fetch_flights_by_numbers")
+def test_get_flights_batch_api(mock_fetch):
+    mock_fetch.return_value = [
+        {"flightNumber": "A101", "date": "2026-01-01 12:00", "price": 100, "fromAirport": "MSK", "toAirport": "SPB", "version": "1:1:1"}
+    ]
+    response = client.get("/flights?numbers=A101,B202,A101")
+    assert response.status_code == 200
+    assert response.json()["totalElements"] == 1
+    assert response.json()["items"][0] == {
+        "flightNumber": "A101", "fromAirport": "MSK", "toAirport": "SPB",
+        "date": "2026-01-01 12:00", "price": 100,
+    }
+    mock_fetch.assert_called_once_with(["A101", "B202"])
+
+
+def test_get_flights_batch_too_many():
+    numbers = ",".join(f"A{i}" for i in range(101))
+    response = client.get(f"/flights?numbers={numbers}")
+    assert response.status_code == 400
+
+
+def test_manage_pool():
+    response = client.get("/manage/pool")
+    assert response.status_code == 200
+    assert {"checkouts", "in_use", "idle", "wait_time_avg"} <= response.json().keys()
+
+
+def test_manage_metrics():
+    client.get("/manage/health")
+    response = client.get("/manage/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/manage/health",status="200"}' in body
+    assert 'db_query_duration_seconds_count{query="fetch_flights"}' in body
+    assert "db_pool_in_use" in body
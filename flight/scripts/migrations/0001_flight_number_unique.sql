@@ -0,0 +1,4 @@
+-- Поиск рейса по номеру: GET /flights/{flight_number} и GET /flights?numbers=...
+-- Остаток неудачного CONCURRENTLY-построения (INVALID индекс) удаляется заранее
+DROP INDEX CONCURRENTLY IF EXISTS flight_flight_number_key;
+CREATE UNIQUE INDEX CONCURRENTLY flight_flight_number_key ON flight (flight_number);
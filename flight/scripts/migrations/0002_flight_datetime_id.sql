@@ -0,0 +1,3 @@
+-- Keyset-пагинация GET /flights по (datetime, id)
+DROP INDEX CONCURRENTLY IF EXISTS idx_flight_datetime_id;
+CREATE INDEX CONCURRENTLY idx_flight_datetime_id ON flight (datetime, id);
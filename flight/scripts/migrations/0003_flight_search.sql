@@ -0,0 +1,15 @@
+-- Поиск рейсов GET /flights/search.
+-- Название аэропорта для ответа ("город аэропорт") хранится готовым вместо
+-- concat(city, ' ', name) в каждой строке каждого запроса. concat не IMMUTABLE,
+-- поэтому выражение через ||, с тем же результатом для NULL
+ALTER TABLE airport ADD COLUMN IF NOT EXISTS display_name TEXT
+    GENERATED ALWAYS AS (coalesce(city, '') || ' ' || coalesce(name, '')) STORED;
+-- Маршрут и диапазон дат, сортировка по дате: WHERE from = ? AND to = ? AND datetime >= ?
+DROP INDEX CONCURRENTLY IF EXISTS idx_flight_route_datetime;
+CREATE INDEX CONCURRENTLY idx_flight_route_datetime ON flight (from_airport_id, to_airport_id, datetime, id);
+-- Маршрут и диапазон цен, сортировка по цене
+DROP INDEX CONCURRENTLY IF EXISTS idx_flight_route_price;
+CREATE INDEX CONCURRENTLY idx_flight_route_price ON flight (from_airport_id, to_airport_id, price, id);
+-- Только аэропорт прилета; только вылет обслуживает префикс индексов маршрута
+DROP INDEX CONCURRENTLY IF EXISTS idx_flight_to_datetime;
+CREATE INDEX CONCURRENTLY idx_flight_to_datetime ON flight (to_airport_id, datetime, id);
@@ -0,0 +1,57 @@
+import random
+
+from .breaker import OPEN, AsyncCircuitBreaker
+
+P2C = "p2c"
+LEAST_OUTSTANDING = "least_outstanding"
+
+
+class Upstream:
+    """Одна реплика сервиса: свой breaker на каждый маршрут клиента, число
+    запросов в полете и результат последней проверки /manage/health"""
+
+    def __init__(self, url: str, breakers: dict[str, AsyncCircuitBreaker]):
+        self.url = url
+        self.breakers = breakers
+        self.outstanding = 0
+        self.requests = 0
+        self.healthy = True
+
+    def available(self, route: str) -> bool:
+        return self.healthy and self.breakers[route].state != OPEN
+
+    def snapshot(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "breakers": {route: b.snapshot() for route, b in self.breakers.items()},
+        }
+
+
+class Balancer:
+    """Выбор реплики для запроса.
+
+    p2c - из двух случайных доступных реплик берется менее загруженная,
+    least_outstanding - реплика с наименьшим числом запросов в полете (при
+    равенстве - с меньшим числом запросов всего).
+    Реплика недоступна, пока ее breaker маршрута открыт или не прошла
+    проверка здоровья. Если недоступны все, выбор идет среди всех: лучше
+    отдать решение breaker-ам, чем отказать заранее."""
+
+    def __init__(self, upstreams: list[Upstream], strategy: str = P2C, rng=random):
+        if strategy not in (P2C, LEAST_OUTSTANDING):
+            raise ValueError(f"Unknown balancing strategy: {strategy}")
+        self.upstreams = upstreams
+        self.strategy = strategy
+        self._rng = rng
+
+    def pick(self, route: str, exclude: tuple = ()) -> Upstream:
+        rest = [u for u in self.upstreams if u not in exclude] or self.upstreams
+        candidates = [u for u in rest if u.available(route)] or rest
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.strategy == LEAST_OUTSTANDING:
+            return min(candidates, key=lambda u: (u.outstanding, u.requests))
+        first, second = self._rng.sample(candidates, 2)
+        return first if first.outstanding <= second.outstanding else second
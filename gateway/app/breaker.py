@@ -0,0 +1,243 @@
+import os
+import time
+from dataclasses import asdict, dataclass, replace
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+@dataclass(frozen=True)
+class BreakerConfig:
+    # Скользящее окно статистики в секундах, разбитое на buckets корзин
+    window: float = 10.0
+    buckets: int = 10
+    # Пока в окне меньше вызовов, доли ошибок и медленных вызовов не оцениваются
+    min_calls: int = 10
+    failure_rate: float = 0.5
+    slow_call_duration: float = 1.0
+    slow_call_rate: float = 0.8
+    # Сколько breaker остается открытым перед пробными вызовами
+    open_duration: float = 10.0
+    # Одновременных пробных вызовов в half-open; столько же успехов закрывают breaker
+    half_open_calls: int = 1
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, state: str):
+        super().__init__(f"Circuit breaker {name} is {state}")
+        self.name = name
+        self.state = state
+
+
+class _Bucket:
+    __slots__ = ("epoch", "calls", "failures", "slow")
+
+    def __init__(self):
+        self.epoch = -1
+        self.calls = self.failures = self.slow = 0
+
+
+class AsyncCircuitBreaker:
+    """Circuit breaker для корутин со скользящим по времени окном.
+
+    Открывается, когда в окне набралось min_calls вызовов и доля ошибок или
+    медленных вызовов превысила порог. Через open_duration переходит в
+    half-open и пропускает не больше half_open_calls одновременных пробных
+    вызовов, остальные отклоняются сразу. Ошибкой считаются только
+    исключения из failure_exceptions; отмена вызова не учитывается.
+
+    shared - состояние, общее для воркеров gateway (SharedBreakerState):
+    переходы публикуются в него, а чужие переходы принимаются перед каждым
+    вызовом. Окно статистики у каждого воркера свое; переход open ->
+    half-open по времени каждый воркер делает сам от общего времени
+    открытия, а разрешения на пробные вызовы и их успехи считаются в общем
+    слоте - half_open_calls ограничивает пробы всех воркеров вместе.
+    clock должен быть общим для процессов (time.monotonic)."""
+
+    def __init__(
+        self,
+        name: str,
+        config: BreakerConfig = BreakerConfig(),
+        failure_exceptions: tuple = (Exception,),
+        on_transition=None,
+        clock=time.monotonic,
+        shared=None,
+    ):
+        self.name = name
+        self.config = config
+        self.failure_exceptions = failure_exceptions
+        self._on_transition = on_transition
+        self._clock = clock
+        self._bucket_width = config.window / config.buckets
+        self._buckets = [_Bucket() for _ in range(config.buckets)]
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        # Номер текущего периода состояния: пробный вызов учитывается только
+        # в том half-open периоде, в котором он начался
+        self._generation = 0
+        self.rejected = 0
+        self._shared = shared
+        self._shared_version = shared.version() if shared is not None else 0
+        if self._shared_version:
+            self._sync()
+
+    @property
+    def state(self) -> str:
+        if self._shared is not None and self._shared.version() != self._shared_version:
+            self._sync()
+        if self._state == OPEN and self._clock() - self._opened_at >= self.config.open_duration:
+            self._transition(HALF_OPEN, publish=False)
+        return self._state
+
+    def _sync(self):
+        """Принять переход, опубликованный другим воркером"""
+        self._shared_version, state, opened_at = self._shared.load()
+        if state != self._state:
+            self._transition(state, opened_at=opened_at, publish=False)
+        elif state == OPEN:
+            self._opened_at = opened_at
+
+    def _transition(self, state: str, opened_at: float | None = None, publish: bool = True):
+        previous, self._state = self._state, state
+        self._generation += 1
+        self._probes = 0
+        self._probe_successes = 0
+        if state == OPEN:
+            self._opened_at = self._clock() if opened_at is None else opened_at
+        if state == CLOSED:
+            self._buckets = [_Bucket() for _ in range(self.config.buckets)]
+        if publish and self._shared is not None:
+            self._shared_version = self._shared.store(state, self._opened_at)
+        if self._on_transition is not None:
+            self._on_transition(self, previous, state)
+
+    def half_open(self):
+        """Досрочный переход open -> half-open, например после успешной
+        проверки здоровья upstream-а"""
+        if self.state == OPEN:
+            self._transition(HALF_OPEN)
+
+    def _bucket(self, now: float) -> _Bucket:
+        epoch = int(now / self._bucket_width)
+        bucket = self._buckets[epoch % self.config.buckets]
+        if bucket.epoch != epoch:
+            bucket.epoch = epoch
+            bucket.calls = bucket.failures = bucket.slow = 0
+        return bucket
+
+    def window_stats(self) -> dict:
+        oldest = int(self._clock() / self._bucket_width) - self.config.buckets
+        calls = failures = slow = 0
+        for bucket in self._buckets:
+            if bucket.epoch > oldest:
+                calls += bucket.calls
+                failures += bucket.failures
+                slow += bucket.slow
+        return {"calls": calls, "failures": failures, "slow": slow}
+
+    def _take_probe(self) -> bool:
+        if self._shared is None:
+            return self._probes < self.config.half_open_calls
+        # Брошенное упавшим воркером разрешение освобождается через open_duration
+        return self._shared.acquire_probe(
+            self._shared_version, self.config.half_open_calls, self._clock(), self.config.open_duration
+        )
+
+    def _release_probe(self, succeeded: bool) -> int:
+        """Освобождает разрешение; число успешных проб текущего периода"""
+        self._probes -= 1
+        self._probe_successes += succeeded
+        if self._shared is None:
+            return self._probe_successes
+        return self._shared.release_probe(self._shared_version, succeeded)
+
+    def _acquire(self) -> int | None:
+        """Разрешение на вызов; для пробного вызова - номер half-open периода"""
+        state = self.state
+        if state == CLOSED:
+            return None
+        if state == HALF_OPEN and self._take_probe():
+            self._probes += 1
+            return self._generation
+        self.rejected += 1
+        raise CircuitOpenError(self.name, state)
+
+    def _record(self, failed: bool, duration: float, probe: int | None):
+        slow = duration >= self.config.slow_call_duration
+        if probe is not None:
+            # Чтение state принимает переход, опубликованный другим воркером
+            if self.state != HALF_OPEN or probe != self._generation:
+                # Другой пробный вызов уже решил исход
+                return
+            if failed or slow:
+                self._transition(OPEN)
+                return
+            if self._release_probe(True) >= self.config.half_open_calls:
+                self._transition(CLOSED)
+            return
+        if self._state != CLOSED:
+            # Вызов начался до открытия breaker-а и ничего не меняет
+            return
+
+        bucket = self._bucket(self._clock())
+        bucket.calls += 1
+        bucket.failures += failed
+        bucket.slow += slow
+
+        stats = self.window_stats()
+        if stats["calls"] < self.config.min_calls:
+            return
+        if (
+            stats["failures"] / stats["calls"] >= self.config.failure_rate
+            or stats["slow"] / stats["calls"] >= self.config.slow_call_rate
+        ):
+            self._transition(OPEN)
+
+    async def call(self, fn, *args, **kwargs):
+        probe = self._acquire()
+        started = self._clock()
+        try:
+            result = await fn(*args, **kwargs)
+        except self.failure_exceptions:
+            self._record(True, self._clock() - started, probe)
+            raise
+        except BaseException:
+            # Отмена или чужая ошибка: пробный слот освобождается без учета
+            if probe is not None and probe == self._generation:
+                self._release_probe(False)
+            raise
+        self._record(False, self._clock() - started, probe)
+        return result
+
+    def snapshot(self) -> dict:
+        state = self.state
+        snapshot = {
+            "name": self.name,
+            "state": state,
+            "window": self.window_stats(),
+            "rejected": self.rejected,
+            "config": asdict(self.config),
+        }
+        if state == OPEN:
+            snapshot["open_remaining"] = max(
+                0.0, self.config.open_duration - (self._clock() - self._opened_at)
+            )
+        if state == HALF_OPEN:
+            snapshot["probes_in_flight"] = (
+                self._probes if self._shared is None else self._shared.probes()
+            )
+        return snapshot
+
+
+def config_from_env(prefix: str, base: BreakerConfig) -> BreakerConfig:
+    """Переопределение полей из <prefix>_BREAKER_<FIELD>, например
+    BONUS_SERVICE_BREAKER_FAILURE_RATE=0.3"""
+    overrides = {}
+    for name, default in asdict(base).items():
+        value = os.getenv(f"{prefix}_BREAKER_{name.upper()}")
+        if value:
+            overrides[name] = type(default)(value)
+    return replace(base, **overrides)
@@ -0,0 +1,192 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, NamedTuple
+
+from .singleflight import SingleFlight
+
+_MISSING = object()
+
+
+class Versioned(NamedTuple):
+    """Значение вместе с ETag ответа upstream-а: по истечении TTL загрузчик
+    может ревалидировать его условным запросом вместо полной загрузки"""
+
+    value: Any
+    etag: str | None = None
+
+
+class TTLCache:
+    """In-process read-through кэш с ограничением размера, TTL и LRU-вытеснением.
+
+    Просроченная запись не удаляется сразу: пока ее не вытеснил LRU, она может
+    быть отдана как устаревшая (stale), если загрузка упала с ошибкой из
+    stale_on - например, при открытом circuit breaker. Одновременные промахи
+    по одному ключу дают одну загрузку. Загрузчик возвращает None, если
+    значения нет; такой результат не кэшируется.
+
+    После attach инвалидации и очистки публикуются в общий журнал
+    (InvalidationLog) и применяются кэшами с тем же именем в других
+    воркерах gateway перед каждым чтением."""
+
+    def __init__(self, max_size: int, ttl: float, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._data: OrderedDict = OrderedDict()
+        self._inflight = SingleFlight()
+        self._log = None
+        self._name = None
+        self._cursor = 0
+        # Экспортируются как счетчики Prometheus - только растут, очистка
+        # кэша их не сбрасывает
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+
+    def attach(self, log, name: str):
+        self._log = log
+        self._name = name
+        self._cursor = log.head()
+
+    def _sync(self):
+        if self._log is None:
+            return
+        self._cursor, events = self._log.poll(self._cursor)
+        if events is None:
+            # Журнал ушел вперед дальше своей емкости - часть событий потеряна
+            self._data.clear()
+            return
+        for name, key in events:
+            if name != self._name:
+                continue
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def _lookup(self, key, allow_stale: bool = False):
+        self._sync()
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        value, expires_at = entry
+        if not allow_stale and expires_at <= self._clock():
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def _stale(self, key):
+        value = self._lookup(key, allow_stale=True)
+        if value is not _MISSING:
+            self.stale_hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, self._clock() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key):
+        """Запись, в том числе просроченная, без учета в статистике; None, если ее нет"""
+        self._sync()
+        entry = self._data.get(key)
+        return entry[0] if entry is not None else None
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+        if self._log is not None:
+            # Свое событие этот кэш потом прочтет из журнала еще раз, это безвредно
+            self._log.publish(self._name, key)
+
+    def clear(self):
+        self._data.clear()
+        if self._log is not None:
+            self._log.publish(self._name, None)
+
+    async def get(self, key, load, stale_on=()):
+        value = self._lookup(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        self.misses += 1
+
+        async def load_and_store():
+            loaded = await load(key)
+            if loaded is not None:
+                self.set(key, loaded)
+            return loaded
+
+        try:
+            return await self._inflight.do(key, load_and_store)
+        except stale_on:
+            stale = self._stale(key)
+            if stale is _MISSING:
+                raise
+            return stale
+
+    async def get_many(self, keys, load_many, stale_on=(), batch_size: int = 100) -> dict:
+        """Пакетный вариант get: промахи загружаются пакетами по batch_size
+        параллельно, load_many(batch) возвращает dict ключ -> значение.
+
+        Ошибка из stale_on затрагивает только ключи своего пакета: для них
+        отдается stale-значение или None."""
+        result = {}
+        waiting = {}
+        to_load = []
+        for key in dict.fromkeys(keys):
+            value = self._lookup(key)
+            if value is not _MISSING:
+                self.hits += 1
+                result[key] = value
+                continue
+            self.misses += 1
+            future, leader = self._inflight.join(key)
+            if leader:
+                to_load.append(key)
+            waiting[key] = future
+
+        async def load_batch(batch):
+            try:
+                loaded = await load_many(batch)
+            except BaseException as exc:
+                for key in batch:
+                    self._inflight.reject(key, exc)
+                if not isinstance(exc, Exception):
+                    raise
+                return
+            for key in batch:
+                value = loaded.get(key)
+                if value is not None:
+                    self.set(key, value)
+                self._inflight.resolve(key, value)
+
+        await asyncio.gather(
+            *(
+                load_batch(to_load[i : i + batch_size])
+                for i in range(0, len(to_load), batch_size)
+            )
+        )
+
+        for key, future in waiting.items():
+            try:
+                result[key] = await asyncio.shield(future)
+            except stale_on:
+                stale = self._stale(key)
+                result[key] = None if stale is _MISSING else stale
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale_hits": self.stale_hits,
+            "coalesced": self._inflight.shared,
+        }
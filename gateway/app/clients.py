@@ -1,10 +1,24 @@
+import asyncio
 import os
 import httpx
 import logging
+from time import perf_counter
 from fastapi import HTTPException
-from circuitbreaker import circuit, CircuitBreaker  #
 
-logging.basicConfig(level=logging.INFO)
+from .balancer import P2C, Balancer, Upstream
+from .breaker import AsyncCircuitBreaker, BreakerConfig, CircuitOpenError, config_from_env
+from .latency import LatencyTracker, hedge_budget
+from .metrics import (
+    observe_upstream,
+    record_breaker_rejection,
+    record_breaker_transition,
+    record_coalesced,
+    record_hedge,
+)
+from .shared import shared_state
+from .singleflight import SingleFlight
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 logger = logging.getLogger("gateway")
 
 
@@ -15,64 +29,429 @@ class ServiceUnavailableException(HTTPException):
         super().__init__(status_code=503, detail=detail)
 
 
+def _conditional(etag: str | None) -> dict:
+    return {"If-None-Match": etag} if etag else {}
+
+
+def _env_number(name: str, default, cast=float):
+    value = os.getenv(name)
+    return cast(value) if value else default
+
+
 class BaseClient:
-    def __init__(self, base_url: str, service_name: str):
-        self.base_url = base_url.rstrip("/")
-        self.breaker = CircuitBreaker(
-            name=f"{service_name}_breaker",
-            failure_threshold=3,
-            recovery_timeout=10,
-            expected_exception=httpx.HTTPError,
+    # Лимиты пула по умолчанию; переопределяются в наследниках и через
+    # переменные окружения <SERVICE>_SERVICE_MAX_CONNECTIONS и т.д.
+    max_connections = 50
+    max_keepalive_connections = 20
+    keepalive_expiry = 30.0
+    timeout = 2.0
+    connect_timeout = 1.0
+    # Breaker клиента; маршруты из route_breakers получают собственный
+    # breaker со своими настройками (см. _request(route=...))
+    breaker_config = BreakerConfig()
+    route_breakers: dict[str, BreakerConfig] = {}
+    # Хеджирование идемпотентных чтений (см. _request(hedge=True)) и
+    # адаптивный таймаут GET-запросов: p99 * timeout_factor в пределах
+    # [min_timeout, timeout]
+    hedging = True
+    # Одновременные одинаковые GET-запросы (метод, путь, параметры,
+    # заголовки) получают один ответ upstream-а; не зависит от кэшей
+    coalescing = True
+    timeout_factor = 3.0
+    min_timeout = 0.1
+    # Балансировка между репликами (<SERVICE>_SERVICE_HOST - адреса через
+    # запятую) и период проверки /manage/health, если реплик больше одной
+    balancing = P2C
+    health_interval = 5.0
+
+    def __init__(
+        self,
+        base_url: str,
+        service_name: str,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.service_name = service_name
+        self._transport = transport
+        self._client: httpx.AsyncClient | None = None
+        self._health_task: asyncio.Task | None = None
+
+        prefix = f"{service_name.upper()}_SERVICE"
+        self.limits = httpx.Limits(
+            max_connections=_env_number(
+                f"{prefix}_MAX_CONNECTIONS", self.max_connections, int
+            ),
+            max_keepalive_connections=_env_number(
+                f"{prefix}_MAX_KEEPALIVE", self.max_keepalive_connections, int
+            ),
+            keepalive_expiry=_env_number(
+                f"{prefix}_KEEPALIVE_EXPIRY", self.keepalive_expiry
+            ),
+        )
+        self.timeouts = httpx.Timeout(
+            _env_number(f"{prefix}_TIMEOUT", self.timeout),
+            connect=_env_number(f"{prefix}_CONNECT_TIMEOUT", self.connect_timeout),
         )
 
-    async def _request(self, method: str, path: str, **kwargs):
-        url = f"{self.base_url}{path}"
-        headers = kwargs.get("headers", {})
-        body = kwargs.get("json") or kwargs.get("content")
+        self.hedging = os.getenv(f"{prefix}_HEDGING", str(self.hedging)).lower() in ("1", "true", "yes", "on")
+        self.hedge_budget = hedge_budget
+        self.coalescing = os.getenv(f"{prefix}_COALESCING", str(self.coalescing)).lower() in ("1", "true", "yes", "on")
+        self.inflight = SingleFlight()
+        self.latency = LatencyTracker(
+            default_timeout=self.timeouts.read,
+            timeout_factor=_env_number(f"{prefix}_TIMEOUT_FACTOR", self.timeout_factor),
+            min_timeout=_env_number(f"{prefix}_MIN_TIMEOUT", self.min_timeout),
+        )
 
-        logger.info(
-            f"--> [OUTGOING] {method} {url} | Breaker State: {self.breaker.state}"
+        configs = {"default": config_from_env(prefix, self.breaker_config)}
+        configs.update(self.route_breakers)
+        self.upstreams = [
+            Upstream(url, {
+                route: self._make_breaker(route, url, config)
+                for route, config in configs.items()
+            })
+            for url in (u.strip().rstrip("/") for u in base_url.split(","))
+            if url
+        ]
+        self.balancer = Balancer(
+            self.upstreams, os.getenv(f"{prefix}_BALANCING", self.balancing)
         )
+        self.health_interval = _env_number(
+            f"{prefix}_HEALTH_INTERVAL", self.health_interval
+        )
+
+    def _make_breaker(self, route: str, url: str, config: BreakerConfig) -> AsyncCircuitBreaker:
+        def on_transition(breaker, previous, state):
+            logger.warning(
+                f"Circuit breaker {self.service_name}/{route} {url}: {previous} -> {state}"
+            )
+            record_breaker_transition(self.service_name, route, previous, state)
+
+        # Между воркерами gateway breaker реплики общий: открыв его в одном
+        # процессе, ошибки upstream-а перестают получать все
+        shared = shared_state.breaker(f"{self.service_name}/{route} {url}") if shared_state else None
+        return AsyncCircuitBreaker(
+            f"{self.service_name}/{route}",
+            config,
+            failure_exceptions=(httpx.HTTPError,),
+            on_transition=on_transition,
+            shared=shared,
+        )
+
+    def breaker_state(self, route: str = "default") -> str:
+        """Состояние маршрута по всем репликам: closed, если хотя бы одна
+        реплика принимает запросы, иначе half_open или open"""
+        states = {u.breakers[route].state for u in self.upstreams}
+        for state in ("closed", "half_open"):
+            if state in states:
+                return state
+        return "open"
 
+    async def check_health(self):
+        await asyncio.gather(*(self._probe(u) for u in self.upstreams))
+
+    async def _probe(self, upstream: Upstream):
         try:
-            return await self.breaker.call(
-                self._execute_http_call, method, url, **kwargs
+            response = await self.client.get(
+                f"{upstream.url}/manage/health", timeout=self.timeouts.connect
+            )
+            healthy = response.status_code == 200
+        except httpx.HTTPError:
+            healthy = False
+        if healthy != upstream.healthy:
+            logger.warning(
+                f"Upstream {self.service_name} {upstream.url} is "
+                f"{'healthy' if healthy else 'unhealthy'}"
             )
+        upstream.healthy = healthy
+        if healthy:
+            # Реплика снова отвечает - пробные запросы пойдут, не дожидаясь
+            # истечения open_duration breaker-а
+            for breaker in upstream.breakers.values():
+                breaker.half_open()
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check_health()
+            except Exception as exc:
+                logger.error(f"Health check of {self.service_name} failed: {exc!r}")
+
+    async def start(self):
+        """Открывает пул соединений; вызывается из lifespan приложения"""
+        if len(self.upstreams) > 1 and self.health_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+        return self.client
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Если lifespan не запускался (например, в тестах), пул создается лениво
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeouts,
+                transport=self._transport,
+            )
+        return self._client
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        route: str = "default",
+        endpoint: str | None = None,
+        hedge: bool = False,
+        **kwargs,
+    ):
+        """route выбирает breaker, endpoint - окно задержек для таймаута и
+        хеджирования; hedge=True допустим только для идемпотентных запросов.
+        GET без тела при включенном coalescing объединяется с одновременными
+        такими же запросами: в upstream уходит один, ответ (или ошибка)
+        достается всем."""
+        if route not in self.upstreams[0].breakers:
+            route = "default"
+        endpoint = endpoint or route
+        if not self.coalescing or method != "GET" or kwargs.keys() - {"params", "headers"}:
+            return await self._send(method, path, route, endpoint, hedge, **kwargs)
+
+        key = (
+            method,
+            path,
+            tuple(sorted((kwargs.get("params") or {}).items())),
+            tuple(sorted((kwargs.get("headers") or {}).items())),
+        )
+        record_coalesced(
+            self.service_name, endpoint, "shared" if self.inflight.pending(key) else "leader"
+        )
+        return await self.inflight.share(
+            key, lambda: self._send(method, path, route, endpoint, hedge, **kwargs)
+        )
+
+    async def _send(self, method: str, path: str, route: str, endpoint: str, hedge: bool, **kwargs):
+        call = self._hedged_call if hedge and self.hedging else self._attempt
+
+        start = perf_counter()
+        outcome = "ok"
+        try:
+            return await call(method, path, route, endpoint, **kwargs)
+        except CircuitOpenError as exc:
+            outcome = "rejected"
+            record_breaker_rejection(self.service_name, route)
+            logger.error(f"!!! [CB BLOCK] {method} {path} | Reason: {str(exc)}")
+            raise ServiceUnavailableException()
         except Exception as exc:
-            logger.error(f"!!! [CB BLOCK] {method} {url} | Reason: {str(exc)}")
+            outcome = "error"
+            logger.error(f"!!! [CB BLOCK] {method} {path} | Reason: {str(exc)}")
             raise ServiceUnavailableException()
+        finally:
+            observe_upstream(self.service_name, method, outcome, perf_counter() - start)
+
+    async def _attempt(
+        self, method: str, path: str, route: str, endpoint: str,
+        upstream: Upstream | None = None, **kwargs,
+    ):
+        """Одна попытка запроса через breaker реплики; по умолчанию реплику
+        выбирает балансировщик"""
+        upstream = upstream or self.balancer.pick(route)
+        breaker = upstream.breakers[route]
+        url = f"{upstream.url}{path}"
+        logger.info(
+            f"--> [OUTGOING] {method} {url} | Breaker State: {breaker.state}"
+        )
+        upstream.outstanding += 1
+        upstream.requests += 1
+        try:
+            return await breaker.call(self._execute_http_call, method, url, endpoint, **kwargs)
+        finally:
+            upstream.outstanding -= 1
 
-    async def _execute_http_call(self, method: str, url: str, **kwargs):
+    async def _execute_http_call(
+        self, method: str, url: str, endpoint: str = "default", stream: bool = False, **kwargs
+    ):
         """Метод, который реально выполняет запрос к сети"""
-        async with httpx.AsyncClient() as client:
-            response = await client.request(method, url, timeout=2.0, **kwargs)
-            if response.status_code >= 500:
-                raise httpx.HTTPStatusError(
-                    f"Server error {response.status_code}",
-                    request=response.request,
-                    response=response,
-                )
-            return response
+        if stream:
+            return await self._execute_stream_call(method, url, **kwargs)
+        # Запись, прерванная по таймауту, могла примениться - для нее
+        # таймаут остается статическим
+        timeout = self.latency.timeout_for(endpoint) if method == "GET" else self.timeouts.read
+        started = perf_counter()
+        try:
+            response = await self.client.request(
+                method,
+                url,
+                timeout=httpx.Timeout(timeout, connect=self.timeouts.connect),
+                **kwargs,
+            )
+        except httpx.TimeoutException:
+            # Замер снизу: запрос шел не меньше таймаута. Без него окно видело
+            # бы только быстрые ответы, и таймаут продолжал бы сжиматься
+            self.latency.observe(endpoint, timeout)
+            raise
+        self.latency.observe(endpoint, perf_counter() - started)
+        if response.status_code >= 500:
+            raise httpx.HTTPStatusError(
+                f"Server error {response.status_code}",
+                request=response.request,
+                response=response,
+            )
+        return response
+
+    async def _execute_stream_call(self, method: str, url: str, **kwargs):
+        """Запрос, тело ответа которого не читается: вызывающий отдает его
+        дальше через aiter_bytes и закрывает aclose. Время выгрузки зависит
+        от объема, поэтому таймаут статический и в окно задержек не попадает"""
+        request = self.client.build_request(method, url, timeout=self.timeouts, **kwargs)
+        response = await self.client.send(request, stream=True)
+        if response.status_code >= 500:
+            await response.aclose()
+            raise httpx.HTTPStatusError(
+                f"Server error {response.status_code}",
+                request=response.request,
+                response=response,
+            )
+        return response
+
+    async def _hedged_call(self, method: str, path: str, route: str, endpoint: str, **kwargs):
+        """Если ответа нет дольше p95 endpoint-а, отправляет вторую попытку
+        (при наличии бюджета, по возможности на другую реплику) и возвращает
+        первый успешный ответ"""
+        self.hedge_budget.deposit()
+        delay = self.latency.hedge_delay(endpoint)
+        first = self.balancer.pick(route)
+        attempts = [
+            asyncio.create_task(self._attempt(method, path, route, endpoint, first, **kwargs))
+        ]
+        started = [perf_counter()]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(attempts, timeout=delay)
+                if not done:
+                    if self.hedge_budget.try_spend():
+                        record_hedge(self.service_name, endpoint, "fired")
+                        second = self.balancer.pick(route, exclude=(first,))
+                        attempts.append(asyncio.create_task(self._attempt(
+                            method, path, route, endpoint, second, **kwargs
+                        )))
+                        started.append(perf_counter())
+                    else:
+                        record_hedge(self.service_name, endpoint, "budget_exhausted")
+
+            pending = set(attempts)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not attempts[0]:
+                            record_hedge(self.service_name, endpoint, "won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            now = perf_counter()
+            for task, began in zip(attempts, started):
+                if task.done():
+                    continue
+                task.cancel()
+                # Проигравшая попытка ответила бы не раньше, чем через столько
+                # секунд. Без этого замера в окне остаются только быстрые
+                # победители, и p95 с таймаутом сползают вниз
+                self.latency.observe(endpoint, now - began)
 
 
 class FlightClient(BaseClient):
-    async def get_flights(self, page: int, size: int):
+    # Самый нагруженный сервис: на каждый билет идет запрос рейса
+    max_connections = 100
+    max_keepalive_connections = 50
+    # Пакет до 100 рейсов отвечает дольше одиночного запроса и не должен
+    # открывать breaker для get_flight
+    route_breakers = {"flights_batch": BreakerConfig(slow_call_duration=1.5)}
+
+    async def get_flights(self, page: int, size: int, etag: str | None = None):
         return await self._request(
-            "GET", "/flights", params={"page": page, "size": size}
+            "GET",
+            "/flights",
+            endpoint="get_flights",
+            params={"page": page, "size": size},
+            headers=_conditional(etag),
         )
 
-    async def get_flight(self, flight_number: str):
-        return await self._request("GET", f"/flights/{flight_number}")
+    async def get_flight(self, flight_number: str, etag: str | None = None):
+        """С etag - условный запрос: 304 без тела, если рейс не менялся"""
+        return await self._request(
+            "GET",
+            f"/flights/{flight_number}",
+            endpoint="get_flight",
+            hedge=True,
+            headers=_conditional(etag),
+        )
+
+    async def search_flights(self, filters: dict):
+        """filters - параметры GET /flights/search, None пропускаются"""
+        return await self._request(
+            "GET",
+            "/flights/search",
+            endpoint="search_flights",
+            hedge=True,
+            params={k: v for k, v in filters.items() if v is not None},
+        )
+
+    async def get_flights_by_numbers(self, flight_numbers: list[str]):
+        return await self._request(
+            "GET",
+            "/flights",
+            route="flights_batch",
+            params={"numbers": ",".join(flight_numbers)},
+        )
 
 
 class TicketClient(BaseClient):
-    async def get_tickets(self, username: str):
-        return await self._request("GET", "/tickets", headers={"X-User-Name": username})
+    async def get_tickets(
+        self,
+        username: str,
+        status: str | None = None,
+        limit: int | None = None,
+        cursor: str | None = None,
+        fields: list[str] | None = None,
+    ):
+        params = {"status": status, "limit": limit, "cursor": cursor}
+        if fields:
+            params["fields"] = ",".join(fields)
+        return await self._request(
+            "GET",
+            "/tickets",
+            endpoint="get_tickets",
+            hedge=True,
+            headers={"X-User-Name": username},
+            params={k: v for k, v in params.items() if v is not None},
+        )
+
+    async def export_tickets(self, username: str, status: str | None = None):
+        """Потоковая выгрузка всех билетов в NDJSON: ответ не прочитан,
+        после передачи тела его нужно закрыть"""
+        params = {"status": status} if status else {}
+        return await self._request(
+            "GET",
+            "/tickets/export",
+            endpoint="export_tickets",
+            stream=True,
+            headers={"X-User-Name": username},
+            params=params,
+        )
 
     async def create_ticket(self, username: str, ticket_uuid, price, flight_number):
         return await self._request(
             "POST",
             "/tickets",
+            endpoint="create_ticket",
             json={
                 "flightNumber": flight_number,
                 "price": price,
@@ -82,19 +461,65 @@ class TicketClient(BaseClient):
         )
 
     async def delete_ticket(self, username: str, ticket_uid: str):
-        return await self._request("PATCH", f"/tickets/{ticket_uid}", json={"username": username, "status": "CANCELED"})
+        return await self._request(
+            "PATCH",
+            f"/tickets/{ticket_uid}",
+            endpoint="delete_ticket",
+            json={"username": username, "status": "CANCELED"},
+        )
 
     async def get_ticket_by_uid(self, username: str, ticket_uid: str):
         return await self._request(
-            "GET", f"/tickets/{ticket_uid}", params={"username": username}
+            "GET",
+            f"/tickets/{ticket_uid}",
+            endpoint="get_ticket_by_uid",
+            params={"username": username},
         )
 
 
 class BonusClient(BaseClient):
-    async def get_privilege(self, username: str):
+    async def get_privilege(self, username: str, etag: str | None = None):
         return await self._request(
             "GET",
             "/privilege",
+            endpoint="get_privilege",
+            hedge=True,
+            params={"username": username},
+            headers=_conditional(etag),
+        )
+
+    async def get_privilege_balance(self, username: str):
+        return await self._request(
+            "GET",
+            "/privilege/balance",
+            endpoint="get_privilege_balance",
+            hedge=True,
+            params={"username": username},
+        )
+
+    async def get_privilege_history(
+        self, username: str, since: str | None = None, limit: int | None = None
+    ):
+        params = {"username": username}
+        if since is not None:
+            params["since"] = since
+        if limit is not None:
+            params["limit"] = limit
+        return await self._request(
+            "GET",
+            "/privilege/history",
+            endpoint="get_privilege_history",
+            hedge=True,
+            params=params,
+        )
+
+    async def export_history(self, username: str):
+        """Потоковая выгрузка всей истории баланса в NDJSON"""
+        return await self._request(
+            "GET",
+            "/privilege/history/export",
+            endpoint="export_history",
+            stream=True,
             params={"username": username},
         )
 
@@ -104,6 +529,7 @@ class BonusClient(BaseClient):
         return await self._request(
             "POST",
             "/privilege/calculate",
+            endpoint="calculate",
             json={
                 "ticketUid": ticket_uuid,
                 "price": price,
@@ -116,5 +542,6 @@ class BonusClient(BaseClient):
         return await self._request(
             "POST",
             f"/privilege/rollback/{ticket_uid}",
+            endpoint="rollback",
             json={"username": username, "price": price},
         )
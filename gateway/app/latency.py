@@ -0,0 +1,127 @@
+import os
+from collections import deque
+
+
+class LatencyWindow:
+    """Последние size длительностей вызовов одного endpoint-а.
+
+    Перцентили пересчитываются не на каждый вызов, а раз в recompute_every
+    новых замеров - сортировка окна на горячем пути слишком дорогая."""
+
+    def __init__(self, size: int = 512, recompute_every: int = 32):
+        self.samples = deque(maxlen=size)
+        self.recompute_every = recompute_every
+        self._sorted: list[float] | None = None
+        self._new = 0
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self._new += 1
+
+    def percentile(self, q: float) -> float | None:
+        if not self.samples:
+            return None
+        if self._sorted is None or self._new >= self.recompute_every:
+            self._sorted = sorted(self.samples)
+            self._new = 0
+        index = min(len(self._sorted) - 1, int(q * len(self._sorted)))
+        return self._sorted[index]
+
+
+class LatencyTracker:
+    """Наблюдаемые задержки по endpoint-ам клиента и производные от них
+    таймауты и задержки хеджирования.
+
+    Пока замеров меньше min_samples, используется статический таймаут
+    клиента и хеджирование не включается."""
+
+    def __init__(
+        self,
+        default_timeout: float,
+        min_samples: int = 50,
+        timeout_factor: float = 3.0,
+        min_timeout: float = 0.1,
+        hedge_percentile: float = 0.95,
+    ):
+        self.default_timeout = default_timeout
+        self.min_samples = min_samples
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self.hedge_percentile = hedge_percentile
+        self._windows: dict[str, LatencyWindow] = {}
+
+    def observe(self, endpoint: str, seconds: float):
+        window = self._windows.get(endpoint)
+        if window is None:
+            window = self._windows[endpoint] = LatencyWindow()
+        window.add(seconds)
+
+    def _percentile(self, endpoint: str, q: float) -> float | None:
+        window = self._windows.get(endpoint)
+        if window is None or len(window.samples) < self.min_samples:
+            return None
+        return window.percentile(q)
+
+    def timeout_for(self, endpoint: str) -> float:
+        """p99 * timeout_factor, но не меньше min_timeout и не больше
+        статического таймаута клиента"""
+        p99 = self._percentile(endpoint, 0.99)
+        if p99 is None:
+            return self.default_timeout
+        return min(self.default_timeout, max(self.min_timeout, p99 * self.timeout_factor))
+
+    def hedge_delay(self, endpoint: str) -> float | None:
+        return self._percentile(endpoint, self.hedge_percentile)
+
+    def stats(self) -> dict:
+        result = {}
+        for endpoint, window in self._windows.items():
+            result[endpoint] = {
+                "samples": len(window.samples),
+                "p50": window.percentile(0.5),
+                "p95": window.percentile(0.95),
+                "p99": window.percentile(0.99),
+                "timeout": self.timeout_for(endpoint),
+                "hedge_delay": self.hedge_delay(endpoint),
+            }
+        return result
+
+
+class HedgeBudget:
+    """Общий на все клиенты лимит повторных (хеджирующих) попыток.
+
+    Каждый запрос, который можно хеджировать, добавляет ratio токена (но не
+    больше burst), каждая повторная попытка тратит один токен. Так повторов
+    не бывает больше ratio от потока даже при общей деградации upstream-ов."""
+
+    def __init__(self, ratio: float = 0.1, burst: float = 10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.spent = 0
+        self.denied = 0
+
+    def deposit(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens < 1:
+            self.denied += 1
+            return False
+        self.tokens -= 1
+        self.spent += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "ratio": self.ratio,
+            "tokens": self.tokens,
+            "spent": self.spent,
+            "denied": self.denied,
+        }
+
+
+hedge_budget = HedgeBudget(
+    ratio=float(os.getenv("HEDGE_BUDGET_RATIO", "0.1")),
+    burst=float(os.getenv("HEDGE_BUDGET_BURST", "10")),
+)
@@ -1,8 +1,12 @@
+import json
 import os
-from fastapi import FastAPI, Header, HTTPException, Query, BackgroundTasks, Response
+from fastapi import FastAPI, Header, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Literal
 
 import asyncio
 
@@ -11,11 +15,116 @@ from .clients import (
     TicketClient,
     BonusClient,
     ServiceUnavailableException,
+    logger,
 )
+from .cache import TTLCache, Versioned
+from .responses import FastJSONResponse, upstream_response, upstream_stream
+from .retry_queue import QueueFull, RetryQueue
+from .saga import Replayed, Saga, Step, StepRejected
+from .shared import shared_state
+from .metrics import GatewayCollector, MetricsMiddleware, metrics_response, register_collector
 
 load_dotenv()
 
-app = FastAPI(title="Gateway Service")
+flight_client = FlightClient(os.getenv("FLIGHT_SERVICE_HOST"), "flight")
+ticket_client = TicketClient(os.getenv("TICKET_SERVICE_HOST"), "ticket")
+bonus_client = BonusClient(os.getenv("BONUS_SERVICE_HOST"), "bonus")
+
+# Данные рейсов почти не меняются, поэтому gateway держит их в памяти
+flight_cache = TTLCache(
+    max_size=int(os.getenv("FLIGHT_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("FLIGHT_CACHE_TTL", "300")),
+)
+
+
+def drain_concurrency(client):
+    """Сколько воркеров очереди разбирают задачи upstream-а client: пока его
+    breaker открыт - ни одного, в half-open - один пробный"""
+
+    def concurrency() -> int:
+        state = client.breaker_state()
+        return {"open": 0, "half_open": 1}.get(state, retry_queue.workers)
+
+    return concurrency
+
+
+# Последний ответ bonus service по пользователю с его ETag. TTL нулевой:
+# каждый запрос ревалидируется, и неизменившийся профиль стоит 304 без тела
+privilege_cache = TTLCache(
+    max_size=int(os.getenv("PRIVILEGE_CACHE_SIZE", "10000")), ttl=0
+)
+
+# Результаты покупок по заголовку Idempotency-Key: повтор запроса клиентом
+# получает сохраненный ответ. Кэш у каждого воркера свой: после перезапуска
+# gateway, вытеснения записи или если повтор попал в другой воркер, его
+# дедуплицируют сами сервисы по uid билета, выведенному из ключа
+idempotency_cache = TTLCache(
+    max_size=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("IDEMPOTENCY_TTL", "86400")),
+)
+IDEMPOTENCY_NAMESPACE = uuid.UUID("3f0c6f43-5b8e-4c55-9d43-2a6f0b7e8c11")
+
+CACHES = {
+    "flights": flight_cache,
+    "privileges": privilege_cache,
+    "idempotency": idempotency_cache,
+}
+# Несколько воркеров: инвалидация в одном применяется во всех
+if shared_state is not None:
+    for name, cache in CACHES.items():
+        cache.attach(shared_state.invalidations, name)
+
+
+# Откаты бонусов и отмены билетов, которые не удалось выполнить сразу
+retry_queue = RetryQueue(
+    os.getenv("RETRY_QUEUE_PATH", "data/retry_queue.sqlite3"),
+    max_size=int(os.getenv("RETRY_QUEUE_MAX_SIZE", "10000")),
+    workers=int(os.getenv("RETRY_QUEUE_WORKERS", "4")),
+    backoff_max=float(os.getenv("RETRY_QUEUE_BACKOFF_MAX", "300")),
+    max_attempts=int(os.getenv("RETRY_QUEUE_MAX_ATTEMPTS", "20")),
+    # Очередь общая для воркеров, разбирает ее один
+    leader=shared_state.leader("retry-queue") if shared_state is not None else None,
+)
+
+
+async def rollback_bonus(payload: dict):
+    await bonus_client.rollback(
+        payload["username"], payload["ticketUid"], payload["price"]
+    )
+
+
+async def cancel_ticket(payload: dict):
+    await ticket_client.delete_ticket(payload["username"], payload["ticketUid"])
+
+
+retry_queue.register("bonus_rollback", rollback_bonus, drain_concurrency(bonus_client))
+retry_queue.register("ticket_cancel", cancel_ticket, drain_concurrency(ticket_client))
+
+register_collector(
+    GatewayCollector(
+        (flight_client, ticket_client, bonus_client),
+        CACHES,
+        retry_queue,
+    )
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    clients = (flight_client, ticket_client, bonus_client)
+    for client in clients:
+        await client.start()
+    await retry_queue.start()
+    yield
+    await retry_queue.stop()
+    for client in clients:
+        await client.close()
+
+
+app = FastAPI(
+    title="Gateway Service", lifespan=lifespan, default_response_class=FastJSONResponse
+)
+app.add_middleware(MetricsMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,10 +134,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-flight_client = FlightClient(os.getenv("FLIGHT_SERVICE_HOST"), "flight")
-ticket_client = TicketClient(os.getenv("TICKET_SERVICE_HOST"), "ticket")
-bonus_client = BonusClient(os.getenv("BONUS_SERVICE_HOST"), "bonus")
-
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
@@ -61,50 +166,310 @@ async def manage_health():
     return {}
 
 
+@app.get("/manage/cache")
+async def manage_cache():
+    return {name: cache.stats() for name, cache in CACHES.items()}
+
+
+def cache_by_name(name: str) -> TTLCache:
+    if name not in CACHES:
+        raise HTTPException(status_code=404, detail=f"Unknown cache: {name}")
+    return CACHES[name]
+
+
+@app.delete("/manage/cache/{name}", status_code=204)
+async def clear_cache(name: str):
+    cache_by_name(name).clear()
+
+
+@app.delete("/manage/cache/{name}/{key}", status_code=204)
+async def invalidate_cache_key(name: str, key: str):
+    cache_by_name(name).invalidate(key)
+
+
+@app.get("/manage/retry-queue")
+async def manage_retry_queue():
+    return await retry_queue.stats()
+
+
+@app.get("/manage/breakers")
+async def manage_breakers():
+    return {
+        client.service_name: {
+            "balancing": client.balancer.strategy,
+            "upstreams": {u.url: u.snapshot() for u in client.upstreams},
+        }
+        for client in (flight_client, ticket_client, bonus_client)
+    }
+
+
+@app.get("/manage/sagas")
+async def manage_sagas():
+    return {"purchase": purchase_saga.stats()}
+
+
+@app.get("/manage/latency")
+async def manage_latency():
+    clients = (flight_client, ticket_client, bonus_client)
+    return {
+        "endpoints": {client.service_name: client.latency.stats() for client in clients},
+        "hedge_budget": flight_client.hedge_budget.stats(),
+        "coalescing": {
+            client.service_name: {
+                "enabled": client.coalescing,
+                "leaders": client.inflight.leaders,
+                "shared": client.inflight.shared,
+                "in_flight": client.inflight.in_flight(),
+            }
+            for client in clients
+        },
+    }
+
+
+@app.get("/manage/metrics")
+async def manage_metrics():
+    # Сборщик метрик синхронный: данные таблицы очереди обновляются заранее
+    await retry_queue.stats()
+    return metrics_response()
+
+
 @app.get("/api/v1/flights")
-async def get_flights(page: int = 0, size: int = 10):
-    resp = await flight_client.get_flights(page, size)
-    return resp.json()
+async def get_flights(
+    page: int = Query(1, ge=1),
+    size: int = Query(10, ge=1, le=100),
+    if_none_match: str | None = Header(None),
+):
+    # Условный запрос клиента и ответ flight service передаются как есть,
+    # тело страницы не разбирается. Границы page и size те же, что у flight
+    # service: без разбора как есть уходит только успешный ответ
+    try:
+        resp = await flight_client.get_flights(page, size, etag=if_none_match)
+    except ServiceUnavailableException:
+        raise FlightServiceUnavailable()
+    if resp.status_code == 304:
+        etag = resp.headers.get("ETag")
+        return Response(status_code=304, headers={"ETag": etag} if etag else None)
+    if 400 <= resp.status_code < 500:
+        raise HTTPException(status_code=400, detail="Invalid page request")
+    if resp.status_code != 200:
+        raise FlightServiceUnavailable()
+    return upstream_response(resp, headers=("ETag",))
+
+
+@app.get("/api/v1/flights/search")
+async def search_flights(
+    fromAirport: str | None = Query(None),
+    toAirport: str | None = Query(None),
+    dateFrom: datetime | None = Query(None),
+    dateTo: datetime | None = Query(None),
+    minPrice: int | None = Query(None, ge=0),
+    maxPrice: int | None = Query(None, ge=0),
+    sort: Literal["date", "-date", "price", "-price"] = Query("date"),
+    size: int = Query(10, ge=1, le=100),
+    cursor: str | None = Query(None),
+):
+    """Поиск рейсов flight service: фильтры применяются в БД, страница
+    отдается клиенту без разбора"""
+    try:
+        resp = await flight_client.search_flights({
+            "fromAirport": fromAirport,
+            "toAirport": toAirport,
+            "dateFrom": dateFrom.isoformat() if dateFrom else None,
+            "dateTo": dateTo.isoformat() if dateTo else None,
+            "minPrice": minPrice,
+            "maxPrice": maxPrice,
+            "sort": sort,
+            "size": size,
+            "cursor": cursor,
+        })
+    except ServiceUnavailableException:
+        raise FlightServiceUnavailable()
 
+    if resp.status_code == 400:
+        raise HTTPException(status_code=400, detail=resp.json().get("detail"))
+    if resp.status_code != 200:
+        raise FlightServiceUnavailable()
+    return upstream_response(resp)
 
-@app.get("/api/v1/tickets")
-async def get_user_tickets(x_user_name: str = Header(...)):
-    t_resp = await ticket_client.get_tickets(x_user_name)
+
+# Сколько запросов к flight service одновременно делает одна агрегация
+FLIGHT_LOOKUP_CONCURRENCY = int(os.getenv("FLIGHT_LOOKUP_CONCURRENCY", "10"))
+# Ограничение flight service на число номеров в пакетном запросе
+FLIGHT_BATCH_SIZE = 100
+
+
+async def get_flight_info(flight_number: str) -> dict | None:
+    """Рейс через кэш; None, если рейс не найден.
+    Если flight service недоступен, отдается устаревшая запись из кэша, если она есть."""
+
+    async def load(number: str):
+        # Просроченная запись ревалидируется по ETag: неизменившийся рейс
+        # стоит 304 без тела
+        cached = flight_cache.peek(number)
+        f_resp = await flight_client.get_flight(
+            number, etag=cached.etag if cached is not None else None
+        )
+        if f_resp.status_code == 304 and cached is not None:
+            return cached
+        if f_resp.status_code != 200:
+            return None
+        return Versioned(f_resp.json(), f_resp.headers.get("ETag"))
+
+    entry = await flight_cache.get(
+        flight_number, load, stale_on=ServiceUnavailableException
+    )
+    return entry.value if entry is not None else None
+
+
+async def fetch_flights_info(flight_numbers) -> dict:
+    """Запрашивает рейсы через кэш, промахи - пакетами по FLIGHT_BATCH_SIZE номеров,
+    пакеты - параллельно. Недоступный или ненайденный рейс отображается в пустой dict."""
+    semaphore = asyncio.Semaphore(FLIGHT_LOOKUP_CONCURRENCY)
+
+    async def load(batch: list[str]):
+        async with semaphore:
+            f_resp = await flight_client.get_flights_by_numbers(batch)
+        if f_resp.status_code != 200:
+            return {}
+        # ETag пакетного ответа относится ко всему пакету, а не к рейсу
+        return {item["flightNumber"]: Versioned(item) for item in f_resp.json()["items"]}
+
+    flights = await flight_cache.get_many(
+        flight_numbers,
+        load,
+        stale_on=ServiceUnavailableException,
+        batch_size=FLIGHT_BATCH_SIZE,
+    )
+    return {number: entry.value if entry else {} for number, entry in flights.items()}
+
+
+async def get_privilege_info(username: str) -> dict | None:
+    """Профиль бонусов с ревалидацией закэшированного ответа; None - не найден"""
+
+    async def load(key: str):
+        cached = privilege_cache.peek(key)
+        resp = await bonus_client.get_privilege(
+            key, etag=cached.etag if cached is not None else None
+        )
+        if resp.status_code == 304 and cached is not None:
+            return cached
+        if resp.status_code != 200:
+            return None
+        return Versioned(resp.json(), resp.headers.get("ETag"))
+
+    entry = await privilege_cache.get(username, load)
+    return entry.value if entry is not None else None
+
+
+# Токен следующей страницы билетов, как в ticket service
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Поля билета в ответе gateway; поля рейса берутся из flight service
+TICKET_FIELDS = ("ticketUid", "flightNumber", "fromAirport", "toAirport", "date", "status", "price")
+FLIGHT_FIELDS = {"fromAirport", "toAirport", "date"}
+
+
+def parse_fields(fields: str | None) -> list[str] | None:
+    """Поля через запятую, как в ticket service; None - все поля"""
+    if fields is None:
+        return None
+    projection = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in projection if f not in TICKET_FIELDS]
+    if unknown or not projection:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return projection
+
+
+async def load_user_tickets(
+    username: str,
+    status: str | None = None,
+    limit: int | None = None,
+    cursor: str | None = None,
+    fields: list[str] | None = None,
+) -> tuple[list, str | None]:
+    """Страница билетов пользователя с данными рейсов и токен следующей
+    страницы. fields - проекция: ticket service отдает только нужные ему
+    колонки, а без полей рейса flight service не запрашивается"""
+    with_flights = fields is None or not FLIGHT_FIELDS.isdisjoint(fields)
+    upstream_fields = None
+    if fields is not None:
+        upstream_fields = [f for f in fields if f not in FLIGHT_FIELDS]
+        if with_flights and "flightNumber" not in upstream_fields:
+            upstream_fields.append("flightNumber")
+
+    t_resp = await ticket_client.get_tickets(
+        username, status=status, limit=limit, cursor=cursor, fields=upstream_fields
+    )
+    if t_resp.status_code == 400:
+        raise HTTPException(status_code=400, detail=t_resp.json().get("detail"))
     if t_resp.status_code != 200:
-        return []
+        return [], None
 
     tickets = t_resp.json()
+    flights = {}
+    if with_flights:
+        flights = await fetch_flights_info(t["flightNumber"] for t in tickets)
     result = []
 
     for t in tickets:
-        f_resp = await flight_client.get_flight(t["flightNumber"])
-        f_data = f_resp.json() if f_resp.status_code == 200 else {}
-        result.append(
-            {
-                "ticketUid": t["ticketUid"],
-                "flightNumber": t["flightNumber"],
-                "fromAirport": f_data.get("fromAirport", "Unknown"),
-                "toAirport": f_data.get("toAirport", "Unknown"),
-                "date": f_data.get("date", "Unknown"),
-                "status": t["status"],
-                "price": t["price"],
-            }
-        )
-    return result
+        f_data = flights.get(t.get("flightNumber"), {})
+        row = {
+            "ticketUid": t.get("ticketUid"),
+            "flightNumber": t.get("flightNumber"),
+            "fromAirport": f_data.get("fromAirport", "Unknown"),
+            "toAirport": f_data.get("toAirport", "Unknown"),
+            "date": f_data.get("date", "Unknown"),
+            "status": t.get("status"),
+            "price": t.get("price"),
+        }
+        result.append(row if fields is None else {f: row[f] for f in fields})
+    return result, t_resp.headers.get(NEXT_CURSOR_HEADER)
+
+
+@app.get("/api/v1/tickets")
+async def get_user_tickets(
+    response: Response,
+    x_user_name: str = Header(...),
+    status: Literal["PAID", "CANCELED"] | None = Query(None),
+    limit: int | None = Query(None, ge=1, le=500),
+    cursor: str | None = Query(None),
+    fields: str | None = Query(None, description="Поля билета через запятую"),
+):
+    tickets, next_cursor = await load_user_tickets(
+        x_user_name, status, limit, cursor, parse_fields(fields)
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return tickets
 
 
 @app.get("/api/v1/me")
-async def get_user_info(x_user_name: str = Header(...)):
-    try:
-        tickets = await get_user_tickets(x_user_name)
-    except ServiceUnavailableException:
-        tickets = []
+async def get_user_info(
+    response: Response,
+    x_user_name: str = Header(...),
+    status: Literal["PAID", "CANCELED"] | None = Query(None),
+    limit: int | None = Query(None, ge=1, le=500),
+    cursor: str | None = Query(None),
+):
+    async def load_tickets():
+        try:
+            return await load_user_tickets(x_user_name, status, limit, cursor)
+        except ServiceUnavailableException:
+            return [], None
 
-    try:
-        p_resp = await bonus_client.get_privilege(x_user_name)
-        privilege = p_resp.json()
-    except ServiceUnavailableException:
-        privilege = {}
+    async def load_privilege():
+        # Для профиля нужны только баланс и статус, история не запрашивается
+        try:
+            resp = await bonus_client.get_privilege_balance(x_user_name)
+        except ServiceUnavailableException:
+            return {}
+        return resp.json() if resp.status_code == 200 else {}
+
+    (tickets, next_cursor), privilege = await asyncio.gather(
+        load_tickets(), load_privilege()
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
 
     return {
         "tickets": tickets,
@@ -112,18 +477,6 @@ async def get_user_info(x_user_name: str = Header(...)):
     }
 
 
-
-
-async def retry_bonus_rollback(username: str, ticket_uid: str, price: int):
-    while True:
-        try:
-            print("ХУЯРИМ")
-            await bonus_client.rollback(username, ticket_uid, price)
-            break  # Успешное выполнение, выходим из цикла
-        except ServiceUnavailableException:
-            # Если сервис все еще недоступен (CB OPEN), ждем 10 секунд
-            await asyncio.sleep(10)
-
 class BonusServiceUnavailable(HTTPException):
     def __init__(self, detail="Bonus Service unavailable"):
         super().__init__(status_code=503, detail=detail)
@@ -139,45 +492,150 @@ class TicketServiceUnavailable(HTTPException):
         super().__init__(status_code=503, detail=detail)
 
 
+class TicketUidConflict(HTTPException, StepRejected):
+    def __init__(self, detail="Ticket uid is already used"):
+        super().__init__(status_code=409, detail=detail)
+
+
+class PurchaseCancelled(HTTPException, StepRejected):
+    def __init__(self, detail="Purchase with this Idempotency-Key was cancelled"):
+        super().__init__(status_code=409, detail=detail)
+
+
+class UpstreamRejected(HTTPException, StepRejected):
+    def __init__(self, service: str, response):
+        super().__init__(
+            status_code=response.status_code,
+            detail=f"{service} service rejected the request",
+        )
+
+
+def step_result(service: str, response):
+    """Ответ сервиса на шаг покупки. 201 - эффект создан этим запуском саги,
+    200 - выполнен раньше, например первой попыткой той же покупки: Replayed
+    не компенсируется. Остальные коды - отказ, эффекта нет"""
+    if response.status_code == 201:
+        return response.json()
+    if response.status_code == 200:
+        return Replayed(response.json())
+    raise UpstreamRejected(service, response)
+
+
 @app.post("/api/v1/tickets")
-async def buy_ticket(request: dict, x_user_name: str = Header(...)):
+async def buy_ticket(
+    request: dict,
+    x_user_name: str = Header(...),
+    idempotency_key: str | None = Header(None),
+):
+    if idempotency_key is None:
+        return await purchase_ticket(request, x_user_name, str(uuid.uuid4()))
+
+    fingerprint = json.dumps(request, sort_keys=True)
+    ticket_uuid = str(
+        uuid.uuid5(IDEMPOTENCY_NAMESPACE, f"{x_user_name}:{idempotency_key}")
+    )
+
+    async def load(key):
+        return fingerprint, await purchase_ticket(request, x_user_name, ticket_uuid)
+
+    # Одновременные повторы ждут первый запрос, а не выполняют покупку сами
+    stored_fingerprint, result = await idempotency_cache.get(
+        (x_user_name, idempotency_key), load
+    )
+    if stored_fingerprint != fingerprint:
+        raise HTTPException(
+            status_code=422, detail="Idempotency-Key is already used for another request"
+        )
+    return result
+
+
+async def validate_flight(ctx: dict) -> dict:
     try:
-        f_resp = await flight_client.get_flight(request["flightNumber"])
-        if f_resp.status_code != 200:
-            raise HTTPException(status_code=404, detail="Flight not found")
+        f_data = await get_flight_info(ctx["request"]["flightNumber"])
     except ServiceUnavailableException:
         raise FlightServiceUnavailable
+    if f_data is None:
+        raise HTTPException(status_code=404, detail="Flight not found")
+    return f_data
 
-    ticket_uuid = str(uuid.uuid4())
-    price = request["price"]
-    paid_from_balance = request["paidFromBalance"]
-    flight_number = request["flightNumber"]
 
+async def calculate_bonus(ctx: dict) -> dict:
+    request = ctx["request"]
     try:
-        b_data = (
-            await bonus_client.calculate(
-                x_user_name, ticket_uuid, price, paid_from_balance
-            )
-        ).json()
+        response = await bonus_client.calculate(
+            ctx["username"], ctx["ticket_uid"], request["price"], request["paidFromBalance"]
+        )
     except ServiceUnavailableException:
         raise BonusServiceUnavailable
+    # 410 - операцию по этому uid уже откатила компенсация прошлой попытки:
+    # скидку без списания бонусов повтор выдать не должен
+    if response.status_code == 410:
+        raise PurchaseCancelled
+    return step_result("Bonus", response)
 
-    f_data = (await flight_client.get_flight(flight_number)).json()
 
+async def compensate_bonus(ctx: dict):
+    await bonus_client.rollback(ctx["username"], ctx["ticket_uid"], ctx["request"]["price"])
+
+
+async def create_ticket(ctx: dict) -> dict:
+    request = ctx["request"]
     try:
         t_resp = await ticket_client.create_ticket(
-            x_user_name,
-            ticket_uuid,
-            price,
-            flight_number,
+            ctx["username"], ctx["ticket_uid"], request["price"], request["flightNumber"]
         )
-        t_data = t_resp.json()
     except ServiceUnavailableException:
         raise TicketServiceUnavailable
+    # 409 - uid занят чужим билетом или билет отменен компенсацией
+    if t_resp.status_code == 409:
+        raise TicketUidConflict
+    return step_result("Ticket", t_resp)
+
 
+async def compensate_ticket(ctx: dict):
+    await ticket_client.delete_ticket(ctx["username"], ctx["ticket_uid"])
+
+
+# Компенсации, которые не удалось выполнить сразу, повторяет очередь
+COMPENSATION_JOBS = {"bonus": "bonus_rollback", "ticket": "ticket_cancel"}
+
+
+async def defer_compensation(step, ctx: dict, exc: Exception):
+    payload = {
+        "username": ctx["username"],
+        "ticketUid": ctx["ticket_uid"],
+        "price": ctx["request"]["price"],
+    }
+    try:
+        await retry_queue.enqueue(COMPENSATION_JOBS[step.name], payload)
+    except QueueFull:
+        logger.error(f"Retry queue is full, compensation {step.name} lost: {payload}")
+
+
+# Рейс проверяется одновременно с бонусной операцией: обе идемпотентны по
+# uid билета, а при ненайденном рейсе бонусы откатываются. Билет создается
+# последним - его отмена дороже для пользователя
+purchase_saga = Saga(
+    "purchase",
+    [
+        [
+            Step("flight", validate_flight),
+            Step("bonus", calculate_bonus, compensate_bonus, compensate_failed=True),
+        ],
+        [Step("ticket", create_ticket, compensate_ticket, compensate_failed=True)],
+    ],
+    on_compensation_failure=defer_compensation,
+)
+
+
+async def purchase_ticket(request: dict, x_user_name: str, ticket_uuid: str) -> dict:
+    ctx = await purchase_saga.run(
+        {"request": request, "username": x_user_name, "ticket_uid": ticket_uuid}
+    )
+    b_data = ctx["bonus"]
     return {
-        **f_data,
-        **t_data,
+        **ctx["flight"],
+        **ctx["ticket"],
         "paidByMoney": request["price"] - b_data["paidByBonuses"],
         "paidByBonuses": b_data["paidByBonuses"],
         "privilege": b_data["privilege"],
@@ -185,11 +643,10 @@ async def buy_ticket(request: dict, x_user_name: str = Header(...)):
 
 
 @app.delete("/api/v1/tickets/{ticketUid}", status_code=204)
-async def refund_ticket(
-    ticketUid: str, 
-    background_tasks: BackgroundTasks, 
-    x_user_name: str = Header(...)
-):
+async def refund_ticket(ticketUid: str, x_user_name: str = Header(...)):
+    # Без места в очереди откат бонусов может потеряться - не отменяем билет
+    if await retry_queue.is_full():
+        raise BonusServiceUnavailable("Bonus rollback queue is full")
 
     try:
         t_resp = await ticket_client.get_ticket_by_uid(x_user_name, ticketUid)
@@ -209,10 +666,32 @@ async def refund_ticket(
     try:
         await bonus_client.rollback(x_user_name, ticketUid, price)
     except ServiceUnavailableException:
-        background_tasks.add_task(retry_bonus_rollback, x_user_name, ticketUid, price)
+        payload = {"username": x_user_name, "ticketUid": ticketUid, "price": price}
+        try:
+            await retry_queue.enqueue("bonus_rollback", payload)
+        except QueueFull:
+            logger.error(f"Retry queue is full, bonus rollback lost: {payload}")
 
     return Response(status_code=204)
 
+@app.get("/api/v1/tickets/export")
+async def export_user_tickets(
+    x_user_name: str = Header(...),
+    status: Literal["PAID", "CANCELED"] | None = Query(None),
+):
+    """Все билеты пользователя в NDJSON, по одному на строку. Тело ticket
+    service передается клиенту по мере чтения, без сборки в памяти"""
+    try:
+        resp = await ticket_client.export_tickets(x_user_name, status)
+    except ServiceUnavailableException:
+        raise TicketServiceUnavailable()
+
+    if resp.status_code != 200:
+        await resp.aclose()
+        raise TicketServiceUnavailable()
+    return upstream_stream(resp)
+
+
 @app.get("/api/v1/tickets/{ticketUid}")
 async def get_ticket_info(ticketUid: str, x_user_name: str = Header(...)):
     t_resp = await ticket_client.get_ticket_by_uid(x_user_name, ticketUid)
@@ -224,9 +703,9 @@ async def get_ticket_info(ticketUid: str, x_user_name: str = Header(...)):
 
     ticket = t_resp.json()
 
-    f_resp = await flight_client.get_flight(ticket["flightNumber"])
+    flight_data = await get_flight_info(ticket["flightNumber"])
 
-    if f_resp.status_code != 200:
+    if flight_data is None:
         return {
             **ticket,
             "fromAirport": "Unknown",
@@ -234,8 +713,6 @@ async def get_ticket_info(ticketUid: str, x_user_name: str = Header(...)):
             "date": "Unknown",
         }
 
-    flight_data = f_resp.json()
-
     return {
         "ticketUid": ticket["ticketUid"],
         "flightNumber": ticket["flightNumber"],
@@ -250,11 +727,45 @@ async def get_ticket_info(ticketUid: str, x_user_name: str = Header(...)):
 @app.get("/api/v1/privilege")
 async def get_privilege_with_history(x_user_name: str = Header(...)):
     try:
-        resp = await bonus_client.get_privilege(x_user_name)
+        privilege = await get_privilege_info(x_user_name)
     except ServiceUnavailableException:
         raise BonusServiceUnavailable
 
-    if resp.status_code == 404:
+    if privilege is None:
         raise HTTPException(status_code=404, detail="Бонусный профиль не найден")
 
-    return resp.json()
+    return privilege
+
+
+@app.get("/api/v1/privilege/history")
+async def get_privilege_history(
+    x_user_name: str = Header(...),
+    since: str | None = Query(None),
+    limit: int | None = Query(None, ge=1, le=500),
+):
+    """Страница истории бонусов; X-Next-Cursor - для следующей страницы и
+    для последующей синхронизации новых операций"""
+    try:
+        resp = await bonus_client.get_privilege_history(x_user_name, since=since, limit=limit)
+    except ServiceUnavailableException:
+        raise BonusServiceUnavailable
+
+    if resp.status_code == 400:
+        raise HTTPException(status_code=400, detail=resp.json().get("detail"))
+    if resp.status_code != 200:
+        raise BonusServiceUnavailable
+    return upstream_response(resp, headers=(NEXT_CURSOR_HEADER,))
+
+
+@app.get("/api/v1/privilege/export")
+async def export_privilege_history(x_user_name: str = Header(...)):
+    """Вся история бонусов в NDJSON потоком из bonus service"""
+    try:
+        resp = await bonus_client.export_history(x_user_name)
+    except ServiceUnavailableException:
+        raise BonusServiceUnavailable
+
+    if resp.status_code != 200:
+        await resp.aclose()
+        raise BonusServiceUnavailable
+    return upstream_stream(resp)
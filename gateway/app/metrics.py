@@ -0,0 +1,211 @@
+import os
+from time import perf_counter
+
+from fastapi import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Несколько воркеров uvicorn: счетчики и гистограммы каждый процесс пишет в
+# свои файлы в PROMETHEUS_MULTIPROC_DIR, scrape любого воркера суммирует
+# их по всем процессам. Переменная должна быть задана до запуска процессов,
+# а каталог - очищаться при старте gateway
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+
+def _scrape_registry() -> CollectorRegistry:
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, MULTIPROC_DIR)
+    return registry
+
+
+SCRAPE_REGISTRY = _scrape_registry()
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ["method", "route", "status"],
+)
+
+UPSTREAM_LATENCY = Histogram(
+    "gateway_upstream_request_duration_seconds",
+    "Время запроса gateway к сервису",
+    ["service", "method", "outcome"],
+)
+
+BREAKER_TRANSITIONS = Counter(
+    "gateway_circuit_breaker_transitions",
+    "Переходы circuit breaker между состояниями",
+    ["service", "route", "from_state", "to_state"],
+)
+
+BREAKER_REJECTIONS = Counter(
+    "gateway_circuit_breaker_rejections",
+    "Запросы, отклоненные открытым или half-open circuit breaker",
+    ["service", "route"],
+)
+
+HEDGES = Counter(
+    "gateway_hedged_requests",
+    "Хеджирующие попытки: fired - отправлена, won - ответила первой, "
+    "budget_exhausted - не отправлена из-за бюджета",
+    ["service", "endpoint", "outcome"],
+)
+
+COALESCED = Counter(
+    "gateway_coalesced_requests",
+    "Идемпотентные чтения через single-flight: leader - ушло в upstream, "
+    "shared - получило ответ одновременного такого же запроса",
+    ["service", "endpoint", "role"],
+)
+
+BREAKER_STATES = ("closed", "open", "half_open")
+
+
+class MetricsMiddleware:
+    """ASGI middleware: латентность запросов по шаблону маршрута.
+
+    Чистый ASGI вместо BaseHTTPMiddleware - без лишней задачи и копирования
+    тела на каждый запрос. Дочерние метрики по меткам кэшируются."""
+
+    def __init__(self, app):
+        self.app = app
+        self._children = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Роутер кладет найденный маршрут в scope; шаблон пути вместо
+            # реального пути ограничивает число рядов метрики
+            route = scope.get("route")
+            key = (scope["method"], route.path if route is not None else "unmatched", status)
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = REQUEST_LATENCY.labels(key[0], key[1], str(status))
+            child.observe(perf_counter() - start)
+
+
+_upstream_children = {}
+
+
+def observe_upstream(service: str, method: str, outcome: str, seconds: float):
+    # labels() на каждый вызов заметно дороже поиска в dict
+    key = (service, method, outcome)
+    child = _upstream_children.get(key)
+    if child is None:
+        child = _upstream_children[key] = UPSTREAM_LATENCY.labels(*key)
+    child.observe(seconds)
+
+
+_coalesced_children = {}
+
+
+def record_coalesced(service: str, endpoint: str, role: str):
+    key = (service, endpoint, role)
+    child = _coalesced_children.get(key)
+    if child is None:
+        child = _coalesced_children[key] = COALESCED.labels(*key)
+    child.inc()
+
+
+def record_hedge(service: str, endpoint: str, outcome: str):
+    HEDGES.labels(service, endpoint, outcome).inc()
+
+
+def record_breaker_transition(service: str, route: str, previous: str, state: str):
+    BREAKER_TRANSITIONS.labels(service, route, previous, state).inc()
+
+
+def record_breaker_rejection(service: str, route: str):
+    BREAKER_REJECTIONS.labels(service, route).inc()
+
+
+class GatewayCollector:
+    """Состояние реплик, breaker-ов, кэшей и очереди повторов, снимается в момент scrape.
+
+    При нескольких воркерах состояние breaker-ов и таблица очереди повторов
+    общие, а запросы в полете, кэши и счетчики очереди - того воркера,
+    который ответил на scrape: в сумму по процессам они не входят."""
+
+    def __init__(self, clients, caches: dict, retry_queue):
+        self.clients = clients
+        self.caches = caches
+        self.retry_queue = retry_queue
+
+    def collect(self):
+        state = GaugeMetricFamily(
+            "gateway_circuit_breaker_state",
+            "Текущее состояние circuit breaker (1 - активное)",
+            labels=["service", "upstream", "route", "state"],
+        )
+        healthy = GaugeMetricFamily(
+            "gateway_upstream_healthy",
+            "Результат последней проверки /manage/health реплики",
+            labels=["service", "upstream"],
+        )
+        outstanding = GaugeMetricFamily(
+            "gateway_upstream_outstanding",
+            "Запросов к реплике в полете",
+            labels=["service", "upstream"],
+        )
+        for client in self.clients:
+            for upstream in client.upstreams:
+                labels = [client.service_name, upstream.url]
+                healthy.add_metric(labels, float(upstream.healthy))
+                outstanding.add_metric(labels, upstream.outstanding)
+                for route, breaker in upstream.breakers.items():
+                    current = breaker.state
+                    for name in BREAKER_STATES:
+                        state.add_metric(labels + [route, name], float(current == name))
+        yield state
+        yield healthy
+        yield outstanding
+
+        size = GaugeMetricFamily("gateway_cache_size", "Записей в кэше", labels=["cache"])
+        counters = {
+            name: CounterMetricFamily(f"gateway_cache_{name}", f"Кэш: {name}", labels=["cache"])
+            for name in ("hits", "misses", "evictions", "stale_hits", "coalesced")
+        }
+        for cache_name, cache in self.caches.items():
+            stats = cache.stats()
+            size.add_metric([cache_name], stats["size"])
+            for name, family in counters.items():
+                family.add_metric([cache_name], stats[name])
+        yield size
+        yield from counters.values()
+
+        stats = self.retry_queue.snapshot()
+        for name in ("depth", "due", "oldest_age_seconds", "max_attempts", "dead", "active_workers"):
+            yield GaugeMetricFamily(f"gateway_retry_queue_{name}", f"Очередь повторов: {name}", value=stats[name])
+        for name in ("enqueued", "rejected", "succeeded", "failed_attempts", "dead_lettered"):
+            yield CounterMetricFamily(f"gateway_retry_queue_{name}", f"Очередь повторов: {name}", value=stats[name])
+
+
+def register_collector(collector):
+    SCRAPE_REGISTRY.register(collector)
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(SCRAPE_REGISTRY), media_type=CONTENT_TYPE_LATEST)
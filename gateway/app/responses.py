@@ -0,0 +1,42 @@
+from typing import Any
+
+import httpx
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic_core import to_json
+from starlette.background import BackgroundTask
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON-ответ, который сериализует pydantic_core за один проход, без
+    json.dumps. datetime и UUID пишутся так же, как их пишет pydantic.
+
+    Если обработчик возвращает такой ответ сам, FastAPI пропускает проверку
+    response_model и jsonable_encoder. Поэтому так возвращаются только
+    данные, которые уже имеют форму ответа."""
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+def upstream_response(resp: httpx.Response, headers: tuple[str, ...] = ()) -> Response:
+    """Ответ upstream-а для клиента как есть: тело передается байтами, без
+    разбора и повторной сериализации. headers - заголовки, которые нужно
+    перенести из ответа upstream-а."""
+    return Response(
+        content=resp.content,
+        status_code=resp.status_code,
+        media_type=resp.headers.get("content-type", "application/json"),
+        headers={name: resp.headers[name] for name in headers if name in resp.headers},
+    )
+
+
+def upstream_stream(resp: httpx.Response) -> StreamingResponse:
+    """Потоковый ответ upstream-а (запрос с stream=True): куски тела уходят
+    клиенту по мере получения, в памяти gateway не больше одного. Ответ
+    upstream-а закрывается после передачи или обрыва соединения клиентом."""
+    return StreamingResponse(
+        resp.aiter_bytes(),
+        status_code=resp.status_code,
+        media_type=resp.headers.get("content-type", "application/json"),
+        background=BackgroundTask(resp.aclose),
+    )
@@ -0,0 +1,320 @@
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger("gateway")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class RetryQueue:
+    """Персистентная очередь повторов компенсирующих операций на SQLite.
+
+    Задача - пара (kind, payload); обработчик регистрируется через register
+    и должен бросить исключение, если операцию нужно повторить. Задача,
+    не выполненная за max_attempts попыток, переносится в retry_dead_jobs
+    и больше не повторяется - ее разбирают вручную. Задачи
+    разбирает небольшой пул воркеров с экспоненциальной задержкой и jitter.
+    concurrency() возвращает, сколько воркеров может работать сейчас, - так
+    скорость разбора следует состоянию circuit breaker upstream-а. Задачи
+    разных upstream-ов регистрируются со своим concurrency: открытый breaker
+    одного сервиса не останавливает и не разгоняет разбор задач другого.
+
+    leader - LeaderLock, если gateway запущен несколькими воркерами: ставить
+    задачи может любой воркер, а разбирает их только владелец блокировки.
+    Остальные раз в poll_interval пробуют ее занять и подхватывают очередь,
+    если владелец завершился."""
+
+    def __init__(
+        self,
+        path: str,
+        max_size: int = 10000,
+        workers: int = 4,
+        backoff_base: float = 1.0,
+        backoff_max: float = 300.0,
+        lease: float = 60.0,
+        poll_interval: float = 1.0,
+        max_attempts: int = 20,
+        concurrency=None,
+        clock=time.time,
+        leader=None,
+    ):
+        self.path = path
+        self.max_size = max_size
+        self.workers = workers
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._concurrency = concurrency or (lambda: self.workers)
+        self._clock = clock
+        self._leader = leader
+        self._handlers = {}
+        self._gates = {}
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: asyncio.Event | None = None
+        self.enqueued = 0
+        self.rejected = 0
+        self.succeeded = 0
+        self.failed_attempts = 0
+        self.dead_lettered = 0
+        self._table_stats = {
+            "depth": 0, "due": 0, "oldest_age_seconds": 0.0, "max_attempts": 0, "dead": 0,
+        }
+
+    def register(self, kind: str, handler, concurrency=None):
+        """concurrency - ограничение воркеров для задач этого вида; по
+        умолчанию общее ограничение очереди"""
+        self._handlers[kind] = handler
+        self._gates[kind] = concurrency or self._concurrency
+
+    def _allowed_kinds(self, index: int) -> list[str]:
+        return [kind for kind, gate in self._gates.items() if index < gate()]
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS retry_jobs (
+                    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind            TEXT    NOT NULL,
+                    payload         TEXT    NOT NULL,
+                    attempts        INTEGER NOT NULL DEFAULT 0,
+                    created_at      REAL    NOT NULL,
+                    next_attempt_at REAL    NOT NULL,
+                    last_error      TEXT
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_retry_jobs_next ON retry_jobs (next_attempt_at)"
+            )
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS retry_dead_jobs (
+                    id         INTEGER PRIMARY KEY,
+                    kind       TEXT    NOT NULL,
+                    payload    TEXT    NOT NULL,
+                    attempts   INTEGER NOT NULL,
+                    created_at REAL    NOT NULL,
+                    failed_at  REAL    NOT NULL,
+                    last_error TEXT
+                )
+            """)
+        return self._conn
+
+    def _execute(self, query: str, params=()):
+        with self._lock:
+            return self.db.execute(query, params).fetchall()
+
+    def _move_to_dead(self, job_id: int, failed_at: float, error: str):
+        with self._lock:
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.execute(
+                    """
+                    INSERT INTO retry_dead_jobs
+                        (id, kind, payload, attempts, created_at, failed_at, last_error)
+                    SELECT id, kind, payload, attempts, created_at, ?, ?
+                    FROM retry_jobs WHERE id = ?
+                    """,
+                    (failed_at, error, job_id),
+                )
+                self.db.execute("DELETE FROM retry_jobs WHERE id = ?", (job_id,))
+
+    async def _run(self, query: str, params=()):
+        # Запись в SQLite с fsync не должна блокировать event loop
+        return await asyncio.to_thread(self._execute, query, params)
+
+    async def is_full(self) -> bool:
+        # Подсчет останавливается на max_size строках, а не обходит всю таблицу
+        rows = await self._run(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM retry_jobs LIMIT ?)", (self.max_size,)
+        )
+        return rows[0][0] >= self.max_size
+
+    async def enqueue(self, kind: str, payload: dict):
+        """Ставит задачу в очередь; QueueFull, если очередь заполнена"""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown retry job kind: {kind}")
+        now = self._clock()
+        rows = await self._run(
+            """
+            INSERT INTO retry_jobs (kind, payload, created_at, next_attempt_at)
+            SELECT ?, ?, ?, ?
+            WHERE (SELECT COUNT(*) FROM retry_jobs) < ?
+            RETURNING id
+            """,
+            (kind, json.dumps(payload), now, now, self.max_size),
+        )
+        if not rows:
+            self.rejected += 1
+            raise QueueFull()
+        self.enqueued += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return rows[0][0]
+
+    async def _claim(self, kinds: list[str] | None = None):
+        # Задача "арендуется" на lease секунд: если процесс упадет во время
+        # обработки, после рестарта она будет повторена
+        now = self._clock()
+        kind_filter = ""
+        if kinds is not None:
+            kind_filter = f"AND kind IN ({', '.join('?' * len(kinds))})"
+        rows = await self._run(
+            f"""
+            UPDATE retry_jobs SET next_attempt_at = ?, attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM retry_jobs WHERE next_attempt_at <= ? {kind_filter}
+                ORDER BY next_attempt_at LIMIT 1
+            )
+            RETURNING id, kind, payload, attempts
+            """,
+            (now + self.lease, now, *(kinds or ())),
+        )
+        return rows[0] if rows else None
+
+    def backoff(self, attempts: int) -> float:
+        # Full jitter: равномерно от 0 до экспоненциальной границы
+        cap = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return random.uniform(0, cap)
+
+    async def process_one(self, kinds: list[str] | None = None) -> bool:
+        """Обрабатывает одну готовую задачу из видов kinds (по умолчанию
+        любого); False, если таких нет"""
+        job = await self._claim(kinds)
+        if job is None:
+            return False
+        job_id, kind, payload, attempts = job
+        try:
+            await self._handlers[kind](json.loads(payload))
+        except Exception as exc:
+            self.failed_attempts += 1
+            if attempts >= self.max_attempts:
+                self.dead_lettered += 1
+                logger.error(
+                    f"Retry job {job_id} ({kind}) failed {attempts} times, "
+                    f"moved to dead letters: {exc!r}, payload {payload}"
+                )
+                await asyncio.to_thread(self._move_to_dead, job_id, self._clock(), repr(exc))
+                return True
+            delay = self.backoff(attempts)
+            logger.warning(
+                f"Retry job {job_id} ({kind}) failed, attempt {attempts}, "
+                f"next in {delay:.1f}s: {exc!r}"
+            )
+            await self._run(
+                "UPDATE retry_jobs SET next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (self._clock() + delay, repr(exc), job_id),
+            )
+        else:
+            self.succeeded += 1
+            await self._run("DELETE FROM retry_jobs WHERE id = ?", (job_id,))
+        return True
+
+    async def _worker(self, index: int):
+        while True:
+            kinds = self._allowed_kinds(index)
+            if kinds and await self.process_one(kinds):
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            # Сброс сразу после пробуждения, до разбора: enqueue, пришедший
+            # во время разбора, снова выставит событие и не потеряется
+            self._wakeup.clear()
+
+    def _start_workers(self):
+        self._tasks += [
+            asyncio.create_task(self._worker(i)) for i in range(self.workers)
+        ]
+
+    async def _wait_for_leadership(self):
+        while not self._leader.try_acquire():
+            await asyncio.sleep(self.poll_interval)
+        logger.info("Retry queue: this worker owns the queue")
+        self._start_workers()
+
+    @property
+    def is_owner(self) -> bool:
+        return self._leader is None or self._leader.held
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        if self._leader is None:
+            self._start_workers()
+        else:
+            self._tasks = [asyncio.create_task(self._wait_for_leadership())]
+
+    async def stop(self):
+        # Список пополняется, пока ожидание роли не отменено
+        while self._tasks:
+            tasks, self._tasks = self._tasks, []
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if self._leader is not None:
+            self._leader.release()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def stats(self) -> dict:
+        """Статистика с обходом таблицы задач; запрос выполняется вне event loop"""
+        now = self._clock()
+        rows = await self._run(
+            """
+            SELECT COUNT(*), MIN(created_at),
+                   COALESCE(SUM(next_attempt_at <= ?), 0), COALESCE(MAX(attempts), 0),
+                   (SELECT COUNT(*) FROM retry_dead_jobs)
+            FROM retry_jobs
+            """,
+            (now,),
+        )
+        depth, oldest, due, max_attempts, dead = rows[0]
+        self._table_stats = {
+            "depth": depth,
+            "due": due,
+            "oldest_age_seconds": now - oldest if oldest is not None else 0.0,
+            "max_attempts": max_attempts,
+            "dead": dead,
+        }
+        return self.snapshot()
+
+    def _active_workers(self) -> int:
+        # Воркер занят, если ему разрешен хотя бы один вид задач
+        gates = self._gates.values() or (self._concurrency,)
+        return min(self.workers, max(gate() for gate in gates))
+
+    def snapshot(self) -> dict:
+        """Статистика без обращения к SQLite: данные таблицы - на момент
+        последнего вызова stats, счетчики - текущие. Для синхронного
+        сборщика метрик"""
+        return {
+            **self._table_stats,
+            "max_size": self.max_size,
+            "workers": self.workers,
+            "owner": self.is_owner,
+            "active_workers": self._active_workers() if self.is_owner else 0,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "succeeded": self.succeeded,
+            "failed_attempts": self.failed_attempts,
+            "dead_lettered": self.dead_lettered,
+        }
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, NamedTuple
+
+logger = logging.getLogger("gateway")
+
+
+class Step(NamedTuple):
+    """Шаг саги. action(context) возвращает результат, который кладется в
+    context[name]; compensate(context) отменяет действие шага.
+
+    compensate_failed - компенсировать и упавший шаг: при таймауте запрос
+    мог быть выполнен upstream-ом, поэтому компенсация должна быть
+    идемпотентной и безопасной, если отменять нечего. Шаг, упавший с
+    StepRejected, не компенсируется: upstream ответил отказом."""
+
+    name: str
+    action: Callable[[dict], Awaitable]
+    compensate: Callable[[dict], Awaitable] | None = None
+    compensate_failed: bool = False
+
+
+class Replayed(NamedTuple):
+    """Результат шага, который upstream выполнил раньше, например при повторе
+    покупки с тем же ключом идемпотентности. value кладется в context[name],
+    но шаг не компенсируется: его эффект создан не этим запуском саги."""
+
+    value: object
+
+
+class StepRejected(Exception):
+    """Upstream отказал в действии шага - эффекта нет, отменять нечего"""
+
+
+class Saga:
+    """Последовательность этапов; шаги одного этапа независимы и выполняются
+    параллельно. Если шаг упал, дожидаются остальные шаги этапа, затем в
+    обратном порядке выполняются компенсации всех начатых шагов, и
+    исключение упавшего шага пробрасывается дальше.
+
+    Компенсация, которая не удалась сразу, передается в
+    on_compensation_failure(step, context, exc) - например, в очередь
+    повторов."""
+
+    def __init__(self, name: str, stages: list[list[Step]], on_compensation_failure=None):
+        self.name = name
+        self.stages = stages
+        self._on_compensation_failure = on_compensation_failure
+        self.started = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.compensated = 0
+        self.compensations_deferred = 0
+
+    async def run(self, context: dict) -> dict:
+        self.started += 1
+        to_compensate: list[Step] = []
+        for stage in self.stages:
+            try:
+                results = await asyncio.gather(
+                    *(step.action(context) for step in stage), return_exceptions=True
+                )
+            except asyncio.CancelledError:
+                # Отмененные шаги этапа могли успеть выполниться upstream-ом
+                started = [step for step in stage if step.compensate_failed]
+                await asyncio.shield(self._compensate(to_compensate + started, context))
+                raise
+            error = None
+            for step, result in zip(stage, results):
+                if isinstance(result, BaseException):
+                    error = error or result
+                    if step.compensate_failed and not isinstance(result, StepRejected):
+                        to_compensate.append(step)
+                elif isinstance(result, Replayed):
+                    context[step.name] = result.value
+                else:
+                    context[step.name] = result
+                    to_compensate.append(step)
+            if error is not None:
+                self.failed += 1
+                logger.warning(f"Saga {self.name} failed: {error!r}, compensating")
+                # Отмена запроса не должна прерывать компенсации
+                await asyncio.shield(self._compensate(to_compensate, context))
+                raise error
+        self.succeeded += 1
+        return context
+
+    async def _compensate(self, steps: list[Step], context: dict):
+        for step in reversed(steps):
+            if step.compensate is None:
+                continue
+            try:
+                await step.compensate(context)
+                self.compensated += 1
+            except Exception as exc:
+                logger.error(f"Saga {self.name}: compensation of {step.name} failed: {exc!r}")
+                if self._on_compensation_failure is None:
+                    continue
+                await self._on_compensation_failure(step, context, exc)
+                self.compensations_deferred += 1
+
+    def stats(self) -> dict:
+        return {
+            "started": self.started,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "compensated": self.compensated,
+            "compensations_deferred": self.compensations_deferred,
+        }
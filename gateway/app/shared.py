@@ -0,0 +1,250 @@
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from pathlib import Path
+
+from .breaker import CLOSED, HALF_OPEN, OPEN
+
+logger = logging.getLogger("gateway")
+
+_STATES = (CLOSED, OPEN, HALF_OPEN)
+
+# Слот breaker-а: хэш имени (0 - свободен), версия, время открытия, состояние,
+# успешные и выполняющиеся пробные вызовы half-open периода, время последней пробы
+_SLOT = struct.Struct("<QQdBxHId")
+_SLOT_SIZE = 40
+_VERSION = struct.Struct("<Q")
+BREAKER_SLOTS = 256
+
+# Запись журнала инвалидаций: номер события, длина, JSON [кэш, ключ]
+_EVENT = struct.Struct("<QH")
+_EVENT_SIZE = 256
+INVALIDATION_CAPACITY = 1024
+
+
+class SharedMemory:
+    """Файл, отображенный в память всеми воркерами gateway (обычно в
+    /dev/shm). Изменения делаются под flock на этом файле; флаг держится
+    только на время синхронной записи, без await внутри."""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self.lock():
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        self.map = mmap.mmap(self._fd, size)
+
+    @contextmanager
+    def lock(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self.map.close()
+        os.close(self._fd)
+
+
+class SharedBreakerState:
+    """Состояние одного breaker-а, общее для воркеров. Версия растет с
+    каждой публикацией; ее чтение без блокировки - дешевая проверка на
+    горячем пути, полное состояние читается только при изменении версии."""
+
+    def __init__(self, memory: SharedMemory, offset: int):
+        self._memory = memory
+        self._offset = offset
+
+    def version(self) -> int:
+        return _VERSION.unpack_from(self._memory.map, self._offset + 8)[0]
+
+    def load(self) -> tuple[int, str, float]:
+        with self._memory.lock():
+            _, version, opened_at, state, *_ = _SLOT.unpack_from(self._memory.map, self._offset)
+        return version, _STATES[state], opened_at
+
+    def store(self, state: str, opened_at: float) -> int:
+        """Публикует переход; счетчики проб начинаются заново"""
+        with self._memory.lock():
+            key, version, *_ = _SLOT.unpack_from(self._memory.map, self._offset)
+            _SLOT.pack_into(
+                self._memory.map, self._offset,
+                key, version + 1, opened_at, _STATES.index(state), 0, 0, 0.0,
+            )
+        return version + 1
+
+    def acquire_probe(self, version: int, limit: int, now: float, lease: float) -> bool:
+        """Compare-and-set разрешения на пробный вызов: проба засчитывается,
+        только если с version переходов не было и свободен один из limit
+        слотов. Слоты, последний из которых выдан больше lease назад,
+        считаются брошенными (воркер завершился во время пробы)."""
+        with self._memory.lock():
+            key, stored, opened_at, state, successes, probes, probe_at = _SLOT.unpack_from(
+                self._memory.map, self._offset
+            )
+            if stored != version:
+                return False
+            if probes >= limit:
+                if now - probe_at < lease:
+                    return False
+                probes = 0
+            _SLOT.pack_into(
+                self._memory.map, self._offset,
+                key, stored, opened_at, state, successes, probes + 1, now,
+            )
+        return True
+
+    def release_probe(self, version: int, succeeded: bool) -> int:
+        """Возвращает разрешение на пробу; результат - число успешных проб
+        периода version (0, если период уже сменился)"""
+        with self._memory.lock():
+            key, stored, opened_at, state, successes, probes, probe_at = _SLOT.unpack_from(
+                self._memory.map, self._offset
+            )
+            if stored != version:
+                return 0
+            successes += succeeded
+            _SLOT.pack_into(
+                self._memory.map, self._offset,
+                key, stored, opened_at, state, successes, max(probes - 1, 0), probe_at,
+            )
+        return successes
+
+    def probes(self) -> int:
+        return _SLOT.unpack_from(self._memory.map, self._offset)[5]
+
+
+class InvalidationLog:
+    """Кольцевой журнал инвалидаций кэшей. Каждый читатель хранит номер
+    последнего примененного события; если он отстал больше чем на емкость
+    журнала, poll возвращает None - события потеряны, кэш нужно очистить."""
+
+    def __init__(self, memory: SharedMemory, offset: int, capacity: int = INVALIDATION_CAPACITY):
+        self._memory = memory
+        self._offset = offset
+        self.capacity = capacity
+
+    def head(self) -> int:
+        return _VERSION.unpack_from(self._memory.map, self._offset)[0]
+
+    def _entry(self, seq: int) -> int:
+        return self._offset + _VERSION.size + ((seq - 1) % self.capacity) * _EVENT_SIZE
+
+    def publish(self, cache: str, key=None):
+        """key=None - очистка всего кэша"""
+        payload = json.dumps([cache, key]).encode()
+        if len(payload) > _EVENT_SIZE - _EVENT.size:
+            # Слишком длинный ключ: надежнее очистить кэш целиком
+            payload = json.dumps([cache, None]).encode()
+        with self._memory.lock():
+            seq = self.head() + 1
+            entry = self._entry(seq)
+            _EVENT.pack_into(self._memory.map, entry, seq, len(payload))
+            start = entry + _EVENT.size
+            self._memory.map[start:start + len(payload)] = payload
+            _VERSION.pack_into(self._memory.map, self._offset, seq)
+        return seq
+
+    def poll(self, cursor: int) -> tuple[int, list | None]:
+        """Новые события после cursor: (новый cursor, [(кэш, ключ), ...])"""
+        head = self.head()
+        if head == cursor:
+            return cursor, []
+        if head - cursor > self.capacity or head < cursor:
+            return head, None
+        events = []
+        with self._memory.lock():
+            for seq in range(cursor + 1, head + 1):
+                entry = self._entry(seq)
+                stored, length = _EVENT.unpack_from(self._memory.map, entry)
+                if stored != seq:
+                    return head, None
+                start = entry + _EVENT.size
+                events.append(tuple(json.loads(self._memory.map[start:start + length])))
+        return head, events
+
+
+class LeaderLock:
+    """Эксклюзивная роль среди воркеров на flock файла. Ядро снимает
+    блокировку, когда процесс-владелец завершается, и роль может занять
+    другой воркер."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: int | None = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+class SharedState:
+    """Состояние, общее для воркеров uvicorn одного gateway: breaker-ы,
+    журнал инвалидаций кэшей и роли (например, владелец очереди повторов).
+    Все воркеры открывают один и тот же каталог GATEWAY_SHARED_DIR."""
+
+    def __init__(self, directory: str):
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        breakers_size = BREAKER_SLOTS * _SLOT_SIZE
+        size = breakers_size + _VERSION.size + INVALIDATION_CAPACITY * _EVENT_SIZE
+        self._memory = SharedMemory(os.path.join(directory, "state"), size)
+        self.invalidations = InvalidationLog(self._memory, breakers_size)
+
+    @classmethod
+    def from_env(cls) -> "SharedState | None":
+        directory = os.getenv("GATEWAY_SHARED_DIR")
+        return cls(directory) if directory else None
+
+    def breaker(self, name: str) -> SharedBreakerState | None:
+        """Слот breaker-а по имени; None, если таблица заполнена"""
+        key = int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "little") or 1
+        start = key % BREAKER_SLOTS
+        with self._memory.lock():
+            for i in range(BREAKER_SLOTS):
+                offset = ((start + i) % BREAKER_SLOTS) * _SLOT_SIZE
+                stored = _SLOT.unpack_from(self._memory.map, offset)[0]
+                if stored == key:
+                    return SharedBreakerState(self._memory, offset)
+                if stored == 0:
+                    _SLOT.pack_into(self._memory.map, offset, key, 0, 0.0, 0, 0, 0, 0.0)
+                    return SharedBreakerState(self._memory, offset)
+        logger.warning(f"Shared breaker table is full, {name} stays local")
+        return None
+
+    def leader(self, role: str) -> LeaderLock:
+        return LeaderLock(os.path.join(self.directory, f"{role}.lock"))
+
+    def close(self):
+        self._memory.close()
+
+
+# Один на процесс; None - gateway работает одним процессом
+shared_state = SharedState.from_env()
@@ -0,0 +1,89 @@
+import asyncio
+
+
+class SingleFlight:
+    """Объединяет одновременные одинаковые запросы.
+
+    Первый вызов по ключу (ведущий) идет в upstream, остальные вызовы с тем же
+    ключом, пришедшие до его завершения, ждут и получают тот же результат или
+    ту же ошибку."""
+
+    def __init__(self):
+        self._calls: dict = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def join(self, key) -> tuple[asyncio.Future, bool]:
+        """Возвращает future результата и признак того, что вызывающий - ведущий.
+        Ведущий обязан завершить ключ через resolve или reject."""
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            return future, False
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.leaders += 1
+        return future, True
+
+    def resolve(self, key, value):
+        future = self._calls.pop(key)
+        if not future.done():
+            future.set_result(value)
+
+    def reject(self, key, exc: BaseException):
+        future = self._calls.pop(key)
+        if future.done():
+            return
+        if isinstance(exc, asyncio.CancelledError):
+            future.cancel()
+            return
+        future.set_exception(exc)
+        # Ведущий получает ошибку сам; без ожидающих asyncio не должен
+        # ругаться на "never retrieved"
+        future.exception()
+
+    async def do(self, key, fn):
+        future, leader = self.join(key)
+        if not leader:
+            # shield: отмена одного ожидающего не отменяет общий вызов
+            return await asyncio.shield(future)
+        try:
+            value = await fn()
+        except BaseException as exc:
+            self.reject(key, exc)
+            raise
+        self.resolve(key, value)
+        return value
+
+    async def share(self, key, fn):
+        """Как do, но общий вызов идет отдельной задачей: отмена любого из
+        ожидающих, в том числе первого, не прерывает вызов для остальных.
+        Задача отменяется, только когда не осталось ни одного ожидающего."""
+        entry = self._calls.get(key)
+        if entry is None:
+            async def run():
+                try:
+                    return await fn()
+                finally:
+                    if self._calls.get(key) is entry:
+                        del self._calls[key]
+
+            entry = self._calls[key] = [None, 0]
+            entry[0] = asyncio.ensure_future(run())
+            self.leaders += 1
+        else:
+            self.shared += 1
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                task.cancel()
+
+    def pending(self, key) -> bool:
+        return key in self._calls
+
+    def in_flight(self) -> int:
+        return len(self._calls)
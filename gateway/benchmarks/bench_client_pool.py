@@ -0,0 +1,73 @@
+"""Сравнение клиента без пула (новый httpx.AsyncClient на каждый вызов)
+и общего пула соединений BaseClient.
+
+    cd gateway && python -m benchmarks.bench_client_pool
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from app.clients import FlightClient
+from .stubs import StubServer, make_flight_app, quiet_logs
+
+
+async def per_call_client(base_url: str, flight_number: str):
+    # Поведение BaseClient до введения пула
+    async with httpx.AsyncClient() as client:
+        return await client.request(
+            "GET", f"{base_url}/flights/{flight_number}", timeout=2.0
+        )
+
+
+async def run(call, requests: int, concurrency: int):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            resp = await call(f"AFL{i % 100:03d}")
+            latencies.append(time.perf_counter() - started)
+            assert resp.status_code == 200
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main(requests: int, concurrency: int):
+    quiet_logs()
+    with StubServer(make_flight_app) as stub:
+        pooled = FlightClient(stub.url, "flight")
+        await pooled.start()
+
+        results = {
+            "per-call client": await run(
+                lambda n: per_call_client(stub.url, n), requests, concurrency
+            ),
+            "pooled client": await run(pooled.get_flight, requests, concurrency),
+        }
+        await pooled.close()
+
+    print(f"{requests} requests, concurrency {concurrency}")
+    print(f"{'mode':<18}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<18}{r['rps']:>10.0f}{r['p50']:>10.2f}{r['p99']:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
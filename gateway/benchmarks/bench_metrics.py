@@ -0,0 +1,90 @@
+"""Накладные расходы сбора метрик на горячем пути.
+
+Одно и то же ASGI-приложение FastAPI вызывается напрямую (без сети) с
+MetricsMiddleware и без него; отдельно меряется observe() гистограммы
+upstream-запросов, которую BaseClient вызывает на каждый запрос.
+
+    cd gateway && python -m benchmarks.bench_metrics
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi import FastAPI
+
+from app.metrics import MetricsMiddleware, observe_upstream
+
+
+def make_app(with_metrics: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/v1/flights/{flight_number}")
+    async def get_flight(flight_number: str):
+        return {"flightNumber": flight_number}
+
+    if with_metrics:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def call_asgi(app, requests: int) -> float:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/api/v1/flights/AFL031",
+        "raw_path": b"/api/v1/flights/AFL031",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "server": ("test", 80),
+        "client": ("test", 1),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        # scope изменяется роутером, поэтому на каждый запрос - копия
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / requests
+
+
+def bench_upstream(calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        observe_upstream("flight", "GET", "ok", 0.003)
+    return (time.perf_counter() - started) / calls
+
+
+async def main(requests: int, rounds: int):
+    plain, measured = make_app(False), make_app(True)
+    await call_asgi(plain, 1000)
+    await call_asgi(measured, 1000)
+
+    # Лучший из нескольких прогонов - меньше шума от планировщика ОС
+    plain_cost = min([await call_asgi(plain, requests) for _ in range(rounds)])
+    measured_cost = min([await call_asgi(measured, requests) for _ in range(rounds)])
+    upstream_cost = min(bench_upstream(requests) for _ in range(rounds))
+
+    print(f"{'request without metrics':<28}{plain_cost * 1e6:>8.1f} us")
+    print(f"{'request with metrics':<28}{measured_cost * 1e6:>8.1f} us")
+    print(
+        f"{'middleware overhead':<28}{(measured_cost - plain_cost) * 1e6:>8.1f} us"
+        f" ({(measured_cost / plain_cost - 1) * 100:.1f}%)"
+    )
+    print(f"{'upstream metrics per call':<28}{upstream_cost * 1e6:>8.1f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.rounds))
@@ -0,0 +1,92 @@
+"""Задержка покупки билета: последовательные вызовы flight -> bonus -> ticket
+против саги, где проверка рейса идет параллельно с бонусной операцией.
+
+Заглушки отвечают с искусственной задержкой --delay; кэш рейсов очищается
+перед каждой покупкой, чтобы рейс каждый раз запрашивался у flight service.
+При высокой --concurrency на малом числе ядер замер упирается в CPU
+заглушек, а не в задержку upstream-ов.
+
+    cd gateway && python -m benchmarks.bench_purchase
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+import uuid
+
+from .stubs import StubServer, make_bonus_app, make_flight_app, make_ticket_app, quiet_logs
+
+
+async def sequential_purchase(main, request: dict, username: str) -> dict:
+    # Порядок вызовов buy_ticket до введения саги
+    ticket_uid = str(uuid.uuid4())
+    f_data = await main.get_flight_info(request["flightNumber"])
+    b_data = (await main.bonus_client.calculate(
+        username, ticket_uid, request["price"], request["paidFromBalance"]
+    )).json()
+    t_data = (await main.ticket_client.create_ticket(
+        username, ticket_uid, request["price"], request["flightNumber"]
+    )).json()
+    return {**f_data, **t_data, "privilege": b_data["privilege"]}
+
+
+async def saga_purchase(main, request: dict, username: str) -> dict:
+    return await main.purchase_ticket(request, username, str(uuid.uuid4()))
+
+
+async def run(main, purchase, requests: int, concurrency: int) -> dict:
+    request = {"flightNumber": "AFL031", "price": 1500, "paidFromBalance": False}
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            main.flight_cache.clear()
+            started = time.perf_counter()
+            await purchase(main, request, "BenchUser")
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main(requests: int, concurrency: int, delay: float):
+    with StubServer(make_flight_app, delay=delay) as flight, \
+         StubServer(make_ticket_app, delay=delay) as ticket, \
+         StubServer(make_bonus_app, delay=delay) as bonus:
+        os.environ.update(
+            FLIGHT_SERVICE_HOST=flight.url,
+            TICKET_SERVICE_HOST=ticket.url,
+            BONUS_SERVICE_HOST=bonus.url,
+            RETRY_QUEUE_PATH=":memory:",
+        )
+        from app import main as gateway
+
+        quiet_logs()
+        # Прогрев: соединения пулов и prepared-пути заглушек
+        await run(gateway, saga_purchase, concurrency, concurrency)
+        results = {
+            "sequential": await run(gateway, sequential_purchase, requests, concurrency),
+            "saga": await run(gateway, saga_purchase, requests, concurrency),
+        }
+        for client in (gateway.flight_client, gateway.ticket_client, gateway.bonus_client):
+            await client.close()
+
+    print(f"{requests} purchases, concurrency {concurrency}, upstream delay {delay * 1000:.0f} ms")
+    print(f"{'mode':<12}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<12}{r['p50']:>10.2f}{r['p99']:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--delay", type=float, default=0.02)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.delay))
@@ -0,0 +1,114 @@
+"""Стоимость сериализации ответа со страницей рейсов в зависимости от ее размера.
+
+Сравниваются пути, которыми страница доходит до байтов ответа:
+- response_model - строки из БД, strftime в Python, проверка и дамп через
+  модель ответа, json.dumps (как flight service делал раньше);
+- fast - дата уже отформатирована в SQL, словари сериализуются FastJSONResponse;
+- gateway json - gateway разбирает ответ upstream-а и собирает его заново;
+- passthrough - gateway отдает байты upstream-а как есть.
+
+    cd gateway && python -m benchmarks.bench_serialization
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import httpx
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, TypeAdapter
+
+from app.responses import FastJSONResponse, upstream_response
+
+
+class FlightResponse(BaseModel):
+    flightNumber: str
+    fromAirport: str
+    toAirport: str
+    date: str
+    price: int
+
+
+class PaginationResponse(BaseModel):
+    page: Optional[int]
+    pageSize: int
+    totalElements: int
+    nextCursor: Optional[str] = None
+    items: List[FlightResponse]
+
+
+ADAPTER = TypeAdapter(PaginationResponse)
+FIELDS = tuple(FlightResponse.model_fields)
+
+
+def rows(size: int, formatted: bool) -> list[dict]:
+    start = datetime(2026, 1, 1)
+    return [
+        {
+            "id": i,
+            "version": f"{i}:1:1",
+            "flightNumber": f"AFL{i:05d}",
+            "date": (start + timedelta(hours=i)).strftime("%Y-%m-%d %H:%M")
+            if formatted else start + timedelta(hours=i),
+            "price": 1500,
+            "fromAirport": "Москва Шереметьево",
+            "toAirport": "Санкт-Петербург Пулково",
+        }
+        for i in range(size)
+    ]
+
+
+def page(items: list) -> dict:
+    return {"page": 1, "pageSize": len(items), "totalElements": 10_000, "items": items}
+
+
+def response_model(items: list[dict]) -> bytes:
+    items = [{**item, "date": item["date"].strftime("%Y-%m-%d %H:%M")} for item in items]
+    value = ADAPTER.validate_python(page(items))
+    return JSONResponse(ADAPTER.dump_python(value, mode="json")).body
+
+
+def fast(items: list[dict]) -> bytes:
+    return FastJSONResponse(page([{name: item[name] for name in FIELDS} for item in items])).body
+
+
+def gateway_json(body: bytes) -> bytes:
+    return JSONResponse(httpx.Response(200, content=body).json()).body
+
+
+def passthrough(body: bytes) -> bytes:
+    resp = httpx.Response(200, content=body, headers={"content-type": "application/json"})
+    return upstream_response(resp).body
+
+
+def measure(func, arg, repeat: int) -> float:
+    func(arg)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(arg)
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main(sizes: list[int], budget: int):
+    print(f"{'items':>6}{'KB':>8}{'response_model':>16}{'fast':>10}{'gateway json':>14}{'passthrough':>13}  (us)")
+    for size in sizes:
+        repeat = max(budget // size, 10)
+        formatted = rows(size, formatted=True)
+        body = fast(formatted)
+        results = [
+            measure(response_model, rows(size, formatted=False), repeat),
+            measure(fast, formatted, repeat),
+            measure(gateway_json, body, repeat),
+            measure(passthrough, body, repeat),
+        ]
+        print(f"{size:>6}{len(body) / 1024:>8.1f}" + "".join(
+            f"{r:>{w}.1f}" for r, w in zip(results, (16, 10, 14, 13))
+        ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--budget", type=int, default=200_000, help="строк на размер")
+    args = parser.parse_args()
+    main(args.sizes, args.budget)
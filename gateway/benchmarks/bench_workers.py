@@ -0,0 +1,142 @@
+"""Пропускная способность gateway в зависимости от числа воркеров uvicorn.
+
+Gateway запускается отдельным процессом с --workers N и общим каталогом
+GATEWAY_SHARED_DIR, как в Dockerfile. Нагрузка - GET /api/v1/tickets
+(билеты из ticket service и рейсы через кэш). У каждого upstream-а столько
+реплик-заглушек, сколько воркеров в самом большом замере, чтобы в них не
+упирался рост; нагрузку дают --loaders отдельных процессов.
+
+Рост почти линейный, пока ядер хватает на воркеры, заглушки и генераторы
+нагрузки; на машине с одним-двумя ядрами все варианты упрутся в CPU.
+
+    cd gateway && python -m benchmarks.bench_workers --workers 1 2 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+import httpx
+
+from .stubs import StubServer, _free_port, make_bonus_app, make_flight_app, make_ticket_app
+
+GATEWAY_DIR = Path(__file__).resolve().parents[1]
+
+
+def start_gateway(workers: int, upstreams: dict, shared_dir: str) -> tuple[subprocess.Popen, str]:
+    port = _free_port()
+    env = {
+        **os.environ,
+        **upstreams,
+        "GATEWAY_SHARED_DIR": shared_dir,
+        "RETRY_QUEUE_PATH": os.path.join(shared_dir, "retry_queue.sqlite3"),
+        # Построчный лог каждого запроса искажает замеры
+        "LOG_LEVEL": "WARNING",
+    }
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--port", str(port), "--workers", str(workers), "--log-level", "warning",
+        ],
+        cwd=GATEWAY_DIR,
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.1).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"gateway with {workers} workers did not start")
+
+
+async def load(url: str, requests: int, concurrency: int) -> int:
+    done = 0
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits) as client:
+        async def one():
+            nonlocal done
+            resp = await client.get("/api/v1/tickets", headers={"X-User-Name": "BenchUser"})
+            assert resp.status_code == 200, resp.status_code
+            done += 1
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited():
+            async with semaphore:
+                await one()
+
+        await asyncio.gather(*(limited() for _ in range(requests)))
+    return done
+
+
+def _loader(url: str, requests: int, concurrency: int, queue):
+    queue.put(asyncio.run(load(url, requests, concurrency)))
+
+
+def run_load(url: str, requests: int, concurrency: int, loaders: int) -> float:
+    queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=_loader, args=(url, requests // loaders, max(concurrency // loaders, 1), queue)
+        )
+        for _ in range(loaders)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    done = sum(queue.get() for _ in processes)
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+    return done / elapsed
+
+
+def main(worker_counts: list[int], requests: int, concurrency: int, loaders: int | None):
+    replicas = max(worker_counts)
+    loaders = loaders or replicas
+    results = {}
+    with ExitStack() as stack:
+        upstreams = {}
+        for env, factory in (
+            ("FLIGHT_SERVICE_HOST", make_flight_app),
+            ("TICKET_SERVICE_HOST", make_ticket_app),
+            ("BONUS_SERVICE_HOST", make_bonus_app),
+        ):
+            stubs = [stack.enter_context(StubServer(factory)) for _ in range(replicas)]
+            upstreams[env] = ",".join(stub.url for stub in stubs)
+
+        for workers in worker_counts:
+            with tempfile.TemporaryDirectory() as shared_dir:
+                process, url = start_gateway(workers, upstreams, shared_dir)
+                try:
+                    run_load(url, min(requests, 500), concurrency, loaders)  # прогрев
+                    results[workers] = run_load(url, requests, concurrency, loaders)
+                finally:
+                    process.terminate()
+                    process.wait()
+
+    print(f"{requests} requests, concurrency {concurrency}, {loaders} loaders, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8}{'req/s':>10}{'speedup':>10}")
+    base = results[worker_counts[0]]
+    for workers, rps in results.items():
+        print(f"{workers:>8}{rps:>10.0f}{rps / base:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--loaders", type=int, default=None)
+    args = parser.parse_args()
+    main(args.workers, args.requests, args.concurrency, args.loaders)
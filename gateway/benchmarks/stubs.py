@@ -0,0 +1,151 @@
+"""Локальные заглушки flight/ticket/bonus сервисов для бенчмарков.
+
+Каждая заглушка - отдельный uvicorn-процесс на свободном порту, так что
+клиенты гейтвея ходят в них по настоящему TCP и не делят с ними GIL.
+"""
+import asyncio
+import logging
+import multiprocessing
+import socket
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Header
+
+
+FLIGHT = {
+    "flightNumber": "AFL031",
+    "fromAirport": "Санкт-Петербург Пулково",
+    "toAirport": "Москва Шереметьево",
+    "date": "2021-10-08 20:00",
+    "price": 1500,
+}
+
+
+def make_flight_app(delay: float = 0.0) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/manage/health")
+    async def health():
+        return {}
+
+    @app.get("/flights")
+    async def flights(page: int = 1, size: int = 10):
+        await asyncio.sleep(delay)
+        return {"page": page, "pageSize": size, "totalElements": 1, "items": [FLIGHT]}
+
+    @app.get("/flights/{flight_number}")
+    async def flight(flight_number: str):
+        await asyncio.sleep(delay)
+        return {**FLIGHT, "flightNumber": flight_number}
+
+    return app
+
+
+def make_ticket_app(delay: float = 0.0, tickets: int = 5) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/manage/health")
+    async def health():
+        return {}
+
+    @app.get("/tickets")
+    async def get_tickets(x_user_name: str = Header(...)):
+        await asyncio.sleep(delay)
+        return [
+            {
+                "ticketUid": str(uuid.UUID(int=i)),
+                "flightNumber": f"AFL{i:03d}",
+                "price": 1500,
+                "status": "PAID",
+            }
+            for i in range(tickets)
+        ]
+
+    @app.post("/tickets")
+    async def create_ticket(request: dict):
+        await asyncio.sleep(delay)
+        return {
+            "ticketUid": request.get("uuid") or str(uuid.uuid4()),
+            "flightNumber": request["flightNumber"],
+            "price": request["price"],
+            "status": "PAID",
+        }
+
+    @app.patch("/tickets/{ticket_uid}")
+    async def cancel_ticket(ticket_uid: str, request: dict):
+        await asyncio.sleep(delay)
+        return None
+
+    return app
+
+
+def make_bonus_app(delay: float = 0.0) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/manage/health")
+    async def health():
+        return {}
+
+    @app.get("/privilege")
+    async def privilege(username: str):
+        await asyncio.sleep(delay)
+        return {"balance": 150, "status": "BRONZE", "history": []}
+
+    @app.post("/privilege/calculate")
+    async def calculate(request: dict):
+        await asyncio.sleep(delay)
+        return {
+            "paidByBonuses": 0,
+            "balanceDiff": 150,
+            "privilege": {"balance": 150, "status": "BRONZE"},
+        }
+
+    @app.post("/privilege/rollback/{ticket_uid}")
+    async def rollback(ticket_uid: str, request: dict):
+        return None
+
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(factory, kwargs, port):
+    uvicorn.run(factory(**kwargs), host="127.0.0.1", port=port, log_level="warning")
+
+
+class StubServer:
+    """uvicorn в отдельном процессе; использовать как контекстный менеджер"""
+
+    def __init__(self, factory, **kwargs):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process = multiprocessing.Process(
+            target=_serve, args=(factory, kwargs, self.port), daemon=True
+        )
+
+    def __enter__(self):
+        self.process.start()
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), 0.1).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError(f"stub on port {self.port} did not start")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.join()
+
+
+def quiet_logs():
+    # Построчный лог каждого запроса искажает замеры
+    for name in ("gateway", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
@@ -0,0 +1,22 @@
+import os
+
+# Клиенты создаются при импорте app.main, поэтому адреса нужны заранее
+os.environ.setdefault("FLIGHT_SERVICE_HOST", "http://flight_service:8060")
+os.environ.setdefault("TICKET_SERVICE_HOST", "http://ticket_service:8070")
+os.environ.setdefault("BONUS_SERVICE_HOST", "http://bonus_service:8050")
+os.environ.setdefault("RETRY_QUEUE_PATH", ":memory:")
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def clear_flight_cache():
+    # Кэши живут на уровне модуля, тесты не должны видеть данные друг друга
+    from app.main import flight_cache, idempotency_cache, privilege_cache
+
+    caches = (flight_cache, idempotency_cache, privilege_cache)
+    for cache in caches:
+        cache.clear()
+    yield
+    for cache in caches:
+        cache.clear()
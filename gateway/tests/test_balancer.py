@@ -0,0 +1,139 @@
+import asyncio
+import random
+
+import httpx
+import pytest
+
+from app.balancer import LEAST_OUTSTANDING, Balancer, Upstream
+from app.breaker import AsyncCircuitBreaker, BreakerConfig
+from app.clients import FlightClient, ServiceUnavailableException
+
+
+class Stub:
+    """Реплика upstream-а: отвечает сама или ошибкой, /manage/health - отдельно"""
+
+    def __init__(self):
+        self.calls = 0
+        self.status = 200
+        self.healthy = True
+        self.delay = 0.0
+
+    async def __call__(self, request):
+        if request.url.path == "/manage/health":
+            return httpx.Response(200 if self.healthy else 503)
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return httpx.Response(self.status, json={"host": request.url.host})
+
+
+def make_client(stubs, **breaker):
+    async def handler(request):
+        return await stubs[request.url.host](request)
+
+    client = FlightClient(
+        ",".join(f"http://{host}:8060" for host in stubs), "flight",
+        transport=httpx.MockTransport(handler),
+    )
+    for upstream in client.upstreams:
+        upstream.breakers["default"] = AsyncCircuitBreaker(
+            f"flight/default {upstream.url}",
+            BreakerConfig(min_calls=3, **breaker),
+            failure_exceptions=(httpx.HTTPError,),
+        )
+    return client
+
+
+def test_least_outstanding_prefers_idle_upstream():
+    upstreams = [
+        Upstream(f"http://f{i}", {"default": AsyncCircuitBreaker("f", BreakerConfig())})
+        for i in range(3)
+    ]
+    upstreams[0].outstanding = 5
+    upstreams[1].outstanding = 1
+    upstreams[2].outstanding = 3
+
+    assert Balancer(upstreams, LEAST_OUTSTANDING).pick("default") is upstreams[1]
+    # Из двух случайных p2c никогда не выберет самую загруженную
+    p2c = Balancer(upstreams, rng=random.Random(1))
+    assert upstreams[0] not in {p2c.pick("default") for _ in range(50)}
+
+    upstreams[1].healthy = False
+    assert Balancer(upstreams, LEAST_OUTSTANDING).pick("default") is upstreams[2]
+
+
+@pytest.mark.asyncio
+async def test_requests_are_spread_over_replicas():
+    stubs = {"f1": Stub(), "f2": Stub(), "f3": Stub()}
+    for stub in stubs.values():
+        stub.delay = 0.01
+    client = make_client(stubs)
+
+    # Разные страницы: одинаковые одновременные запросы объединились бы в один
+    await asyncio.gather(*(client.get_flights(page, 10) for page in range(30)))
+
+    assert all(stub.calls > 0 for stub in stubs.values())
+    assert sum(stub.calls for stub in stubs.values()) == 30
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_failing_replica_is_ejected_and_restored_by_health_check():
+    stubs = {"f1": Stub(), "f2": Stub()}
+    stubs["f2"].status = 500
+    client = make_client(stubs, open_duration=60)
+
+    failures = 0
+    for _ in range(30):
+        try:
+            await client.get_flights(1, 10)
+        except ServiceUnavailableException:
+            failures += 1
+
+    # После min_calls ошибок реплика исключена, остальные запросы идут на f1
+    assert stubs["f2"].calls == failures == 3
+    assert client.upstreams[1].breakers["default"].state == "open"
+    assert client.breaker_state() == "closed"
+
+    stubs["f2"].status = 200
+    await client.check_health()
+    assert client.upstreams[1].breakers["default"].state == "half_open"
+
+    for _ in range(10):
+        await client.get_flights(1, 10)
+    assert stubs["f2"].calls > 3
+    assert client.upstreams[1].breakers["default"].state == "closed"
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_unhealthy_replica_gets_no_traffic():
+    stubs = {"f1": Stub(), "f2": Stub()}
+    stubs["f1"].healthy = False
+    client = make_client(stubs)
+
+    await client.check_health()
+    for _ in range(10):
+        await client.get_flights(1, 10)
+    assert stubs["f1"].calls == 0
+
+    stubs["f1"].healthy = False
+    stubs["f2"].healthy = False
+    await client.check_health()
+    # Все реплики нездоровы - решение за breaker-ами, запросы не отклоняются
+    await client.get_flights(1, 10)
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_hedge_goes_to_another_replica():
+    stubs = {"f1": Stub(), "f2": Stub()}
+    client = make_client(stubs)
+    for _ in range(60):
+        client.latency.observe("get_flight", 0.01)
+    slow = client.balancer.pick("default")
+    stubs[httpx.URL(slow.url).host].delay = 1
+
+    response = await asyncio.wait_for(client.get_flight("AFL031"), 0.5)
+
+    assert response.json()["host"] != httpx.URL(slow.url).host
+    await client.close()
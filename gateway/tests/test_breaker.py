@@ -0,0 +1,169 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.breaker import AsyncCircuitBreaker, BreakerConfig, CircuitOpenError, config_from_env
+from app.clients import BonusClient, FlightClient, ServiceUnavailableException
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def ok():
+    return "ok"
+
+
+async def fail():
+    raise httpx.ConnectError("down")
+
+
+async def run(breaker, fn, times=1):
+    for _ in range(times):
+        try:
+            await breaker.call(fn)
+        except (httpx.HTTPError, CircuitOpenError):
+            pass
+
+
+def make_breaker(clock, **config):
+    transitions = []
+    breaker = AsyncCircuitBreaker(
+        "test",
+        BreakerConfig(**{"min_calls": 4, "failure_rate": 0.5, **config}),
+        failure_exceptions=(httpx.HTTPError,),
+        on_transition=lambda b, previous, state: transitions.append((previous, state)),
+        clock=clock,
+    )
+    return breaker, transitions
+
+
+@pytest.mark.asyncio
+async def test_opens_on_failure_rate_in_window():
+    clock = FakeClock()
+    breaker, transitions = make_breaker(clock)
+
+    await run(breaker, fail, 2)
+    await run(breaker, ok)
+    assert breaker.state == "closed"  # меньше min_calls
+
+    await run(breaker, fail)
+    assert breaker.state == "open"
+    assert transitions == [("closed", "open")]
+
+    with pytest.raises(CircuitOpenError):
+        await breaker.call(ok)
+    assert breaker.rejected == 1
+
+
+@pytest.mark.asyncio
+async def test_old_failures_leave_the_window():
+    clock = FakeClock()
+    breaker, _ = make_breaker(clock, window=10, buckets=10)
+
+    await run(breaker, fail, 3)
+    clock.now += 11
+    await run(breaker, ok, 3)
+    await run(breaker, fail)
+
+    assert breaker.window_stats() == {"calls": 4, "failures": 1, "slow": 0}
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_opens_on_slow_call_rate():
+    clock = FakeClock()
+    breaker, _ = make_breaker(clock, slow_call_duration=1.0, slow_call_rate=0.5)
+
+    async def slow():
+        clock.now += 2
+        return "ok"
+
+    await run(breaker, slow, 2)
+    await run(breaker, ok, 1)
+    assert breaker.state == "closed"
+    await run(breaker, slow, 1)
+    assert breaker.state == "open"
+
+
+@pytest.mark.asyncio
+async def test_half_open_limits_concurrent_probes():
+    clock = FakeClock()
+    breaker, transitions = make_breaker(clock, open_duration=10, half_open_calls=2)
+    await run(breaker, fail, 4)
+
+    clock.now += 10
+    assert breaker.state == "half_open"
+
+    release = asyncio.Event()
+    calls = 0
+
+    async def probe():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "ok"
+
+    probes = [asyncio.create_task(breaker.call(probe)) for _ in range(2)]
+    await asyncio.sleep(0)
+    # Третий одновременный вызов отклоняется, не доходя до upstream
+    with pytest.raises(CircuitOpenError):
+        await breaker.call(probe)
+    assert calls == 2
+
+    release.set()
+    await asyncio.gather(*probes)
+    assert breaker.state == "closed"
+    assert transitions == [("closed", "open"), ("open", "half_open"), ("half_open", "closed")]
+
+
+@pytest.mark.asyncio
+async def test_failed_probe_reopens():
+    clock = FakeClock()
+    breaker, _ = make_breaker(clock, open_duration=10)
+    await run(breaker, fail, 4)
+    clock.now += 10
+
+    await run(breaker, fail)
+
+    assert breaker.state == "open"
+    assert breaker.snapshot()["open_remaining"] == 10
+
+
+def test_config_per_client_from_env(monkeypatch):
+    monkeypatch.setenv("BONUS_SERVICE_BREAKER_FAILURE_RATE", "0.3")
+    monkeypatch.setenv("BONUS_SERVICE_BREAKER_MIN_CALLS", "50")
+
+    assert config_from_env("BONUS_SERVICE", BreakerConfig()) == BreakerConfig(failure_rate=0.3, min_calls=50)
+    bonus = BonusClient("http://bonus", "bonus")
+    assert bonus.upstreams[0].breakers["default"].config.failure_rate == 0.3
+    # У пакетного маршрута flight свой breaker
+    flight = FlightClient("http://flight", "flight")
+    assert set(flight.upstreams[0].breakers) == {"default", "flights_batch"}
+
+
+@pytest.mark.asyncio
+async def test_client_stops_calling_failing_upstream():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(500)
+
+    client = BonusClient("http://bonus", "bonus", transport=httpx.MockTransport(handler))
+    client.upstreams[0].breakers["default"] = AsyncCircuitBreaker(
+        "bonus/default", BreakerConfig(min_calls=3), failure_exceptions=(httpx.HTTPError,)
+    )
+
+    for _ in range(10):
+        with pytest.raises(ServiceUnavailableException):
+            await client.get_privilege("TestUser")
+
+    assert len(calls) == 3
+    assert client.breaker_state() == "open"
+    await client.close()
@@ -0,0 +1,170 @@
+import asyncio
+
+import pytest
+from httpx import ASGITransport, AsyncClient, Response
+from unittest.mock import AsyncMock, patch
+
+from app.cache import TTLCache, Versioned
+from app.clients import ServiceUnavailableException
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.asyncio
+async def test_ttl_and_lru_eviction():
+    clock = FakeClock()
+    cache = TTLCache(max_size=2, ttl=10, clock=clock)
+    load = AsyncMock(side_effect=lambda key: {"flightNumber": key})
+
+    await cache.get("AFL031", load)
+    await cache.get("AFL031", load)
+    assert load.await_count == 1
+
+    clock.now = 11
+    await cache.get("AFL031", load)
+    assert load.await_count == 2
+
+    await cache.get("AFL032", load)
+    await cache.get("AFL031", load)
+    await cache.get("AFL033", load)  # вытесняет давно не читанный AFL032
+
+    stats = cache.stats()
+    assert stats["size"] == 2
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 2
+    assert stats["misses"] == 4
+
+    # Очистка удаляет записи, но счетчики остаются монотонными
+    cache.clear()
+    assert cache.stats()["size"] == 0
+    assert cache.stats()["hits"] == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_load():
+    cache = TTLCache(max_size=10, ttl=10)
+    calls = 0
+
+    async def load(key):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"flightNumber": key}
+
+    results = await asyncio.gather(*(cache.get("AFL031", load) for _ in range(100)))
+
+    assert calls == 1
+    assert all(r == {"flightNumber": "AFL031"} for r in results)
+    assert cache.stats()["coalesced"] == 99
+
+
+@pytest.mark.asyncio
+async def test_stale_entry_served_while_upstream_unavailable():
+    clock = FakeClock()
+    cache = TTLCache(max_size=10, ttl=10, clock=clock)
+    await cache.get("AFL031", AsyncMock(return_value={"price": 1500}))
+
+    clock.now = 60
+    broken = AsyncMock(side_effect=ServiceUnavailableException())
+    value = await cache.get("AFL031", broken, stale_on=ServiceUnavailableException)
+
+    assert value == {"price": 1500}
+    assert cache.stats()["stale_hits"] == 1
+    with pytest.raises(ServiceUnavailableException):
+        await cache.get("AFL032", broken, stale_on=ServiceUnavailableException)
+
+
+@pytest.mark.asyncio
+async def test_get_many_loads_only_misses():
+    cache = TTLCache(max_size=10, ttl=10)
+    cache.set("AFL031", {"flightNumber": "AFL031"})
+    load_many = AsyncMock(side_effect=lambda batch: {n: {"flightNumber": n} for n in batch if n != "NONE"})
+
+    result = await cache.get_many(["AFL031", "AFL032", "NONE", "AFL032"], load_many)
+
+    load_many.assert_awaited_once_with(["AFL032", "NONE"])
+    assert result == {
+        "AFL031": {"flightNumber": "AFL031"},
+        "AFL032": {"flightNumber": "AFL032"},
+        "NONE": None,
+    }
+    # Ненайденный рейс не кэшируется
+    assert cache.stats()["size"] == 2
+
+
+@pytest.mark.asyncio
+async def test_ticket_views_reuse_cached_flight():
+    from app.main import app
+
+    ticket = {"ticketUid": "uid", "flightNumber": "AFL031", "price": 1500, "status": "PAID"}
+    flight = {"flightNumber": "AFL031", "fromAirport": "A", "toAirport": "B", "date": "2021-10-08 20:00"}
+
+    with patch("app.main.ticket_client.get_ticket_by_uid", new_callable=AsyncMock) as mock_ticket, \
+         patch("app.main.flight_client.get_flight", new_callable=AsyncMock) as mock_flight:
+        mock_ticket.return_value = Response(200, json=ticket)
+        mock_flight.return_value = Response(200, json=flight)
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            for _ in range(3):
+                response = await ac.get("/api/v1/tickets/uid", headers={"X-User-Name": "TestUser"})
+                assert response.json()["fromAirport"] == "A"
+            stats = (await ac.get("/manage/cache")).json()["flights"]
+
+    assert mock_flight.await_count == 1
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_expired_flight_is_revalidated_with_etag(monkeypatch):
+    from app.main import flight_cache, get_flight_info
+
+    clock = FakeClock()
+    monkeypatch.setattr(flight_cache, "_clock", clock)
+    flight = {"flightNumber": "AFL031", "fromAirport": "A", "toAirport": "B"}
+    with patch("app.main.flight_client.get_flight", new_callable=AsyncMock) as mock_flight:
+        mock_flight.return_value = Response(200, json=flight, headers={"ETag": '"v1"'})
+        assert await get_flight_info("AFL031") == flight
+
+        clock.now += flight_cache.ttl + 1
+        mock_flight.return_value = Response(304, headers={"ETag": '"v1"'})
+        assert await get_flight_info("AFL031") == flight
+        mock_flight.assert_awaited_with("AFL031", etag='"v1"')
+
+
+@pytest.mark.asyncio
+async def test_privilege_is_revalidated_on_every_request():
+    from app.main import app
+
+    privilege = {"balance": 150, "status": "BRONZE", "history": []}
+    with patch("app.main.bonus_client.get_privilege", new_callable=AsyncMock) as mock_bonus:
+        mock_bonus.return_value = Response(200, json=privilege, headers={"ETag": '"p1"'})
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            first = await ac.get("/api/v1/privilege", headers={"X-User-Name": "TestUser"})
+            mock_bonus.return_value = Response(304, headers={"ETag": '"p1"'})
+            second = await ac.get("/api/v1/privilege", headers={"X-User-Name": "TestUser"})
+
+    assert first.json() == second.json() == privilege
+    mock_bonus.assert_awaited_with("TestUser", etag='"p1"')
+
+
+@pytest.mark.asyncio
+async def test_manage_cache_invalidation():
+    from app.main import app, flight_cache
+
+    flight_cache.set("AFL031", Versioned({"flightNumber": "AFL031"}))
+    flight_cache.set("AFL032", Versioned({"flightNumber": "AFL032"}))
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        assert (await ac.delete("/manage/cache/flights/AFL031")).status_code == 204
+        assert flight_cache.peek("AFL031") is None
+        assert flight_cache.peek("AFL032") is not None
+
+        assert (await ac.delete("/manage/cache/flights")).status_code == 204
+        assert flight_cache.peek("AFL032") is None
+        assert (await ac.delete("/manage/cache/unknown")).status_code == 404
@@ -0,0 +1,185 @@
+import asyncio
+
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+
+from app.clients import FlightClient, BonusClient, ServiceUnavailableException, TicketClient
+
+
+def make_transport(calls):
+    def handler(request: httpx.Request):
+        calls.append(request)
+        return httpx.Response(200, json={"flightNumber": request.url.path[-6:]})
+
+    return httpx.MockTransport(handler)
+
+
+@pytest.mark.asyncio
+async def test_client_reuses_pool_between_calls():
+    calls = []
+    client = FlightClient("http://flight/", "flight", transport=make_transport(calls))
+    await client.start()
+    pool = client.client
+
+    await client.get_flight("AFL031")
+    await client.get_flight("AFL032")
+
+    assert client.client is pool
+    assert [c.url.path for c in calls] == ["/flights/AFL031", "/flights/AFL032"]
+
+    await client.close()
+    assert client._client is None
+
+
+def test_limits_per_service(monkeypatch):
+    monkeypatch.setenv("BONUS_SERVICE_MAX_CONNECTIONS", "7")
+    monkeypatch.setenv("BONUS_SERVICE_TIMEOUT", "0.5")
+
+    bonus = BonusClient("http://bonus", "bonus")
+    flight = FlightClient("http://flight", "flight")
+
+    assert bonus.limits.max_connections == 7
+    assert bonus.timeouts.read == 0.5
+    assert flight.limits.max_connections == FlightClient.max_connections
+    assert flight.timeouts.read == 2.0
+
+
+@pytest.mark.asyncio
+async def test_get_flights_by_numbers_is_one_call():
+    calls = []
+    client = FlightClient("http://flight", "flight", transport=make_transport(calls))
+
+    await client.get_flights_by_numbers(["AFL031", "AFL032", "AFL033"])
+
+    assert len(calls) == 1
+    assert calls[0].url.params["numbers"] == "AFL031,AFL032,AFL033"
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_get_tickets_sends_only_given_options():
+    calls = []
+    client = TicketClient("http://ticket", "ticket", transport=make_transport(calls))
+
+    await client.get_tickets("TestUser")
+    await client.get_tickets("TestUser", status="PAID", limit=20, fields=["ticketUid", "status"])
+
+    assert dict(calls[0].url.params) == {}
+    assert dict(calls[1].url.params) == {"status": "PAID", "limit": "20", "fields": "ticketUid,status"}
+    assert calls[1].headers["X-User-Name"] == "TestUser"
+    await client.close()
+
+
+def make_slow_transport(calls, delay=0.02):
+    async def handler(request: httpx.Request):
+        calls.append(request)
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json={"path": request.url.path})
+
+    return httpx.MockTransport(handler)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_gets_share_one_upstream_call():
+    calls = []
+    client = FlightClient("http://flight", "flight", transport=make_slow_transport(calls))
+    labels = {"service": "flight", "endpoint": "get_flights", "role": "shared"}
+    shared_before = REGISTRY.get_sample_value("gateway_coalesced_requests_total", labels) or 0
+
+    responses = await asyncio.gather(
+        *(client.get_flights(1, 10) for _ in range(5)),
+        client.get_flights(2, 10),
+        client.get_flights(1, 10, etag='"v1"'),
+    )
+
+    # Разные параметры и заголовки - разные запросы
+    assert len(calls) == 3
+    assert len({id(r) for r in responses[:5]}) == 1
+    assert client.inflight.shared == 4
+    assert REGISTRY.get_sample_value("gateway_coalesced_requests_total", labels) - shared_before == 4
+    assert client.inflight.in_flight() == 0
+
+    # Запрос после завершения общего идет в upstream заново
+    await client.get_flights(1, 10)
+    assert len(calls) == 4
+
+
+@pytest.mark.asyncio
+async def test_coalescing_skips_writes_and_can_be_disabled(monkeypatch):
+    calls = []
+    bonus = BonusClient("http://bonus", "bonus", transport=make_slow_transport(calls))
+    await asyncio.gather(*(bonus.rollback("user", "uid", 100) for _ in range(3)))
+    assert len(calls) == 3
+
+    monkeypatch.setenv("FLIGHT_SERVICE_COALESCING", "false")
+    flight = FlightClient("http://flight", "flight", transport=make_slow_transport(calls))
+    await asyncio.gather(*(flight.get_flight("AFL031") for _ in range(3)))
+    assert len(calls) == 6
+
+
+@pytest.mark.asyncio
+async def test_cancelled_first_caller_does_not_cancel_shared_call():
+    calls = []
+    client = FlightClient("http://flight", "flight", transport=make_slow_transport(calls))
+
+    first = asyncio.create_task(client.get_flight("AFL031"))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(client.get_flight("AFL031"))
+    await asyncio.sleep(0.005)
+    first.cancel()
+
+    assert (await second).json() == {"path": "/flights/AFL031"}
+    assert first.cancelled()
+    assert len(calls) == 1
+
+
+class ChunkStream(httpx.AsyncByteStream):
+    """Тело ответа upstream-а, которое отдается кусками и помнит, сколько прочитано"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.sent = 0
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            self.sent += 1
+            yield chunk
+
+    async def aclose(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_export_returns_unread_stream():
+    body = ChunkStream([b'{"price": 1}\n', b'{"price": 2}\n'])
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, stream=body, headers={"content-type": "application/x-ndjson"})
+
+    client = TicketClient("http://ticket", "ticket", transport=httpx.MockTransport(handler))
+    resp = await client.export_tickets("user", "PAID")
+
+    # Ответ вернулся до чтения тела: gateway не собирает выгрузку в памяти
+    assert body.sent == 0
+    assert [chunk async for chunk in resp.aiter_bytes()] == body.chunks
+    await resp.aclose()
+    assert body.closed
+    assert requests[0].url.path == "/tickets/export"
+    assert requests[0].url.params["status"] == "PAID"
+
+
+@pytest.mark.asyncio
+async def test_export_server_error_closes_stream():
+    body = ChunkStream([b"error"])
+    client = BonusClient(
+        "http://bonus", "bonus",
+        transport=httpx.MockTransport(lambda request: httpx.Response(500, stream=body)),
+    )
+
+    with pytest.raises(ServiceUnavailableException):
+        await client.export_history("user")
+    assert body.closed
@@ -1,6 +1,8 @@
+import httpx
 import pytest
 from httpx import AsyncClient, Response
 from unittest.mock import AsyncMock, patch
+from app.clients import ServiceUnavailableException
 from app.main import app
 
 # Тестовые данные
@@ -21,19 +23,92 @@ async def client():
 async def test_get_flights(client):
     """Тест получения списка рейсов"""
     with patch("app.main.flight_client.get_flights", new_callable=AsyncMock) as mock_get:
-        mock_get.return_value = Response(200, json={"items": [{"flightNumber": "AFL031"}]})
+        mock_get.return_value = Response(
+            200, json={"items": [{"flightNumber": "AFL031"}]}, headers={"ETag": '"v1"'}
+        )
         
-        response = await client.get("/api/v1/flights?page=0&size=10")
+        response = await client.get("/api/v1/flights?page=1&size=10")
         
         assert response.status_code == 200
         assert response.json()["items"][0]["flightNumber"] == "AFL031"
-        mock_get.assert_called_once_with(0, 10)
+        # Тело flight service отдается без разбора и повторной сериализации
+        assert response.content == mock_get.return_value.content
+        assert response.headers["ETag"] == '"v1"'
+        mock_get.assert_called_once_with(1, 10, etag=None)
+
+
+@pytest.mark.asyncio
+async def test_get_flights_validates_page(client):
+    """Неверная страница отклоняется самим gateway, отказ flight service
+    отдается в формате ошибок gateway, а не байтами upstream-а"""
+    with patch("app.main.flight_client.get_flights", new_callable=AsyncMock) as mock_get:
+        response = await client.get("/api/v1/flights?page=0")
+        assert response.status_code == 400
+        assert "page" in response.json()["message"]
+        assert (await client.get("/api/v1/flights?size=1000")).status_code == 400
+        mock_get.assert_not_called()
+
+        mock_get.return_value = Response(422, json={"detail": [{"loc": ["query", "page"]}]})
+        response = await client.get("/api/v1/flights")
+        assert response.status_code == 400
+        assert "message" in response.json()
+
+        mock_get.return_value = Response(500)
+        assert (await client.get("/api/v1/flights")).status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_search_flights_forwards_filters(client):
+    with patch("app.main.flight_client.search_flights", new_callable=AsyncMock) as mock_search:
+        mock_search.return_value = Response(
+            200, json={"pageSize": 10, "nextCursor": None, "items": [{"flightNumber": "AFL031"}]}
+        )
+
+        response = await client.get(
+            "/api/v1/flights/search?fromAirport=Москва&dateFrom=2026-01-01&maxPrice=2000&sort=-price"
+        )
+
+        assert response.status_code == 200
+        assert response.content == mock_search.return_value.content
+        filters = mock_search.call_args.args[0]
+        assert filters["fromAirport"] == "Москва"
+        assert filters["dateFrom"] == "2026-01-01T00:00:00"
+        assert (filters["maxPrice"], filters["sort"], filters["toAirport"]) == (2000, "-price", None)
+
+
+@pytest.mark.asyncio
+async def test_search_flights_bad_cursor(client):
+    with patch("app.main.flight_client.search_flights", new_callable=AsyncMock) as mock_search:
+        mock_search.return_value = Response(400, json={"detail": "Invalid cursor"})
+
+        response = await client.get("/api/v1/flights/search?cursor=garbage")
+
+        assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_flights_not_modified(client):
+    """Условный запрос списка рейсов передается flight service"""
+    with patch("app.main.flight_client.get_flights", new_callable=AsyncMock) as mock_get:
+        mock_get.return_value = Response(304, headers={"ETag": '"v1"'})
+
+        response = await client.get("/api/v1/flights", headers={"If-None-Match": '"v1"'})
+
+        assert response.status_code == 304
+        assert response.headers["ETag"] == '"v1"'
+        mock_get.assert_called_once_with(1, 10, etag='"v1"')
+
+        # Без ETag в ответе upstream-а заголовок не передается
+        mock_get.return_value = Response(304)
+        response = await client.get("/api/v1/flights", headers={"If-None-Match": '"v1"'})
+        assert response.status_code == 304
+        assert "ETag" not in response.headers
 
 @pytest.mark.asyncio
 async def test_get_user_tickets_aggregation(client):
     """Тест агрегации данных билета и рейса"""
     with patch("app.main.ticket_client.get_tickets", new_callable=AsyncMock) as mock_tickets, \
-         patch("app.main.flight_client.get_flight", new_callable=AsyncMock) as mock_flight:
+         patch("app.main.flight_client.get_flights_by_numbers", new_callable=AsyncMock) as mock_flight:
         
         # Данные из Ticket Service
         mock_tickets.return_value = Response(200, json=[{
@@ -44,11 +119,12 @@ async def test_get_user_tickets_aggregation(client):
         }])
         
         # Данные из Flight Service
-        mock_flight.return_value = Response(200, json={
+        mock_flight.return_value = Response(200, json={"items": [{
+            "flightNumber": "AFL031",
             "fromAirport": "Пулково Санкт-Петербург",
             "toAirport": "Шереметьево Москва",
             "date": "2021-10-08 20:00"
-        })
+        }]})
 
         response = await client.get("/api/v1/tickets", headers={"X-User-Name": MOCK_USERNAME})
         
@@ -58,6 +134,189 @@ async def test_get_user_tickets_aggregation(client):
         assert data["fromAirport"] == "Пулково Санкт-Петербург"
         assert data["price"] == 1500
 
+@pytest.mark.asyncio
+async def test_get_user_tickets_batches_and_partial_failure(client, monkeypatch):
+    """Рейсы запрашиваются пакетами без повторов, сбой пакета портит только свои строки"""
+    from app import main
+    from app.clients import ServiceUnavailableException
+
+    monkeypatch.setattr(main, "FLIGHT_BATCH_SIZE", 2)
+
+    async def get_flights_by_numbers(flight_numbers):
+        if "BROKEN" in flight_numbers:
+            raise ServiceUnavailableException()
+        return Response(200, json={"items": [
+            {"flightNumber": n, "fromAirport": "Пулково Санкт-Петербург",
+             "toAirport": "Шереметьево Москва", "date": "2021-10-08 20:00"}
+            for n in flight_numbers
+        ]})
+
+    tickets = [
+        {"ticketUid": MOCK_TICKET_UID, "flightNumber": number, "price": 1500, "status": "PAID"}
+        for number in ["AFL031", "AFL032", "AFL031", "BROKEN", "AFL033"]
+    ]
+
+    with patch("app.main.ticket_client.get_tickets", new_callable=AsyncMock) as mock_tickets, \
+         patch("app.main.flight_client.get_flights_by_numbers", side_effect=get_flights_by_numbers) as mock_flight:
+        mock_tickets.return_value = Response(200, json=tickets)
+
+        response = await client.get("/api/v1/tickets", headers={"X-User-Name": MOCK_USERNAME})
+
+        assert response.status_code == 200
+        assert [t["fromAirport"] for t in response.json()] == [
+            "Пулково Санкт-Петербург", "Пулково Санкт-Петербург", "Пулково Санкт-Петербург",
+            "Unknown", "Unknown",
+        ]
+        assert [c.args[0] for c in mock_flight.call_args_list] == [
+            ["AFL031", "AFL032"], ["BROKEN", "AFL033"]
+        ]
+
+
+@pytest.mark.asyncio
+async def test_flight_batches_are_bounded(monkeypatch):
+    """Одновременно выполняется не больше FLIGHT_LOOKUP_CONCURRENCY пакетов"""
+    import asyncio
+    from app import main
+
+    monkeypatch.setattr(main, "FLIGHT_LOOKUP_CONCURRENCY", 3)
+    monkeypatch.setattr(main, "FLIGHT_BATCH_SIZE", 1)
+    in_flight = 0
+    peak = 0
+
+    async def get_flights_by_numbers(flight_numbers):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return Response(200, json={"items": [{"flightNumber": flight_numbers[0]}]})
+
+    with patch("app.main.flight_client.get_flights_by_numbers", side_effect=get_flights_by_numbers):
+        flights = await main.fetch_flights_info(f"AFL{i:03d}" for i in range(20))
+
+    assert len(flights) == 20
+    assert peak == 3
+
+
+@pytest.mark.asyncio
+async def test_get_user_tickets_passes_paging_through(client):
+    """Фильтр и страница передаются в ticket service, курсор - обратно клиенту"""
+    with patch("app.main.ticket_client.get_tickets", new_callable=AsyncMock) as mock_tickets, \
+         patch("app.main.flight_client.get_flights_by_numbers", new_callable=AsyncMock) as mock_flight:
+        mock_tickets.return_value = Response(
+            200,
+            json=[{"ticketUid": MOCK_TICKET_UID, "flightNumber": "AFL031", "price": 1500, "status": "PAID"}],
+            headers={"X-Next-Cursor": "Nw"},
+        )
+        mock_flight.return_value = Response(200, json={"items": []})
+
+        response = await client.get(
+            "/api/v1/me?status=PAID&limit=1&cursor=OQ", headers={"X-User-Name": MOCK_USERNAME}
+        )
+
+        assert response.status_code == 200
+        assert response.headers["X-Next-Cursor"] == "Nw"
+        assert len(response.json()["tickets"]) == 1
+        mock_tickets.assert_called_once_with(
+            MOCK_USERNAME, status="PAID", limit=1, cursor="OQ", fields=None
+        )
+
+
+@pytest.mark.asyncio
+async def test_get_user_tickets_forwards_projection(client):
+    """Проекция уходит в ticket service; без полей рейса flight service не нужен"""
+    with patch("app.main.ticket_client.get_tickets", new_callable=AsyncMock) as mock_tickets, \
+         patch("app.main.flight_client.get_flights_by_numbers", new_callable=AsyncMock) as mock_flight:
+        mock_tickets.return_value = Response(200, json=[{"ticketUid": MOCK_TICKET_UID, "status": "PAID"}])
+
+        response = await client.get(
+            "/api/v1/tickets?fields=ticketUid,status", headers={"X-User-Name": MOCK_USERNAME}
+        )
+
+        assert response.json() == [{"ticketUid": MOCK_TICKET_UID, "status": "PAID"}]
+        assert mock_tickets.call_args.kwargs["fields"] == ["ticketUid", "status"]
+        mock_flight.assert_not_called()
+
+        mock_tickets.return_value = Response(200, json=[{"price": 1500, "flightNumber": "AFL031"}])
+        mock_flight.return_value = Response(200, json={"items": [
+            {"flightNumber": "AFL031", "fromAirport": "Пулково Санкт-Петербург"}
+        ]})
+
+        response = await client.get(
+            "/api/v1/tickets?fields=price,fromAirport", headers={"X-User-Name": MOCK_USERNAME}
+        )
+
+        assert response.json() == [{"price": 1500, "fromAirport": "Пулково Санкт-Петербург"}]
+        assert mock_tickets.call_args.kwargs["fields"] == ["price", "flightNumber"]
+
+        response = await client.get(
+            "/api/v1/tickets?fields=password", headers={"X-User-Name": MOCK_USERNAME}
+        )
+        assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_user_info_reads_balance_without_history(client):
+    with patch("app.main.ticket_client.get_tickets", new_callable=AsyncMock) as mock_tickets, \
+         patch("app.main.bonus_client.get_privilege_balance", new_callable=AsyncMock) as mock_balance, \
+         patch("app.main.bonus_client.get_privilege", new_callable=AsyncMock) as mock_privilege:
+        mock_tickets.return_value = Response(200, json=[])
+        mock_balance.return_value = Response(200, json={"balance": 150, "status": "BRONZE"})
+
+        response = await client.get("/api/v1/me", headers={"X-User-Name": MOCK_USERNAME})
+
+        assert response.json()["privilege"] == {"balance": 150, "status": "BRONZE"}
+        mock_privilege.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_get_privilege_history_passes_cursor_through(client):
+    with patch("app.main.bonus_client.get_privilege_history", new_callable=AsyncMock) as mock_history:
+        mock_history.return_value = Response(200, json=[], headers={"X-Next-Cursor": "Nw"})
+
+        response = await client.get(
+            "/api/v1/privilege/history?since=OQ&limit=50", headers={"X-User-Name": MOCK_USERNAME}
+        )
+
+        assert response.status_code == 200
+        assert response.headers["X-Next-Cursor"] == "Nw"
+        mock_history.assert_called_once_with(MOCK_USERNAME, since="OQ", limit=50)
+
+@pytest.mark.asyncio
+async def test_export_tickets_streams_upstream_body(client, monkeypatch):
+    from app.clients import TicketClient
+
+    chunks = [b'{"ticketUid": "a"}\n', b'{"ticketUid": "b"}\n']
+
+    async def body():
+        for chunk in chunks:
+            yield chunk
+
+    def handler(request):
+        assert request.headers["X-User-Name"] == MOCK_USERNAME
+        return Response(200, content=body(), headers={"content-type": "application/x-ndjson"})
+
+    monkeypatch.setattr(
+        "app.main.ticket_client",
+        TicketClient("http://ticket", "ticket", transport=httpx.MockTransport(handler)),
+    )
+    response = await client.get("/api/v1/tickets/export", headers={"X-User-Name": MOCK_USERNAME})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.content == b"".join(chunks)
+
+
+@pytest.mark.asyncio
+async def test_export_history_upstream_unavailable(client):
+    with patch("app.main.bonus_client.export_history", new_callable=AsyncMock) as mock_export:
+        mock_export.side_effect = ServiceUnavailableException()
+
+        response = await client.get("/api/v1/privilege/export", headers={"X-User-Name": MOCK_USERNAME})
+
+        assert response.status_code == 503
+
+
 @pytest.mark.asyncio
 async def test_buy_ticket_flow(client):
     """Тест сценария покупки билета с бонусами"""
@@ -66,11 +325,11 @@ async def test_buy_ticket_flow(client):
          patch("app.main.ticket_client.create_ticket", new_callable=AsyncMock) as mock_t:
         
         mock_f.return_value = Response(200, json={"price": 1500})
-        mock_b.return_value = Response(200, json={
+        mock_b.return_value = Response(201, json={
             "paidByBonuses": 500,
             "privilege": {"balance": 0, "status": "BRONZE"}
         })
-        mock_t.return_value = Response(200, json={
+        mock_t.return_value = Response(201, json={
             "ticketUid": MOCK_TICKET_UID,
             "flightNumber": "AFL031",
             "status": "PAID"
@@ -92,20 +351,63 @@ async def test_buy_ticket_flow(client):
         res_json = response.json()
         assert res_json["paidByMoney"] == 1000
         assert res_json["paidByBonuses"] == 500
-        # Проверка, что Ticket Service получил финальную цену
-        args, _ = mock_t.call_args
-        assert args[1]["price"] == 1000
+        # Билет и бонусная операция создаются с одним uid; в билете - цена
+        # рейса, по ней при возврате откатываются бонусы
+        username, ticket_uid, price, flight_number = mock_t.call_args.args
+        assert (username, price, flight_number) == (MOCK_USERNAME, 1500, "AFL031")
+        assert mock_b.call_args.args == (MOCK_USERNAME, ticket_uid, 1500, True)
 
 @pytest.mark.asyncio
 async def test_refund_ticket_not_found(client):
     """Тест ошибки при возврате несуществующего билета"""
-    with patch("app.main.ticket_client.delete_ticket", new_callable=AsyncMock) as mock_del:
-        mock_del.return_value = Response(404)
-        
+    with patch("app.main.ticket_client.get_ticket_by_uid", new_callable=AsyncMock) as mock_get, \
+         patch("app.main.ticket_client.delete_ticket", new_callable=AsyncMock) as mock_del:
+        # Цена для отката бонусов читается до отмены билета
+        mock_get.return_value = Response(404)
+
         response = await client.delete(
-            f"/api/v1/tickets/{MOCK_TICKET_UID}", 
+            f"/api/v1/tickets/{MOCK_TICKET_UID}",
             headers={"X-User-Name": MOCK_USERNAME}
         )
-        
+
         assert response.status_code == 404
-        assert response.json()["detail"] == "Ticket not found"
\ No newline at end of file
+        assert response.json()["message"] == "Ticket not found"
+        mock_del.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_buy_ticket_idempotency_key(client):
+    """Повтор покупки с тем же Idempotency-Key не вызывает сервисы второй раз"""
+    with patch("app.main.flight_client.get_flight", new_callable=AsyncMock) as mock_f, \
+         patch("app.main.bonus_client.calculate", new_callable=AsyncMock) as mock_b, \
+         patch("app.main.ticket_client.create_ticket", new_callable=AsyncMock) as mock_t:
+
+        mock_f.return_value = Response(200, json={"flightNumber": "AFL031", "price": 1500})
+        mock_b.return_value = Response(200, json={
+            "paidByBonuses": 0,
+            "privilege": {"balance": 150, "status": "BRONZE"}
+        })
+        mock_t.return_value = Response(200, json={"ticketUid": MOCK_TICKET_UID, "status": "PAID"})
+
+        payload = {"flightNumber": "AFL031", "price": 1500, "paidFromBalance": False}
+        headers = {"X-User-Name": MOCK_USERNAME, "Idempotency-Key": "purchase-1"}
+
+        first = await client.post("/api/v1/tickets", json=payload, headers=headers)
+        second = await client.post("/api/v1/tickets", json=payload, headers=headers)
+
+        assert first.status_code == second.status_code == 200
+        assert first.json() == second.json()
+        assert mock_b.await_count == mock_t.await_count == 1
+        # uid билета выводится из ключа - повтор после потери кэша придет
+        # в сервисы с тем же uid
+        ticket_uid = mock_b.await_args.args[1]
+        assert ticket_uid == mock_t.await_args.args[1]
+
+        other = await client.post(
+            "/api/v1/tickets", json={**payload, "price": 10}, headers=headers
+        )
+        assert other.status_code == 422
+
+        from app.main import idempotency_cache
+        idempotency_cache.clear()
+        await client.post("/api/v1/tickets", json=payload, headers=headers)
+        assert mock_b.await_args.args[1] == ticket_uid
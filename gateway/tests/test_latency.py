@@ -0,0 +1,108 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.clients import FlightClient
+from app.latency import HedgeBudget, LatencyTracker
+
+
+def test_timeout_follows_p99_within_bounds():
+    tracker = LatencyTracker(default_timeout=5.0, min_samples=10, timeout_factor=3.0, min_timeout=0.1)
+    assert tracker.timeout_for("get") == 5.0  # мало замеров
+
+    for _ in range(100):
+        tracker.observe("get", 0.2)
+    assert tracker.timeout_for("get") == pytest.approx(0.6)
+    assert tracker.hedge_delay("get") == pytest.approx(0.2)
+
+    for _ in range(100):
+        tracker.observe("fast", 0.001)
+    assert tracker.timeout_for("fast") == 0.1
+
+    for _ in range(100):
+        tracker.observe("slow", 4.0)
+    assert tracker.timeout_for("slow") == 5.0
+
+
+def test_hedge_budget_limits_ratio():
+    budget = HedgeBudget(ratio=0.1, burst=1)
+    assert budget.try_spend()
+    assert not budget.try_spend()
+
+    for _ in range(12):
+        budget.deposit()
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    assert budget.stats()["spent"] == 2
+    assert budget.stats()["denied"] == 2
+
+
+def make_client(handler, budget):
+    client = FlightClient("http://flight", "flight", transport=httpx.MockTransport(handler))
+    client.hedge_budget = budget
+    client.latency = LatencyTracker(default_timeout=5.0, min_samples=10)
+    for _ in range(20):
+        client.latency.observe("get_flight", 0.01)
+    return client
+
+
+@pytest.mark.asyncio
+async def test_hedged_read_returns_first_response():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+        return httpx.Response(200, json={"flightNumber": "AFL031", "attempt": len(calls)})
+
+    client = make_client(handler, HedgeBudget(ratio=0.1, burst=10))
+
+    response = await asyncio.wait_for(client.get_flight("AFL031"), 0.5)
+
+    assert response.json()["attempt"] == 2
+    assert len(calls) == 2
+    assert client.hedge_budget.spent == 1
+    # Отмененная медленная попытка тоже попадает в окно - как замер снизу
+    samples = client.latency._windows["get_flight"].samples
+    assert len(samples) == 20 + 2
+    assert samples[-1] >= 0.01 and samples[-1] > samples[-2]
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_no_hedge_without_budget():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"flightNumber": "AFL031"})
+
+    client = make_client(handler, HedgeBudget(ratio=0.1, burst=0))
+
+    await client.get_flight("AFL031")
+
+    assert len(calls) == 1
+    assert client.hedge_budget.denied == 1
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_writes_are_not_hedged():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"ticketUid": "uid"})
+
+    client = make_client(handler, HedgeBudget(ratio=0.1, burst=10))
+    client.latency.observe("create_ticket", 0.001)
+
+    await client._request("POST", "/tickets", endpoint="create_ticket", json={})
+
+    assert len(calls) == 1
+    assert client.hedge_budget.spent == 0
+    await client.close()
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.clients import BonusClient
+
+GATEWAY_DIR = Path(__file__).resolve().parents[1]
+
+
+@pytest.mark.asyncio
+async def test_manage_metrics_exposes_gateway_state():
+    from app.main import app
+
+    upstream = BonusClient(
+        "http://bonus", "bonus",
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, json={})),
+    )
+    await upstream.get_privilege("TestUser")
+    await upstream.close()
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        await ac.get("/manage/health")
+        response = await ac.get("/manage/metrics")
+
+    assert response.status_code == 200
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/manage/health",status="200"}' in body
+    assert 'gateway_upstream_request_duration_seconds_count{method="GET",outcome="ok",service="bonus"}' in body
+    assert 'gateway_circuit_breaker_state{route="default",service="flight",state="closed",upstream="http://flight_service:8060"} 1.0' in body
+    assert 'gateway_cache_hits_total{cache="flights"}' in body
+    assert "gateway_retry_queue_depth" in body
+
+
+def test_multiprocess_metrics_are_summed_over_workers(tmp_path):
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+
+    def run(script):
+        return subprocess.run(
+            [sys.executable, "-c", script], cwd=GATEWAY_DIR, env=env,
+            check=True, capture_output=True, text=True,
+        ).stdout
+
+    # Два воркера, каждый отклонил по запросу
+    for _ in range(2):
+        run("from app.metrics import record_breaker_rejection; record_breaker_rejection('bonus', 'default')")
+    body = run("from app.metrics import metrics_response; print(metrics_response().body.decode())")
+
+    assert 'gateway_circuit_breaker_rejections_total{route="default",service="bonus"} 2.0' in body
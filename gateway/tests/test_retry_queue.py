@@ -0,0 +1,191 @@
+import asyncio
+
+import pytest
+from httpx import ASGITransport, AsyncClient, Response
+from unittest.mock import AsyncMock, patch
+
+from app.clients import ServiceUnavailableException
+from app.retry_queue import QueueFull, RetryQueue
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.asyncio
+async def test_jobs_survive_restart(tmp_path):
+    path = str(tmp_path / "queue.sqlite3")
+    queue = RetryQueue(path)
+    queue.register("bonus_rollback", AsyncMock())
+    await queue.enqueue("bonus_rollback", {"ticketUid": "uid", "price": 1500})
+    await queue.stop()
+
+    handler = AsyncMock()
+    restarted = RetryQueue(path)
+    restarted.register("bonus_rollback", handler)
+    assert (await restarted.stats())["depth"] == 1
+
+    assert await restarted.process_one()
+    handler.assert_awaited_once_with({"ticketUid": "uid", "price": 1500})
+    assert (await restarted.stats())["depth"] == 0
+    await restarted.stop()
+
+
+@pytest.mark.asyncio
+async def test_queue_is_bounded():
+    queue = RetryQueue(":memory:", max_size=2)
+    queue.register("bonus_rollback", AsyncMock())
+    await queue.enqueue("bonus_rollback", {})
+    await queue.enqueue("bonus_rollback", {})
+
+    assert await queue.is_full()
+    with pytest.raises(QueueFull):
+        await queue.enqueue("bonus_rollback", {})
+    # snapshot для сборщика метрик не ходит в SQLite: глубина - на момент
+    # последнего stats, счетчики - текущие
+    assert queue.snapshot()["depth"] == 0
+    assert queue.snapshot()["rejected"] == 1
+    assert (await queue.stats())["depth"] == 2
+    assert queue.snapshot()["depth"] == 2
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_job_backs_off(monkeypatch):
+    clock = FakeClock()
+    queue = RetryQueue(":memory:", backoff_base=1, backoff_max=8, clock=clock)
+    queue.register("bonus_rollback", AsyncMock(side_effect=ServiceUnavailableException()))
+    monkeypatch.setattr("app.retry_queue.random.uniform", lambda low, high: high)
+    await queue.enqueue("bonus_rollback", {})
+
+    delays = []
+    for _ in range(5):
+        assert await queue.process_one()
+        next_at = queue._execute("SELECT next_attempt_at FROM retry_jobs")[0][0]
+        delays.append(next_at - clock.now)
+        # До истечения задержки задача не выдается
+        assert not await queue.process_one()
+        clock.now = next_at
+
+    assert delays == [1, 2, 4, 8, 8]
+    stats = await queue.stats()
+    assert stats["failed_attempts"] == 5
+    assert stats["max_attempts"] == 5
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_job_is_dead_lettered_after_max_attempts():
+    clock = FakeClock()
+    queue = RetryQueue(":memory:", max_attempts=3, clock=clock)
+    queue.register("bonus_rollback", AsyncMock(side_effect=ServiceUnavailableException()))
+    await queue.enqueue("bonus_rollback", {"ticketUid": "uid"})
+
+    for _ in range(3):
+        assert await queue.process_one()
+        clock.now += 1000
+
+    # Задача больше не повторяется, но и не теряется
+    assert not await queue.process_one()
+    stats = await queue.stats()
+    assert (stats["depth"], stats["dead"], stats["dead_lettered"]) == (0, 1, 1)
+    kind, payload, attempts = queue._execute(
+        "SELECT kind, payload, attempts FROM retry_dead_jobs"
+    )[0]
+    assert (kind, payload, attempts) == ("bonus_rollback", '{"ticketUid": "uid"}', 3)
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_enqueue_after_empty_read_wakes_worker():
+    queue = RetryQueue(":memory:", workers=1, poll_interval=10)
+    handler = AsyncMock()
+    queue.register("bonus_rollback", handler)
+    claim = queue._claim
+    raced = False
+
+    async def racing_claim(kinds=None):
+        nonlocal raced
+        job = await claim(kinds)
+        if job is None and not raced:
+            # Задача пришла, когда воркер уже прочитал пустую очередь
+            raced = True
+            await queue.enqueue("bonus_rollback", {})
+        return job
+
+    queue._claim = racing_claim
+    await queue.start()
+
+    # Пробуждение не потеряно: задача не ждет poll_interval
+    for _ in range(100):
+        if handler.await_count:
+            break
+        await asyncio.sleep(0.01)
+    handler.assert_awaited_once()
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_workers_follow_concurrency_gate():
+    handler = AsyncMock()
+    allowed = 0
+    queue = RetryQueue(":memory:", workers=2, poll_interval=0.01, concurrency=lambda: allowed)
+    queue.register("bonus_rollback", handler)
+    await queue.start()
+    await queue.enqueue("bonus_rollback", {})
+
+    await asyncio.sleep(0.05)
+    handler.assert_not_awaited()
+
+    allowed = 1
+    await asyncio.sleep(0.05)
+    handler.assert_awaited_once()
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_each_kind_follows_its_own_gate():
+    rollback, cancel = AsyncMock(), AsyncMock()
+    queue = RetryQueue(":memory:", workers=2, poll_interval=0.01)
+    queue.register("bonus_rollback", rollback, concurrency=lambda: 0)
+    queue.register("ticket_cancel", cancel, concurrency=lambda: 1)
+    await queue.start()
+    await queue.enqueue("bonus_rollback", {})
+    await queue.enqueue("ticket_cancel", {})
+
+    await asyncio.sleep(0.05)
+    # Закрытый bonus service не задерживает отмену билета
+    cancel.assert_awaited_once()
+    rollback.assert_not_awaited()
+    stats = await queue.stats()
+    assert stats["depth"] == 1
+    assert stats["active_workers"] == 1
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_refund_queues_rollback_when_bonus_unavailable():
+    from app.main import app, retry_queue
+
+    with patch("app.main.ticket_client.get_ticket_by_uid", new_callable=AsyncMock) as mock_get, \
+         patch("app.main.ticket_client.delete_ticket", new_callable=AsyncMock) as mock_del, \
+         patch("app.main.bonus_client.rollback", new_callable=AsyncMock) as mock_rollback:
+        mock_get.return_value = Response(200, json={"price": 1500})
+        mock_del.return_value = Response(204)
+        mock_rollback.side_effect = ServiceUnavailableException()
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            response = await ac.delete("/api/v1/tickets/uid", headers={"X-User-Name": "TestUser"})
+            stats = (await ac.get("/manage/retry-queue")).json()
+
+        assert response.status_code == 204
+        assert stats["depth"] == 1
+
+        mock_rollback.side_effect = None
+        assert await retry_queue.process_one()
+        mock_rollback.assert_awaited_with("TestUser", "uid", 1500)
+        assert (await retry_queue.stats())["depth"] == 0
@@ -0,0 +1,248 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.clients import BonusClient, FlightClient, TicketClient
+from app.saga import Replayed, Saga, Step, StepRejected
+
+
+@pytest.mark.asyncio
+async def test_stage_steps_run_concurrently():
+    async def slow(ctx):
+        await asyncio.sleep(0.05)
+        return "done"
+
+    saga = Saga("test", [[Step("a", slow), Step("b", slow)]])
+
+    started = time.perf_counter()
+    ctx = await saga.run({})
+
+    assert time.perf_counter() - started < 0.09
+    assert ctx["a"] == ctx["b"] == "done"
+    assert saga.stats()["succeeded"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failure_compensates_started_steps_in_reverse_order():
+    log = []
+
+    def step(name, fail=False, **kwargs):
+        async def action(ctx):
+            log.append(name)
+            if fail:
+                raise RuntimeError(name)
+            return name
+
+        async def compensate(ctx):
+            log.append(f"undo {name}")
+
+        return Step(name, action, compensate, **kwargs)
+
+    saga = Saga("test", [
+        [step("a"), step("b")],
+        [step("c", fail=True, compensate_failed=True), step("d", fail=True)],
+        [step("e")],
+    ])
+
+    with pytest.raises(RuntimeError, match="c"):
+        await saga.run({})
+
+    assert log == ["a", "b", "c", "d", "undo c", "undo b", "undo a"]
+    assert saga.stats()["compensated"] == 3
+
+
+@pytest.mark.asyncio
+async def test_replayed_and_rejected_steps_are_not_compensated():
+    undone = []
+
+    def step(name, result):
+        async def action(ctx):
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        async def compensate(ctx):
+            undone.append(name)
+
+        return Step(name, action, compensate, compensate_failed=True)
+
+    saga = Saga("test", [
+        [step("new", "created"), step("old", Replayed("stored"))],
+        [step("conflict", StepRejected("409"))],
+    ])
+
+    ctx = {}
+    with pytest.raises(StepRejected):
+        await saga.run(ctx)
+
+    assert ctx["old"] == "stored"
+    assert undone == ["new"]
+
+
+@pytest.mark.asyncio
+async def test_failed_compensation_is_handed_over():
+    deferred = []
+
+    async def fail(ctx):
+        raise RuntimeError("fail")
+
+    async def on_failure(step, ctx, exc):
+        deferred.append(step.name)
+
+    saga = Saga("test", [[Step("a", lambda ctx: asyncio.sleep(0), fail)], [Step("b", fail)]], on_failure)
+
+    with pytest.raises(RuntimeError):
+        await saga.run({})
+    assert deferred == ["a"]
+    assert saga.stats()["compensations_deferred"] == 1
+
+
+class Upstreams:
+    """Заглушки flight, ticket и bonus сервисов с внедрением отказов"""
+
+    def __init__(self):
+        self.calls = []
+        self.fail = set()
+        # Эффекты, созданные раньше: upstream отвечает 200 вместо 201
+        self.replayed = set()
+        self.conflict = False
+        # Отказы сервисов: путь -> код ответа
+        self.rejected = {}
+
+    async def __call__(self, request):
+        key = f"{request.method} {request.url.host}"
+        self.calls.append(key)
+        if any(f"{key}{request.url.path}".startswith(prefix) for prefix in self.fail):
+            return httpx.Response(500)
+        if request.url.path in self.rejected:
+            return httpx.Response(self.rejected[request.url.path], json={"detail": "rejected"})
+        if key == "GET flight":
+            if request.url.path != "/flights/AFL031":
+                return httpx.Response(404)
+            return httpx.Response(200, json={"flightNumber": "AFL031", "price": 1500})
+        if request.url.path == "/privilege/calculate":
+            return httpx.Response(200 if "bonus" in self.replayed else 201, json={
+                "paidByBonuses": 0,
+                "balanceDiff": 150,
+                "privilege": {"balance": 150, "status": "BRONZE"},
+            })
+        if key == "POST ticket":
+            if self.conflict:
+                return httpx.Response(409)
+            status = 200 if "ticket" in self.replayed else 201
+            return httpx.Response(status, json={"ticketUid": "uid", "status": "PAID"})
+        return httpx.Response(200)
+
+
+@pytest.fixture
+def upstreams(monkeypatch):
+    stubs = Upstreams()
+    transport = httpx.MockTransport(stubs)
+    for name, cls in (("flight", FlightClient), ("ticket", TicketClient), ("bonus", BonusClient)):
+        monkeypatch.setattr(f"app.main.{name}_client", cls(f"http://{name}", name, transport=transport))
+    return stubs
+
+
+async def buy(flight_number="AFL031"):
+    from app.main import app
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        return await ac.post(
+            "/api/v1/tickets",
+            json={"flightNumber": flight_number, "price": 1500, "paidFromBalance": False},
+            headers={"X-User-Name": "TestUser"},
+        )
+
+
+@pytest.mark.asyncio
+async def test_purchase_calls_each_service_once(upstreams):
+    response = await buy()
+
+    assert response.status_code == 200
+    assert response.json()["paidByMoney"] == 1500
+    assert sorted(upstreams.calls) == ["GET flight", "POST bonus", "POST ticket"]
+
+
+@pytest.mark.asyncio
+async def test_unknown_flight_rolls_back_bonus(upstreams):
+    response = await buy("XXX000")
+
+    assert response.status_code == 404
+    assert "POST ticket" not in upstreams.calls
+    assert upstreams.calls.count("POST bonus") == 2  # calculate и rollback
+
+
+@pytest.mark.asyncio
+async def test_ticket_failure_rolls_back_bonus_and_cancels_ticket(upstreams):
+    upstreams.fail.add("POST ticket")
+
+    response = await buy()
+
+    assert response.status_code == 503
+    assert upstreams.calls[-2:] == ["PATCH ticket", "POST bonus"]
+
+
+@pytest.mark.asyncio
+async def test_failed_rollback_goes_to_retry_queue(upstreams):
+    from app.main import retry_queue
+
+    upstreams.fail.update({"POST ticket", "PATCH ticket", "POST bonus/privilege/rollback"})
+
+    response = await buy()
+
+    assert response.status_code == 503
+    assert (await retry_queue.stats())["depth"] == 2
+    upstreams.fail.clear()
+    assert await retry_queue.process_one()
+    assert await retry_queue.process_one()
+    assert (await retry_queue.stats())["depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_retry_does_not_roll_back_earlier_purchase(upstreams):
+    # Бонусы по этому uid начислила первая попытка покупки
+    upstreams.replayed.add("bonus")
+
+    response = await buy("XXX000")
+
+    assert response.status_code == 404
+    assert upstreams.calls.count("POST bonus") == 1
+
+
+@pytest.mark.asyncio
+async def test_ticket_conflict_keeps_existing_ticket(upstreams):
+    upstreams.replayed.add("bonus")
+    upstreams.conflict = True
+
+    response = await buy()
+
+    assert response.status_code == 409
+    assert "PATCH ticket" not in upstreams.calls
+    assert upstreams.calls.count("POST bonus") == 1
+
+
+@pytest.mark.asyncio
+async def test_retry_of_compensated_purchase_is_rejected(upstreams):
+    # Первая попытка упала, бонусы по этому uid уже откачены
+    upstreams.rejected["/privilege/calculate"] = 410
+
+    response = await buy()
+
+    assert response.status_code == 409
+    assert "POST ticket" not in upstreams.calls
+    assert upstreams.calls.count("POST bonus") == 1
+
+
+@pytest.mark.asyncio
+async def test_validation_error_fails_step_without_compensating_it(upstreams):
+    upstreams.rejected["/tickets"] = 422
+
+    response = await buy()
+
+    assert response.status_code == 422
+    # Бонусы начислены этой попыткой и откатываются, билета нет - не отменяется
+    assert "PATCH ticket" not in upstreams.calls
+    assert upstreams.calls.count("POST bonus") == 2
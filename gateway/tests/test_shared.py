@@ -0,0 +1,179 @@
+import asyncio
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+from app.breaker import AsyncCircuitBreaker, BreakerConfig, CircuitOpenError
+from app.cache import TTLCache
+from app.retry_queue import RetryQueue
+from app.shared import INVALIDATION_CAPACITY, SharedState
+
+GATEWAY_DIR = Path(__file__).resolve().parents[1]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def fail():
+    raise httpx.ConnectError("down")
+
+
+async def ok():
+    return "ok"
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Два независимых отображения одного каталога - как у двух воркеров"""
+    states = [SharedState(str(tmp_path)), SharedState(str(tmp_path))]
+    yield states
+    for state in states:
+        state.close()
+
+
+def make_breaker(state, clock):
+    return AsyncCircuitBreaker(
+        "flight/default",
+        BreakerConfig(min_calls=2, open_duration=10),
+        failure_exceptions=(httpx.HTTPError,),
+        clock=clock,
+        shared=state.breaker("flight/default http://flight:8060"),
+    )
+
+
+@pytest.mark.asyncio
+async def test_breaker_opened_by_one_worker_protects_others(workers):
+    clock = FakeClock()
+    first, second = (make_breaker(state, clock) for state in workers)
+
+    for _ in range(2):
+        with pytest.raises(httpx.ConnectError):
+            await first.call(fail)
+    assert first.state == "open"
+
+    # Второй воркер не видел ни одной ошибки, но запросы уже отклоняет
+    assert second.state == "open"
+    with pytest.raises(CircuitOpenError):
+        await second.call(ok)
+
+    # Время открытия общее: half-open наступает у всех одновременно,
+    # успешная проба в одном воркере закрывает breaker во всех
+    clock.now += 10
+    assert second.state == first.state == "half_open"
+    assert await second.call(ok) == "ok"
+    assert first.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_half_open_probe_permit_is_shared(workers):
+    clock = FakeClock()
+    first, second = (make_breaker(state, clock) for state in workers)
+    for _ in range(2):
+        with pytest.raises(httpx.ConnectError):
+            await first.call(fail)
+
+    clock.now += 10
+    release = asyncio.Event()
+
+    async def slow_probe():
+        await release.wait()
+        return "ok"
+
+    probe = asyncio.create_task(first.call(slow_probe))
+    await asyncio.sleep(0)
+    # half_open_calls=1 на все воркеры: второй пробу не начинает
+    with pytest.raises(CircuitOpenError):
+        await second.call(ok)
+    assert second.snapshot()["probes_in_flight"] == 1
+
+    release.set()
+    assert await probe == "ok"
+    assert second.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_abandoned_probe_permit_expires(workers):
+    clock = FakeClock()
+    first, second = (make_breaker(state, clock) for state in workers)
+    for _ in range(2):
+        with pytest.raises(httpx.ConnectError):
+            await first.call(fail)
+    clock.now += 10
+    # Воркер взял разрешение и завершился, не вернув его
+    assert first._acquire() is not None
+
+    with pytest.raises(CircuitOpenError):
+        await second.call(ok)
+    clock.now += 10
+    assert await second.call(ok) == "ok"
+    assert first.state == "closed"
+
+
+def test_breaker_state_crosses_process_boundary(tmp_path):
+    state = SharedState(str(tmp_path))
+    breaker = make_breaker(state, time.monotonic)
+    script = (
+        "import sys, time; from app.shared import SharedState;"
+        "SharedState(sys.argv[1]).breaker('flight/default http://flight:8060')"
+        ".store('open', time.monotonic())"
+    )
+    subprocess.run([sys.executable, "-c", script, str(tmp_path)], cwd=GATEWAY_DIR, check=True)
+
+    assert breaker.state == "open"
+    state.close()
+
+
+def test_invalidation_reaches_other_workers(workers):
+    caches = [TTLCache(max_size=10, ttl=60) for _ in workers]
+    for cache, state in zip(caches, workers):
+        cache.attach(state.invalidations, "flights")
+        cache.set("AFL031", "a")
+        cache.set("AFL032", "b")
+
+    caches[0].invalidate("AFL031")
+    assert caches[1].peek("AFL031") is None
+    assert caches[1].peek("AFL032") == "b"
+
+    caches[0].clear()
+    assert caches[1].peek("AFL032") is None
+
+
+def test_lagging_reader_drops_whole_cache(workers):
+    reader, writer = TTLCache(max_size=10, ttl=60), TTLCache(max_size=10, ttl=60)
+    reader.attach(workers[0].invalidations, "flights")
+    writer.attach(workers[1].invalidations, "privileges")
+    reader.set("AFL031", "a")
+
+    # События чужого кэша, но читатель отстал больше емкости журнала
+    for i in range(INVALIDATION_CAPACITY + 1):
+        writer.invalidate(f"user{i}")
+
+    assert reader.peek("AFL031") is None
+
+
+@pytest.mark.asyncio
+async def test_only_one_worker_drains_retry_queue(workers, tmp_path):
+    queues = [
+        RetryQueue(str(tmp_path / "queue.sqlite3"), leader=state.leader("retry-queue"), poll_interval=0.01)
+        for state in workers
+    ]
+    for queue in queues:
+        await queue.start()
+        await asyncio.sleep(0.05)
+
+    assert [queue.snapshot()["owner"] for queue in queues] == [True, False]
+
+    # Владелец остановился - роль переходит к оставшемуся воркеру
+    await queues[0].stop()
+    await asyncio.sleep(0.05)
+    assert queues[1].snapshot()["owner"]
+    await queues[1].stop()
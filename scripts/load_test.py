@@ -0,0 +1,71 @@
+"""Нагрузочный тест: пропускная способность сервиса в зависимости от числа
+одновременных клиентов. Если обработчики не блокируют event loop,
+req/s растет почти линейно, пока не упрется в пул соединений с БД.
+
+    python scripts/load_test.py --url http://localhost:8060/flights/AFL031
+    python scripts/load_test.py --url "http://localhost:8050/privilege?username=Test Max" \
+        --levels 1,4,16,64 --duration 10
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def run_level(url: str, headers: dict, concurrency: int, duration: float):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    resp = await client.get(url, headers=headers)
+                    if resp.status_code >= 500:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000,
+        "errors": errors,
+    }
+
+
+async def main(args):
+    headers = dict(h.split(":", 1) for h in args.header)
+    levels = [int(level) for level in args.levels.split(",")]
+
+    print(f"GET {args.url}, {args.duration}s per level")
+    print(f"{'clients':>8}{'req/s':>10}{'x1':>7}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    base = None
+    for level in levels:
+        r = await run_level(args.url, headers, level, args.duration)
+        base = base or r["rps"]
+        print(
+            f"{level:>8}{r['rps']:>10.0f}{r['rps'] / base:>7.1f}"
+            f"{r['p50']:>10.2f}{r['p99']:>10.2f}{r['errors']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--header", action="append", default=[], help="Name:value")
+    parser.add_argument("--levels", default="1,2,4,8,16,32")
+    parser.add_argument("--duration", type=float, default=5.0)
+    asyncio.run(main(parser.parse_args()))
@@ -1,80 +1,229 @@
 import os
-import psycopg2
 import uuid
-from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
+from .db_pool import create_pool
+from .metrics import timed_query
 
 load_dotenv()
 
+DB_PARAMS = dict(
+    host=os.getenv("DB_HOST"),
+    dbname=os.getenv("DB_NAME"),
+    user=os.getenv("DB_USER"),
+    password=os.getenv("DB_PASSWORD"),
+)
+
+pool = create_pool(DB_PARAMS, name="ticket")
+
+# Строк за один FETCH серверного курсора при выгрузке
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+
 def get_db_connection():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        database=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
+    # Соединение возвращается в пул при выходе из async with; выход без
+    # ошибки фиксирует транзакцию, исключение - откатывает
+    return pool.connection()
+
+# Поля билета, которые можно запросить через projection, и их колонки
+TICKET_FIELDS = {
+    "ticketUid": "ticket_uid",
+    "flightNumber": "flight_number",
+    "price": "price",
+    "status": "status",
+}
+
+
+@timed_query
+async def get_user_tickets(
+    username: str,
+    status: str | None = None,
+    limit: int | None = None,
+    after_id: int | None = None,
+    fields: list[str] | None = None,
+):
+    """Билеты пользователя, новые первыми. Страница - keyset по id:
+    after_id - id последнего билета предыдущей страницы. В каждой строке
+    есть служебное поле id для построения курсора."""
+    columns = ", ".join(
+        f'{TICKET_FIELDS[name]} as "{name}"' for name in (fields or TICKET_FIELDS)
     )
+    conditions = ["username = %s"]
+    params = [username]
+    if status is not None:
+        conditions.append("status = %s")
+        params.append(status)
+    if after_id is not None:
+        conditions.append("id < %s")
+        params.append(after_id)
+    query = f"""
+        SELECT id, {columns}
+        FROM ticket WHERE {" AND ".join(conditions)}
+        ORDER BY id DESC
+    """
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+
+    async with get_db_connection() as conn:
+        cur = await conn.execute(query, params)
+        return await cur.fetchall()
 
-def get_user_tickets(username: str):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        SELECT ticket_uid as "ticketUid", flight_number as "flightNumber", price, status 
-        FROM ticket WHERE username = %s
-    """, (username,))
-    tickets = cur.fetchall()
-    cur.close()
-    conn.close()
-    return tickets
-
-def create_new_ticket(username: str, flight_number: str, price: int, ticket_uid: uuid.UUID | None):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+
+async def stream_user_tickets(
+    username: str, status: str | None = None, batch_size: int = EXPORT_BATCH_SIZE
+):
+    """Все билеты пользователя пачками по batch_size строк, старые первыми.
+    Серверный курсор держит результат в Postgres, поэтому в памяти сервиса
+    не больше одной пачки, сколько бы билетов ни было. Соединение занято,
+    пока генератор не дочитан или не закрыт."""
+    columns = ", ".join(f'{column} as "{name}"' for name, column in TICKET_FIELDS.items())
+    conditions = ["username = %s"]
+    params = [username]
+    if status is not None:
+        conditions.append("status = %s")
+        params.append(status)
+    query = f"""
+        SELECT {columns}
+        FROM ticket WHERE {" AND ".join(conditions)}
+        ORDER BY id
+    """
+    async with get_db_connection() as conn:
+        async with conn.cursor(name="ticket_export") as cur:
+            await cur.execute(query, params)
+            while batch := await cur.fetchmany(batch_size):
+                yield batch
+
+
+@timed_query
+async def create_new_ticket(username: str, flight_number: str, price: int, ticket_uid: uuid.UUID | None):
+    """(True, билет) - билет создан, (False, билет) - повтор покупки с теми
+    же данными, (False, None) - uid занят другим билетом или билет по нему
+    уже отменен: отмененную покупку повтор не возвращает как оплаченную"""
     if not ticket_uid:
         ticket_uid = uuid.uuid4()
-    
-    cur.execute("""
-        INSERT INTO ticket (ticket_uid, username, flight_number, price, status)
-        VALUES (%s, %s, %s, %s, 'PAID')
-        RETURNING ticket_uid as "ticketUid", flight_number as "flightNumber", price, status
-    """, (str(ticket_uid), username, flight_number, price))
-    
-    ticket = cur.fetchone()
-    conn.commit()
-    cur.close()
-    conn.close()
-    return ticket
-
-def update_ticket_status(ticket_uid: str, username: str, status: str):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE ticket SET status = %s 
-        WHERE ticket_uid = %s AND username = %s
-    """, (status, ticket_uid, username))
-    
-    count = cur.rowcount
-    conn.commit()
-    cur.close()
-    conn.close()
-    return count > 0
-
-def get_ticket_by_uid_and_user(ticket_uid: str, username: str):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    # В запросе обязательно проверяем и UID билета, и имя пользователя
-    query = """
-        SELECT 
-            ticket_uid as "ticketUid", 
-            flight_number as "flightNumber", 
-            price, 
-            status 
-        FROM ticket 
-        WHERE ticket_uid = %s AND username = %s
-    """
-    cur.execute(query, (ticket_uid, username))
-    ticket = cur.fetchone()
-    
-    cur.close()
-    conn.close()
-    return ticket
\ No newline at end of file
+
+    async with get_db_connection() as conn:
+        cur = await conn.execute("""
+            INSERT INTO ticket (ticket_uid, username, flight_number, price, status)
+            VALUES (%s, %s, %s, %s, 'PAID')
+            ON CONFLICT (ticket_uid) DO NOTHING
+            RETURNING ticket_uid as "ticketUid", flight_number as "flightNumber", price, status
+        """, (str(ticket_uid), username, flight_number, price))
+        ticket = await cur.fetchone()
+        if ticket is not None:
+            return True, ticket
+
+        # Повтор покупки с тем же uid: отдаем уже созданный билет. Отдельный
+        # запрос видит строку, даже если ее вставила параллельная транзакция
+        cur = await conn.execute("""
+            SELECT ticket_uid as "ticketUid", flight_number as "flightNumber", price, status
+            FROM ticket
+            WHERE ticket_uid = %s AND username = %s AND flight_number = %s AND price = %s
+              AND status = 'PAID'
+        """, (str(ticket_uid), username, flight_number, price))
+        return False, await cur.fetchone()
+
+
+@timed_query
+async def create_new_tickets(tickets: list[tuple[str, str, int, uuid.UUID | None]]):
+    """Пакет билетов (username, flight_number, price, ticket_uid) одной
+    инструкцией INSERT из массивов. Результат по каждому элементу, по
+    порядку: (True, билет) - создан, (False, билет) - повтор с теми же
+    данными, (False, None) - uid занят другим билетом или билет отменен."""
+    tickets = [
+        (username, flight_number, price, ticket_uid or uuid.uuid4())
+        for username, flight_number, price, ticket_uid in tickets
+    ]
+    # Повтор uid внутри пакета в INSERT не попадает: вставляется первый
+    # элемент, остальные сверяются с ним так же, как повтор покупки
+    unique = {}
+    for username, flight_number, price, uid in tickets:
+        unique.setdefault(uid, (username, flight_number, price))
+    uids = list(unique)
+    usernames, flight_numbers, prices = (list(column) for column in zip(*unique.values()))
+
+    async with get_db_connection() as conn:
+        # Четыре массива вместо VALUES на каждую строку: текст запроса не
+        # зависит от размера пакета и готовится один раз
+        cur = await conn.execute("""
+            INSERT INTO ticket (ticket_uid, username, flight_number, price, status)
+            SELECT uid, username, flight_number, price, 'PAID'
+            FROM unnest(%s::uuid[], %s::text[], %s::text[], %s::int[])
+                AS t(uid, username, flight_number, price)
+            ON CONFLICT (ticket_uid) DO NOTHING
+            RETURNING ticket_uid as "ticketUid", flight_number as "flightNumber", price, status
+        """, (uids, usernames, flight_numbers, prices))
+        created = {row["ticketUid"]: row for row in await cur.fetchall()}
+
+        # Остальные uid уже заняты: повтор покупки или чужой билет
+        stored = {
+            uid: {"username": unique[uid][0], **ticket} for uid, ticket in created.items()
+        }
+        missing = [uid for uid in uids if uid not in created]
+        if missing:
+            cur = await conn.execute("""
+                SELECT ticket_uid as "ticketUid", username, flight_number as "flightNumber",
+                       price, status
+                FROM ticket WHERE ticket_uid = ANY(%s)
+            """, (missing,))
+            stored.update((row["ticketUid"], row) for row in await cur.fetchall())
+
+    results = []
+    for username, flight_number, price, uid in tickets:
+        if uid in created:
+            results.append((True, created.pop(uid)))
+            continue
+        row = stored.get(uid)
+        if row is None or row["status"] != "PAID" or (
+            row["username"], row["flightNumber"], row["price"]
+        ) != (username, flight_number, price):
+            results.append((False, None))
+            continue
+        results.append((False, {name: value for name, value in row.items() if name != "username"}))
+    return results
+
+
+@timed_query
+async def update_tickets_status(updates: list[tuple[uuid.UUID, str, str]]):
+    """Смена статуса пакета билетов (ticket_uid, username, status) одной
+    инструкцией UPDATE. Для каждого элемента по порядку: True - билет
+    найден у этого пользователя и обновлен."""
+    uids, usernames, statuses = (list(column) for column in zip(*updates))
+    async with get_db_connection() as conn:
+        # Владелец проверяется для каждого билета отдельно, поэтому вместо
+        # ticket_uid = ANY(...) тройки сопоставляются со строками через unnest
+        cur = await conn.execute("""
+            UPDATE ticket t SET status = u.status
+            FROM unnest(%s::uuid[], %s::text[], %s::text[]) AS u(ticket_uid, username, status)
+            WHERE t.ticket_uid = u.ticket_uid AND t.username = u.username
+            RETURNING t.ticket_uid as "ticketUid", t.username
+        """, (uids, usernames, statuses))
+        updated = {(row["ticketUid"], row["username"]) for row in await cur.fetchall()}
+    return [(uid, username) in updated for uid, username in zip(uids, usernames)]
+
+
+@timed_query
+async def update_ticket_status(ticket_uid: str, username: str, status: str):
+    async with get_db_connection() as conn:
+        cur = await conn.execute("""
+            UPDATE ticket SET status = %s
+            WHERE ticket_uid = %s AND username = %s
+        """, (status, ticket_uid, username))
+        return cur.rowcount > 0
+
+
+@timed_query
+async def get_ticket_by_uid_and_user(ticket_uid: str, username: str):
+    async with get_db_connection() as conn:
+        # В запросе обязательно проверяем и UID билета, и имя пользователя
+        query = """
+            SELECT
+                ticket_uid as "ticketUid",
+                flight_number as "flightNumber",
+                price,
+                status
+            FROM ticket
+            WHERE ticket_uid = %s AND username = %s
+        """
+        cur = await conn.execute(query, (ticket_uid, username))
+        return await cur.fetchone()
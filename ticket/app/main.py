@@ -1,32 +1,150 @@
-from fastapi import FastAPI, Header, HTTPException, Response
-from .database import get_user_tickets, create_new_ticket, update_ticket_status, get_ticket_by_uid_and_user
-from .schemas import TicketInternal, CreateTicketRequest, UpdateTicketStatus
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from .database import (
+    TICKET_FIELDS,
+    get_user_tickets,
+    create_new_ticket,
+    create_new_tickets,
+    update_ticket_status,
+    update_tickets_status,
+    get_ticket_by_uid_and_user,
+    pool,
+    stream_user_tickets,
+)
+from .db_pool import pool_stats
+from .metrics import MetricsMiddleware, metrics_response, register_pool
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+from .responses import NDJSON_MEDIA_TYPE, FastJSONResponse, ndjson_stream
+from .schemas import (
+    BatchResponse,
+    CreateTicketRequest,
+    CreateTicketsBatchRequest,
+    TicketInternal,
+    TicketStatus,
+    TicketView,
+    UpdateTicketStatus,
+    UpdateTicketsBatchRequest,
+)
 from typing import List
 
-app = FastAPI(title="Ticket Service")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # wait=False: сервис стартует, даже если БД еще поднимается
+    await pool.open(wait=False)
+    yield
+    await pool.close()
+
+app = FastAPI(
+    title="Ticket Service", lifespan=lifespan, default_response_class=FastJSONResponse
+)
+app.add_middleware(MetricsMiddleware)
+register_pool(pool, pool_stats)
 
 @app.get("/manage/health")
 async def manage_health():
     return {}
 
-@app.get("/tickets", response_model=List[TicketInternal])
-async def get_tickets(x_user_name: str = Header(...)):
-    return get_user_tickets(x_user_name)
+@app.get("/manage/pool")
+async def manage_pool():
+    return pool_stats(pool)
+
+@app.get("/manage/metrics")
+async def manage_metrics():
+    return metrics_response()
+
+# Токен следующей страницы отдается в заголовке, чтобы тело осталось списком
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+@app.get("/tickets", response_model=List[TicketView], response_model_exclude_unset=True)
+async def get_tickets(
+    x_user_name: str = Header(...),
+    status: TicketStatus | None = Query(None),
+    limit: int | None = Query(None, ge=1, le=500),
+    cursor: str | None = Query(None, description="Значение X-Next-Cursor предыдущей страницы"),
+    fields: str | None = Query(None, description="Поля билета через запятую"),
+):
+    projection = None
+    if fields is not None:
+        projection = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+        unknown = [f for f in projection if f not in TICKET_FIELDS]
+        if unknown or not projection:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    try:
+        after_id = decode_cursor(cursor) if cursor else None
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
-@app.post("/tickets", response_model=TicketInternal)
+    tickets = await get_user_tickets(x_user_name, status, limit, after_id, projection)
+
+    headers = {}
+    if limit is not None and len(tickets) == limit:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(tickets[-1]["id"])
+    for ticket in tickets:
+        ticket.pop("id", None)
+    # Строки уже содержат ровно запрошенные поля - без повторной проверки
+    # через response_model
+    return FastJSONResponse(tickets, headers=headers)
+
+@app.get("/tickets/export")
+async def export_tickets(
+    x_user_name: str = Header(...),
+    status: TicketStatus | None = Query(None),
+):
+    """Все билеты пользователя в NDJSON, по одному на строку. Строки читаются
+    из серверного курсора пачками и сразу уходят клиенту"""
+    return StreamingResponse(
+        ndjson_stream(stream_user_tickets(x_user_name, status)),
+        media_type=NDJSON_MEDIA_TYPE,
+    )
+
+@app.post("/tickets", response_model=TicketInternal, status_code=201)
 async def create_ticket(request: CreateTicketRequest):
-    return create_new_ticket(request.username, request.flightNumber, request.price, request.uuid)
+    """201 - билет создан этим запросом, 200 - повтор покупки с тем же uid:
+    вызывающий по коду отличает свой билет от созданного раньше. 409 - uid
+    занят другим билетом или билет по нему отменен"""
+    created, ticket = await create_new_ticket(
+        request.username, request.flightNumber, request.price, request.uuid
+    )
+    if ticket is None:
+        raise HTTPException(status_code=409, detail="Ticket uid is already used")
+    return FastJSONResponse(ticket, status_code=201 if created else 200)
+
+@app.post("/tickets:batch", response_model=BatchResponse)
+async def create_tickets_batch(request: CreateTicketsBatchRequest):
+    """Создание пакета билетов одним запросом к БД; ошибка одного элемента
+    не отменяет остальные"""
+    results = await create_new_tickets(
+        [(item.username, item.flightNumber, item.price, item.uuid) for item in request.items]
+    )
+    items = []
+    for created, ticket in results:
+        if ticket is None:
+            items.append({"code": 409, "detail": "Ticket uid is already used"})
+        else:
+            items.append({"code": 201 if created else 200, "ticket": ticket})
+    return FastJSONResponse({"items": items})
+
+@app.patch("/tickets:batch", response_model=BatchResponse)
+async def patch_tickets_batch(request: UpdateTicketsBatchRequest):
+    updated = await update_tickets_status(
+        [(item.ticketUid, item.username, item.status) for item in request.items]
+    )
+    return FastJSONResponse({"items": [
+        {"code": 204} if ok else {"code": 404, "detail": "Ticket not found"} for ok in updated
+    ]})
 
 @app.patch("/tickets/{ticket_uid}")
 async def patch_ticket(ticket_uid: str, request: UpdateTicketStatus):
-    updated = update_ticket_status(ticket_uid, request.username, request.status)
+    updated = await update_ticket_status(ticket_uid, request.username, request.status)
     if not updated:
         raise HTTPException(status_code=404, detail="Ticket not found")
     return Response(status_code=204)
 
 @app.get("/tickets/{ticket_uid}", response_model=TicketInternal)
 async def get_single_ticket(ticket_uid: str, username: str):
-    ticket = get_ticket_by_uid_and_user(ticket_uid, username)
+    ticket = await get_ticket_by_uid_and_user(ticket_uid, username)
     
     if not ticket:
         raise HTTPException(
@@ -34,4 +152,4 @@ async def get_single_ticket(ticket_uid: str, username: str):
             detail="Ticket not found or access denied"
         )
         
-    return ticket
\ No newline at end of file
+    return FastJSONResponse(ticket)
\ No newline at end of file
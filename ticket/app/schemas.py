@@ -1,6 +1,11 @@
 from pydantic import BaseModel, Field
 from uuid import UUID
-from typing import List
+from typing import List, Literal, Optional
+
+TicketStatus = Literal["PAID", "CANCELED"]
+
+# Наибольшее число элементов в пакетном запросе
+MAX_BATCH_SIZE = 1000
 
 class TicketInternal(BaseModel):
     ticketUid: UUID
@@ -8,6 +13,13 @@ class TicketInternal(BaseModel):
     price: int
     status: str
 
+class TicketView(BaseModel):
+    """Билет в списке: при projection заполнены только запрошенные поля"""
+    ticketUid: Optional[UUID] = None
+    flightNumber: Optional[str] = None
+    price: Optional[int] = None
+    status: Optional[str] = None
+
 class CreateTicketRequest(BaseModel):
     flightNumber: str
     price: int
@@ -19,4 +31,26 @@ class UpdateTicketStatus(BaseModel):
     username: str
 
 class DeleteTicketRequest(BaseModel):
-    username: str
\ No newline at end of file
+    username: str
+
+class CreateTicketsBatchRequest(BaseModel):
+    items: List[CreateTicketRequest] = Field(min_length=1, max_length=MAX_BATCH_SIZE)
+
+class UpdateTicketStatusItem(BaseModel):
+    ticketUid: UUID
+    username: str
+    status: TicketStatus
+
+class UpdateTicketsBatchRequest(BaseModel):
+    items: List[UpdateTicketStatusItem] = Field(min_length=1, max_length=MAX_BATCH_SIZE)
+
+class BatchItemResult(BaseModel):
+    """Результат элемента пакета, в порядке элементов запроса. code - код,
+    который вернул бы одиночный запрос: 201/200 для создания (новый билет
+    или повтор с тем же uid), 204 для смены статуса, 404 и 409 - ошибки"""
+    code: int
+    ticket: Optional[TicketInternal] = None
+    detail: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    items: List[BatchItemResult]
@@ -1,65 +1,197 @@
+import asyncio
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from uuid import uuid4
 from app.database import (
-    get_user_tickets, 
-    create_new_ticket, 
-    update_ticket_status, 
-    get_ticket_by_uid_and_user
+    get_user_tickets,
+    create_new_ticket,
+    create_new_tickets,
+    update_ticket_status,
+    update_tickets_status,
+    get_ticket_by_uid_and_user,
+    stream_user_tickets,
 )
 
-@patch("app.database.get_db_connection")
-def test_get_user_tickets_logic(mock_connect):
+
+def mock_db(mock_connect):
+    """Соединение из пула: async with get_db_connection() as conn, conn.execute -> cursor"""
     mock_conn = MagicMock()
     mock_cur = MagicMock()
-    mock_connect.return_value = mock_conn
-    mock_conn.cursor.return_value = mock_cur
-    
+    mock_connect.return_value.__aenter__.return_value = mock_conn
+    mock_conn.execute = AsyncMock(return_value=mock_cur)
+    mock_cur.fetchall = AsyncMock()
+    mock_cur.fetchone = AsyncMock()
+    return mock_conn, mock_cur
+
+
+@patch("app.database.get_db_connection")
+def test_get_user_tickets_logic(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+
     mock_cur.fetchall.return_value = [
         {"ticketUid": uuid4(), "flightNumber": "A101", "price": 100, "status": "PAID"}
     ]
-    
-    result = get_user_tickets("TestUser")
-    
+
+    result = asyncio.run(get_user_tickets("TestUser"))
+
     assert len(result) == 1
     assert result[0]["flightNumber"] == "A101"
-    assert mock_cur.execute.called
+    assert mock_conn.execute.called
+
+@patch("app.database.get_db_connection")
+def test_get_user_tickets_filters_and_pages(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+    mock_cur.fetchall.return_value = []
+
+    asyncio.run(get_user_tickets("TestUser", "PAID", 20, 42, ["flightNumber"]))
+
+    query, params = mock_conn.execute.call_args.args
+    assert 'flight_number as "flightNumber"' in query
+    assert "ticket_uid" not in query
+    assert "status = %s" in query and "id < %s" in query
+    assert "ORDER BY id DESC" in query and "LIMIT %s" in query
+    assert params == ["TestUser", "PAID", 42, 20]
 
 @patch("app.database.get_db_connection")
 def test_create_new_ticket_logic(mock_connect):
-    mock_conn = MagicMock()
-    mock_cur = MagicMock()
-    mock_connect.return_value = mock_conn
-    mock_conn.cursor.return_value = mock_cur
-    
+    mock_conn, mock_cur = mock_db(mock_connect)
+
     uid = uuid4()
     mock_cur.fetchone.return_value = {
         "ticketUid": uid, "flightNumber": "B202", "price": 200, "status": "PAID"
     }
-    
-    result = create_new_ticket("TestUser", "B202", 200, uid)
-    
+
+    created, result = asyncio.run(create_new_ticket("TestUser", "B202", 200, uid))
+
+    assert created is True
     assert result["ticketUid"] == uid
-    assert mock_conn.commit.called
+    # Транзакцию фиксирует выход из контекста соединения пула
+    assert mock_connect.return_value.__aexit__.called
+    assert mock_conn.execute.call_args.args[1][0] == str(uid)
+
+@patch("app.database.get_db_connection")
+def test_create_new_ticket_repeat_returns_existing(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+
+    uid = uuid4()
+    existing = {"ticketUid": uid, "flightNumber": "B202", "price": 200, "status": "PAID"}
+    mock_cur.fetchone.side_effect = [None, existing]
+
+    result = asyncio.run(create_new_ticket("TestUser", "B202", 200, uid))
+
+    assert result == (False, existing)
+    assert "ON CONFLICT (ticket_uid) DO NOTHING" in mock_conn.execute.call_args_list[0].args[0]
+    # Отмененный билет повтор не находит - покупка отвечает 409
+    assert "status = 'PAID'" in mock_conn.execute.call_args_list[1].args[0]
+
+@patch("app.database.get_db_connection")
+def test_create_new_tickets_one_insert_per_batch(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+    new_uid, repeat_uid, foreign_uid, canceled_uid = uuid4(), uuid4(), uuid4(), uuid4()
+    mock_cur.fetchall.side_effect = [
+        [{"ticketUid": new_uid, "flightNumber": "B202", "price": 200, "status": "PAID"}],
+        [
+            {"ticketUid": repeat_uid, "username": "TestUser", "flightNumber": "B202",
+             "price": 200, "status": "PAID"},
+            {"ticketUid": foreign_uid, "username": "Other", "flightNumber": "B202",
+             "price": 200, "status": "PAID"},
+            {"ticketUid": canceled_uid, "username": "TestUser", "flightNumber": "B202",
+             "price": 200, "status": "CANCELED"},
+        ],
+    ]
+
+    results = asyncio.run(create_new_tickets([
+        ("TestUser", "B202", 200, new_uid),
+        ("TestUser", "B202", 200, repeat_uid),
+        ("TestUser", "B202", 200, foreign_uid),
+        ("TestUser", "B202", 200, canceled_uid),
+    ]))
+
+    assert [created for created, _ in results] == [True, False, False, False]
+    assert results[1][1] == {
+        "ticketUid": repeat_uid, "flightNumber": "B202", "price": 200, "status": "PAID"
+    }
+    assert results[2][1] is None
+    assert results[3][1] is None
+    insert, lookup = mock_conn.execute.call_args_list
+    assert "unnest" in insert.args[0] and "ON CONFLICT (ticket_uid) DO NOTHING" in insert.args[0]
+    assert insert.args[1][0] == [new_uid, repeat_uid, foreign_uid, canceled_uid]
+    assert lookup.args[1] == ([repeat_uid, foreign_uid, canceled_uid],)
+
+@patch("app.database.get_db_connection")
+def test_create_new_tickets_repeated_uid_in_batch(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+    uid = uuid4()
+    mock_cur.fetchall.return_value = [
+        {"ticketUid": uid, "flightNumber": "B202", "price": 200, "status": "PAID"}
+    ]
+
+    results = asyncio.run(create_new_tickets([
+        ("TestUser", "B202", 200, uid),
+        ("TestUser", "B202", 200, uid),
+        ("TestUser", "B202", 300, uid),
+    ]))
+
+    # Одинаковый повтор идемпотентен, 409 - только для других данных
+    assert results == [
+        (True, {"ticketUid": uid, "flightNumber": "B202", "price": 200, "status": "PAID"}),
+        (False, {"ticketUid": uid, "flightNumber": "B202", "price": 200, "status": "PAID"}),
+        (False, None),
+    ]
+    assert mock_conn.execute.call_count == 1
+    assert mock_conn.execute.call_args.args[1][0] == [uid]
+
+@patch("app.database.get_db_connection")
+def test_update_tickets_status_single_statement(mock_connect):
+    mock_conn, mock_cur = mock_db(mock_connect)
+    mine, foreign = uuid4(), uuid4()
+    mock_cur.fetchall.return_value = [{"ticketUid": mine, "username": "TestUser"}]
+
+    result = asyncio.run(update_tickets_status([
+        (mine, "TestUser", "CANCELED"),
+        (foreign, "TestUser", "CANCELED"),
+    ]))
+
+    assert result == [True, False]
+    assert mock_conn.execute.call_count == 1
+    assert mock_conn.execute.call_args.args[1] == (
+        [mine, foreign], ["TestUser", "TestUser"], ["CANCELED", "CANCELED"]
+    )
 
 @patch("app.database.get_db_connection")
 def test_update_ticket_status_success(mock_connect):
-    mock_conn = MagicMock()
-    mock_cur = MagicMock()
-    mock_connect.return_value = mock_conn
-    mock_conn.cursor.return_value = mock_cur
+    mock_conn, mock_cur = mock_db(mock_connect)
     mock_cur.rowcount = 1
-    
-    result = update_ticket_status(str(uuid4()), "TestUser", "CANCELED")
+
+    result = asyncio.run(update_ticket_status(str(uuid4()), "TestUser", "CANCELED"))
     assert result is True
 
 @patch("app.database.get_db_connection")
 def test_get_ticket_by_uid_not_found(mock_connect):
-    mock_conn = MagicMock()
-    mock_cur = MagicMock()
-    mock_connect.return_value = mock_conn
-    mock_conn.cursor.return_value = mock_cur
+    mock_conn, mock_cur = mock_db(mock_connect)
     mock_cur.fetchone.return_value = None
-    
-    result = get_ticket_by_uid_and_user(str(uuid4()), "User")
-    assert result is None
\ No newline at end of file
+
+    result = asyncio.run(get_ticket_by_uid_and_user(str(uuid4()), "User"))
+    assert result is None
+
+
+@patch("app.database.get_db_connection")
+def test_stream_user_tickets_uses_server_cursor(mock_connect):
+    mock_conn, _ = mock_db(mock_connect)
+    server_cur = MagicMock()
+    mock_conn.cursor.return_value.__aenter__.return_value = server_cur
+    server_cur.execute = AsyncMock()
+    server_cur.fetchmany = AsyncMock(side_effect=[[{"price": 1}, {"price": 2}], [{"price": 3}], []])
+
+    async def collect():
+        return [batch async for batch in stream_user_tickets("TestUser", "PAID", batch_size=2)]
+
+    batches = asyncio.run(collect())
+
+    assert batches == [[{"price": 1}, {"price": 2}], [{"price": 3}]]
+    assert mock_conn.cursor.call_args.kwargs["name"]
+    server_cur.fetchmany.assert_called_with(2)
+    query, params = server_cur.execute.call_args.args
+    assert "ORDER BY id" in query
+    assert params == ["TestUser", "PAID"]
+    assert not mock_conn.execute.called
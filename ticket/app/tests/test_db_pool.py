@@ -0,0 +1,42 @@
+from psycopg.rows import dict_row
+from app.db_pool import create_pool, pool_stats
+
+
+def test_pool_settings_from_env(monkeypatch):
+    monkeypatch.setenv("DB_POOL_MIN_SIZE", "2")
+    monkeypatch.setenv("DB_POOL_MAX_SIZE", "7")
+    monkeypatch.setenv("DB_POOL_MAX_LIFETIME", "60")
+    monkeypatch.setenv("DB_POOL_HEALTH_CHECK", "false")
+
+    pool = create_pool({"host": "db", "dbname": "flights", "port": None}, name="test")
+
+    assert (pool.min_size, pool.max_size, pool.max_lifetime) == (2, 7, 60)
+    assert pool.kwargs["row_factory"] is dict_row
+    assert pool.kwargs["prepare_threshold"] == 0
+    assert "port" not in pool.kwargs
+    assert pool._check is None
+    assert pool.closed
+
+
+def test_pool_stats_mapping():
+    class FakePool:
+        max_size = 10
+
+        def get_stats(self):
+            return {
+                "pool_max": 10,
+                "pool_size": 4,
+                "pool_available": 1,
+                "requests_num": 8,
+                "requests_wait_ms": 400,
+                "requests_errors": 1,
+                "connections_num": 4,
+            }
+
+    stats = pool_stats(FakePool())
+
+    assert stats["in_use"] == 3
+    assert stats["idle"] == 1
+    assert stats["checkouts"] == 8
+    assert stats["wait_time_avg"] == 0.05
+    assert stats["checkout_timeouts"] == 1
@@ -1,3 +1,4 @@
+import json
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch
@@ -11,6 +12,11 @@ def test_manage_health():
     assert response.status_code == 200
     assert response.json() == {}
 
+def test_manage_pool():
+    response = client.get("/manage/pool")
+    assert response.status_code == 200
+    assert {"checkouts", "in_use", "idle", "wait_time_avg"} <= response.json().keys()
+
 @patch("app.main.get_user_tickets")
 def test_get_tickets_api(mock_db):
     uid = uuid4()
@@ -22,21 +28,98 @@ def test_get_tickets_api(mock_db):
     assert response.status_code == 200
     assert response.json()[0]["ticketUid"] == str(uid)
 
+@patch("app.main.get_user_tickets")
+def test_get_tickets_page_and_projection(mock_db):
+    mock_db.side_effect = lambda *args: [
+        {"id": 9, "flightNumber": "A101"},
+        {"id": 7, "flightNumber": "A102"},
+    ]
+    headers = {"x-user-name": "TestUser"}
+    response = client.get("/tickets?status=PAID&limit=2&fields=flightNumber", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json() == [{"flightNumber": "A101"}, {"flightNumber": "A102"}]
+    cursor = response.headers["X-Next-Cursor"]
+
+    client.get(f"/tickets?limit=2&cursor={cursor}", headers=headers)
+    mock_db.assert_called_with("TestUser", None, 2, 7, None)
+
+@patch("app.main.stream_user_tickets")
+def test_export_tickets_ndjson(mock_stream):
+    uid = uuid4()
+
+    async def batches(*args):
+        yield [{"ticketUid": uid, "flightNumber": "A101", "price": 100, "status": "PAID"}]
+        yield [{"ticketUid": uid, "flightNumber": "A102", "price": 200, "status": "CANCELED"}]
+
+    mock_stream.side_effect = batches
+    response = client.get("/tickets/export?status=PAID", headers={"x-user-name": "TestUser"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["flightNumber"] for line in lines] == ["A101", "A102"]
+    assert lines[0]["ticketUid"] == str(uid)
+    mock_stream.assert_called_once_with("TestUser", "PAID")
+
+def test_get_tickets_bad_params():
+    headers = {"x-user-name": "TestUser"}
+    assert client.get("/tickets?fields=password", headers=headers).status_code == 400
+    assert client.get("/tickets?cursor=%21%21", headers=headers).status_code == 400
+
 @patch("app.main.create_new_ticket")
 def test_create_ticket_api(mock_db):
     uid = uuid4()
-    mock_db.return_value = {
-        "ticketUid": uid, "flightNumber": "A101", "price": 100, "status": "PAID"
-    }
+    ticket = {"ticketUid": uid, "flightNumber": "A101", "price": 100, "status": "PAID"}
+    mock_db.return_value = (True, ticket)
     payload = {
         "flightNumber": "A101",
         "price": 100,
         "username": "TestUser"
     }
     response = client.post("/tickets", json=payload)
-    assert response.status_code == 200
+    assert response.status_code == 201
     assert response.json()["ticketUid"] == str(uid)
 
+    # Повтор с тем же uid отличается от создания только кодом
+    mock_db.return_value = (False, ticket)
+    assert client.post("/tickets", json=payload).status_code == 200
+
+    mock_db.return_value = (False, None)
+    assert client.post("/tickets", json=payload).status_code == 409
+
+
+@patch("app.main.create_new_tickets")
+def test_create_tickets_batch_api(mock_db):
+    uid = uuid4()
+    ticket = {"ticketUid": uid, "flightNumber": "A101", "price": 100, "status": "PAID"}
+    mock_db.return_value = [(True, ticket), (False, ticket), (False, None)]
+    item = {"flightNumber": "A101", "price": 100, "username": "TestUser", "uuid": str(uid)}
+
+    response = client.post("/tickets:batch", json={"items": [item, item, item]})
+
+    assert response.status_code == 200
+    assert [r["code"] for r in response.json()["items"]] == [201, 200, 409]
+    assert response.json()["items"][0]["ticket"]["ticketUid"] == str(uid)
+    assert mock_db.call_args.args[0][0] == ("TestUser", "A101", 100, uid)
+
+@patch("app.main.update_tickets_status")
+def test_patch_tickets_batch_api(mock_db):
+    mock_db.return_value = [True, False]
+    items = [
+        {"ticketUid": str(uuid4()), "username": "TestUser", "status": "CANCELED"}
+        for _ in range(2)
+    ]
+
+    response = client.patch("/tickets:batch", json={"items": items})
+
+    assert response.status_code == 200
+    assert response.json()["items"] == [{"code": 204}, {"code": 404, "detail": "Ticket not found"}]
+
+def test_batch_size_is_limited():
+    item = {"flightNumber": "A101", "price": 100, "username": "TestUser"}
+    assert client.post("/tickets:batch", json={"items": []}).status_code == 422
+    assert client.post("/tickets:batch", json={"items": [item] * 1001}).status_code == 422
 
 @patch("app.main.get_ticket_by_uid_and_user")
 def test_get_single_ticket_success(mock_db):
@@ -46,4 +129,15 @@ def test_get_single_ticket_success(mock_db):
     }
     response = client.get(f"/tickets/{uid}?username=TestUser")
     assert response.status_code == 200
-    assert response.json()["ticketUid"] == str(uid)
\ No newline at end of file
+    assert response.json()["ticketUid"] == str(uid)
+
+
+def test_manage_metrics():
+    client.get("/manage/health")
+    response = client.get("/manage/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/manage/health",status="200"}' in body
+    assert 'db_query_duration_seconds_count{query="get_user_tickets"}' in body
+    assert "db_pool_in_use" in body
@@ -0,0 +1,96 @@
+"""Создание и отмена N билетов: N одиночных запросов против одного пакетного.
+
+Нужен запущенный ticket service с базой (например, docker compose up);
+билеты создаются под отдельным пользователем на каждый запуск и остаются
+в базе. Одиночные запросы идут с --concurrency параллельно, как у
+ночных заданий с пулом воркеров; пакетный - один POST и один PATCH
+/tickets:batch по MAX_BATCH_SIZE элементов.
+
+    cd ticket && python -m benchmarks.bench_batch --url http://localhost:8070
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+from app.schemas import MAX_BATCH_SIZE
+
+
+def tickets(username: str, count: int) -> list[dict]:
+    return [
+        {"flightNumber": "AFL031", "price": 1500, "username": username, "uuid": str(uuid.uuid4())}
+        for _ in range(count)
+    ]
+
+
+def batches(items: list, size: int = MAX_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def single(client: httpx.AsyncClient, items: list[dict], concurrency: int) -> tuple[float, float]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(method: str, path: str, payload: dict):
+        async with semaphore:
+            resp = await client.request(method, path, json=payload)
+            assert resp.status_code < 300, resp.status_code
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call("POST", "/tickets", item) for item in items))
+    created = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        call("PATCH", f"/tickets/{item['uuid']}", {"username": item["username"], "status": "CANCELED"})
+        for item in items
+    ))
+    return created, time.perf_counter() - started
+
+
+async def batch(client: httpx.AsyncClient, items: list[dict]) -> tuple[float, float]:
+    started = time.perf_counter()
+    for chunk in batches(items):
+        resp = await client.post("/tickets:batch", json={"items": chunk})
+        assert all(r["code"] == 201 for r in resp.json()["items"])
+    created = time.perf_counter() - started
+
+    updates = [
+        {"ticketUid": item["uuid"], "username": item["username"], "status": "CANCELED"}
+        for item in items
+    ]
+    started = time.perf_counter()
+    for chunk in batches(updates):
+        resp = await client.patch("/tickets:batch", json={"items": chunk})
+        assert all(r["code"] == 204 for r in resp.json()["items"])
+    return created, time.perf_counter() - started
+
+
+async def main(url: str, count: int, concurrency: int):
+    run = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        # Прогрев: соединения пула и подготовленные запросы в сервисе
+        await single(client, tickets(f"bench-warmup-{run}", 50), concurrency)
+        await batch(client, tickets(f"bench-warmup-{run}", 50))
+
+        results = {
+            f"single x{count}": await single(client, tickets(f"bench-single-{run}", count), concurrency),
+            "batch": await batch(client, tickets(f"bench-batch-{run}", count)),
+        }
+
+    print(f"{count} tickets, concurrency {concurrency}")
+    print(f"{'':>14}{'create, ms':>12}{'cancel, ms':>12}")
+    for name, (created, cancelled) in results.items():
+        print(f"{name:>14}{created * 1000:>12.1f}{cancelled * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8070")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.count, args.concurrency))
@@ -0,0 +1,4 @@
+-- Билеты пользователя: GET /tickets с заголовком X-User-Name
+-- Остаток неудачного CONCURRENTLY-построения (INVALID индекс) удаляется заранее
+DROP INDEX CONCURRENTLY IF EXISTS idx_ticket_username;
+CREATE INDEX CONCURRENTLY idx_ticket_username ON ticket (username);
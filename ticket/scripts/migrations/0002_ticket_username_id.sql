@@ -0,0 +1,5 @@
+-- Keyset-пагинация билетов пользователя: WHERE username = ? AND id < ? ORDER BY id DESC.
+-- Индекс по (username, id) покрывает и простой поиск по username, старый индекс удаляется
+DROP INDEX CONCURRENTLY IF EXISTS idx_ticket_username_id;
+CREATE INDEX CONCURRENTLY idx_ticket_username_id ON ticket (username, id);
+DROP INDEX CONCURRENTLY IF EXISTS idx_ticket_username;